@@ -1,140 +1,662 @@
 import os
 import random
 import time
-from datetime import datetime, date
+import threading
+import atexit
+import asyncio
+from datetime import date
 from supabase import create_client, Client
 import google.generativeai as genai
+from google.ai import generativelanguage as glm
+from google.api_core import exceptions as errores_google
 
 # Configuración de Supabase
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 
+# Configuración de seguridad para evitar bloqueos tontos
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+]
+
+# Cada cuánto se refresca la tabla local de candidatos desde Supabase (segundos)
+CACHE_TTL_SEGUNDOS = int(os.environ.get("AI_CACHE_TTL", 60))
+
+# Contabilidad de uso por lotes: se vuelca cada N segundos o cada N llamadas
+FLUSH_USO_SEGUNDOS = int(os.environ.get("AI_USO_FLUSH_SEGUNDOS", 10))
+FLUSH_USO_LLAMADAS = int(os.environ.get("AI_USO_FLUSH_LLAMADAS", 20))
+
+# Estrategia de selección de llave por defecto (ver ESTRATEGIAS_SELECCION)
+ESTRATEGIA_DEFAULT = os.environ.get("AI_ESTRATEGIA", "holgura")
+
+# Suavizado de las métricas medidas por modelo (media móvil exponencial)
+ALFA_METRICAS = 0.2
+LATENCIA_DESCONOCIDA_MS = 2000
+
+# Limitador por llave/modelo (token bucket en Postgres, compartido por todas las máquinas)
+RPM_DEFAULT = int(os.environ.get("AI_RPM_DEFAULT", 15))
+TPM_DEFAULT = int(os.environ.get("AI_TPM_DEFAULT", 1000000))
+TOKENS_ESTIMADOS_DEFAULT = 1500
+ESPERA_MAXIMA_SEGUNDOS = float(os.environ.get("AI_ESPERA_MAXIMA", 30))
+# Peticiones que se reservan por RPC y se gastan en memoria (máx. rpm/4 por bloque);
+# lo que no se gasta en CUPO_BLOQUE_TTL segundos se descarta
+CUPO_BLOQUE = int(os.environ.get("AI_CUPO_BLOQUE", 5))
+CUPO_BLOQUE_TTL = float(os.environ.get("AI_CUPO_BLOQUE_TTL", 10))
+BACKOFF_BASE_SEGUNDOS = 5
+BACKOFF_MAXIMO_SEGUNDOS = 300
+
+# Ejecución asíncrona por lotes (generate_many)
+CONCURRENCIA_IA = int(os.environ.get("AI_CONCURRENCIA", 8))
+REINTENTOS_LOTE = 2
+TOKENS_SALIDA_ESTIMADOS = 800
+
+# =========================================================================
+#  CLIENTE POR LLAVE EN EL SDK DE GEMINI
+#  google-generativeai no expone un constructor con cliente propio: el modelo
+#  usa `_client` / `_async_client` si están puestos y si no cae al cliente
+#  GLOBAL de genai.configure (otra llave). Por eso el SDK va fijado en
+#  requirements.txt y aquí se verifica que esos atributos sigan existiendo:
+#  si una actualización los quita, fallamos fuerte en vez de mandar la
+#  llamada por la llave equivocada (ver tests/test_sdk_gemini.py).
+# =========================================================================
+ATRIBUTOS_CLIENTE_SDK = ('_client', '_async_client')
+
+def atar_cliente(model, cliente=None, cliente_async=None):
+    """ Ata el modelo a los clientes de UNA llave. Lanza si el SDK ya no los respeta. """
+    faltan = [a for a in ATRIBUTOS_CLIENTE_SDK if not hasattr(model, a)]
+    if faltan:
+        raise RuntimeError(
+            f"google-generativeai {getattr(genai, '__version__', '?')} no tiene {faltan}: "
+            "no se puede aislar la llave por modelo. Revisar la versión fijada en requirements.txt."
+        )
+    if cliente is not None: model._client = cliente
+    if cliente_async is not None: model._async_client = cliente_async
+    return model
+
+# Errores que dicen algo de la LLAVE o del servicio (cuota, 429, red, llave o modelo
+# inválidos): esos se reportan al limitador y se reintenta con otra llave. Lo demás
+# (respuesta bloqueada por seguridad -> ValueError en .text, prompt inválido -> 400)
+# es del CONTENIDO: otra llave daría lo mismo, así que ni se penaliza ni se reintenta.
+ERRORES_DE_LLAVE = (
+    errores_google.ResourceExhausted, errores_google.TooManyRequests,
+    errores_google.ServiceUnavailable, errores_google.InternalServerError,
+    errores_google.GatewayTimeout, errores_google.DeadlineExceeded,
+    errores_google.Unauthenticated, errores_google.PermissionDenied,
+    errores_google.NotFound, errores_google.RetryError,
+    asyncio.TimeoutError, ConnectionError,
+)
+
+def estimar_tokens(prompt):
+    """ Estimación barata (~4 caracteres por token) + lo que suele responder el modelo. """
+    return len(prompt) // 4 + TOKENS_SALIDA_ESTIMADOS
+
+# =========================================================================
+#  LIMITADOR RPM/TPM (TOKEN BUCKET) EN POSTGRES (migraciones/011)
+#  Los cubos viven en ai_rate_buckets, junto a incrementar_uso_ia: todas las
+#  máquinas y procesos (web, orquestador, cada VM) comparten el mismo cupo.
+#  El backoff de 429 también está ahí y se levanta cuando incrementar_uso_ia
+#  anota éxitos de ese modelo. Si la DB no responde, dejamos pasar la llamada:
+#  el 429 de Google vuelve a frenar por report_failure.
+#  El cupo se reserva por bloques (migraciones/016): un RPC trae varias
+#  peticiones y las siguientes se gastan en memoria, sin ir a la DB.
+# =========================================================================
+class LimitadorTokens:
+    def __init__(self, tamano_bloque=CUPO_BLOQUE, ttl_bloque=CUPO_BLOQUE_TTL):
+        self.tamano_bloque = tamano_bloque
+        self.ttl_bloque = ttl_bloque
+        # model_id -> [peticiones, tokens, vence (monotonic)] ya cobrados al cubo
+        self._bloques = {}
+        self._lock = threading.Lock()
+
+    def _gastar_local(self, model_id, tokens):
+        with self._lock:
+            bloque = self._bloques.get(model_id)
+            if not bloque or bloque[2] <= time.monotonic(): return False
+            if bloque[0] < 1 or bloque[1] < tokens: return False
+            bloque[0] -= 1
+            bloque[1] -= tokens
+            return True
+
+    def intentar(self, model_id, rpm, tpm, tokens):
+        """
+        Gasta 1 petición + `tokens` del bloque local; si no alcanza, reserva otro
+        bloque del cubo compartido (1 RPC). Devuelve 0 si pasó, o los segundos a esperar.
+        """
+        model_id = str(model_id)
+        if self._gastar_local(model_id, tokens): return 0
+
+        # Con rpm bajos el bloque se achica: no acaparar el cupo de las otras máquinas
+        cantidad = max(1, min(self.tamano_bloque, int(rpm) // 4))
+        try:
+            respuesta = supabase.rpc('reservar_cupo_ia', {
+                'p_model_id': model_id, 'p_rpm': int(rpm), 'p_tpm': int(tpm),
+                'p_tokens': int(tokens), 'p_cantidad': cantidad
+            }).execute()
+            fila = (respuesta.data or [{}])[0]
+        except Exception as e:
+            print(f"Error consultando limitador de IA: {e}")
+            return 0
+
+        concedidas = int(fila.get('concedidas') or 0)
+        if not concedidas:
+            return float(fila.get('espera') or 0)
+
+        # Una se usa ya; el resto queda en memoria (la DB cobró LEAST(tokens, tpm) por cada una)
+        por_peticion = min(int(tokens), int(tpm))
+        with self._lock:
+            self._bloques[model_id] = [concedidas - 1, (concedidas - 1) * por_peticion,
+                                       time.monotonic() + self.ttl_bloque]
+        return 0
+
+    def penalizar(self, model_id):
+        """ 429 transitorio: backoff exponencial corto (5s, 10s, 20s... máx 5 min). Suelta el bloque local. """
+        with self._lock:
+            self._bloques.pop(str(model_id), None)
+        respuesta = supabase.rpc('penalizar_ia', {
+            'p_model_id': str(model_id), 'p_base': BACKOFF_BASE_SEGUNDOS, 'p_maximo': BACKOFF_MAXIMO_SEGUNDOS
+        }).execute()
+        return float(respuesta.data or BACKOFF_BASE_SEGUNDOS)
+
+# =========================================================================
+#  ESTRATEGIAS DE SELECCIÓN: (candidatos, metricas) -> candidato
+#  `metricas` es model_id -> {"latencia_ms", "tasa_error", "ultimo_uso"}
+# =========================================================================
+def _holgura(item):
+    """ Cupo que le queda al modelo hoy antes del margen de seguridad. """
+    return max(item['daily_limit'] - item['safety_margin'] - (item['usage_today'] or 0), 0)
+
+def seleccion_aleatoria(candidatos, metricas):
+    """ Comportamiento original: uniforme entre los que tienen cupo. """
+    return random.choice(candidatos)
+
+def seleccion_por_holgura(candidatos, metricas):
+    """ Sorteo ponderado por cupo restante (y castigado por tasa de error): las llaves grandes trabajan más. """
+    pesos = [_holgura(c) * (1 - metricas.get(c['id'], {}).get('tasa_error', 0)) for c in candidatos]
+    if sum(pesos) <= 0: return random.choice(candidatos)
+    return random.choices(candidatos, weights=pesos, k=1)[0]
+
+def seleccion_lru(candidatos, metricas):
+    """ La que lleva más tiempo sin usarse. """
+    return min(candidatos, key=lambda c: metricas.get(c['id'], {}).get('ultimo_uso', 0))
+
+def seleccion_por_latencia(candidatos, metricas):
+    """ Ponderado por cupo, salud y velocidad medida: holgura * (1 - error) / latencia. """
+    pesos = []
+    for c in candidatos:
+        m = metricas.get(c['id'], {})
+        latencia = m.get('latencia_ms') or LATENCIA_DESCONOCIDA_MS
+        pesos.append(_holgura(c) * (1 - m.get('tasa_error', 0)) / max(latencia, 1))
+    if sum(pesos) <= 0: return random.choice(candidatos)
+    return random.choices(candidatos, weights=pesos, k=1)[0]
+
+ESTRATEGIAS_SELECCION = {
+    "aleatoria": seleccion_aleatoria,
+    "holgura": seleccion_por_holgura,
+    "lru": seleccion_lru,
+    "latencia": seleccion_por_latencia,
+}
+
 class AIManager:
-    def __init__(self):
-        pass
+    def __init__(self, ttl_cache=CACHE_TTL_SEGUNDOS, estrategia=ESTRATEGIA_DEFAULT):
+        # --- CACHÉ DE CANDIDATOS (en memoria del proceso) ---
+        # model_id -> fila de ai_models (con ai_vault) + uso local acumulado
+        self.ttl_cache = ttl_cache
+        self._candidatos = {}
+        self._ultima_carga = 0
+        self._lock = threading.Lock()
+        self._lock_carga = threading.Lock()
+        self._refresco_forzado = threading.Event()
+        self._hilo_refresco = None
+
+        # --- ACUMULADOR DE USO (model_id -> incrementos aún no enviados) ---
+        self._uso_pendiente = {}
+        self._uso_en_vuelo = {}
+        self._llamadas_pendientes = 0
+        self._lock_uso = threading.Lock()
+        self._flush_forzado = threading.Event()
+        self._hilo_flush = None
+        atexit.register(self.flush_usage)
+
+        # --- POOL DE MODELOS: (api_key, model_name) -> GenerativeModel listo ---
+        # Cada modelo lleva SU PROPIO cliente con su llave: nada de genai.configure global
+        self._pool_modelos = {}
+        self._clientes_por_llave = {}
+        self._lock_pool = threading.Lock()
+        self.metricas_pool = {"hits": 0, "misses": 0}
+
+        # --- ESTRATEGIA DE SELECCIÓN + MÉTRICAS MEDIDAS POR MODELO ---
+        # Acepta el nombre de una estrategia registrada o una función propia
+        self.estrategia = ESTRATEGIAS_SELECCION.get(estrategia, seleccion_por_holgura) if isinstance(estrategia, str) else estrategia
+        self._metricas = {}
+        # Momento en que se entregó cada modelo en ESTE hilo (para medir latencia sin tocar a los trabajadores)
+        self._entregas = threading.local()
+
+        # --- LIMITADOR RPM/TPM COMPARTIDO ENTRE MÁQUINAS (Postgres) ---
+        self.limitador = LimitadorTokens()
+
+        # --- MOTOR ASYNC: un event loop propio en un hilo (los clientes gRPC async viven ahí) ---
+        self._loop = None
+        self._semaforo = None
+        self._clientes_async = {}
+        self._lock_loop = threading.Lock()
         
-    def get_optimal_model(self, task_type="general"):
+    def get_optimal_model(self, task_type="general", tokens_estimados=TOKENS_ESTIMADOS_DEFAULT):
         """
         Busca la mejor IA disponible. Si falla la gratuita, busca la paga.
+        Si las gratuitas tienen cupo pero están frenadas por RPM/TPM, esperamos
+        un poco (máx AI_ESPERA_MAXIMA) en vez de saltar a la reserva paga.
         """
-        # 1. Buscamos modelos (FREE primero)
-        candidate = self._find_available_key(task_type, account_tier='FREE')
-        
-        # 2. Si no hay gratis, buscamos PAGAS
-        if not candidate:
-            print("⚠️ No hay cuentas GRATIS disponibles. Buscando en RESERVA (PAID)...")
-            candidate = self._find_available_key(task_type, account_tier='PAID')
-            
-        if not candidate:
-            raise Exception("❌ ERROR CRÍTICO: Todas las IAs están ocupadas o muertas por hoy.")
+        candidate = self._seleccionar_candidato(task_type, tokens_estimados)
 
-        # 3. Configuramos la IA
-        api_key = candidate['ai_vault']['api_key']
-        model_name = candidate['model_name']
-        
-        genai.configure(api_key=api_key)
-        
-        # Configuración de seguridad para evitar bloqueos tontos
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-        ]
-        
-        model = genai.GenerativeModel(model_name, safety_settings=safety_settings)
+        # Tomamos la IA del pool (ya configurada con su llave)
+        model = self._modelo_desde_pool(candidate['ai_vault']['api_key'], candidate['model_name'])
         
-        print(f"✅ Cerebro Asignado: {model_name} (ID: {candidate['id']})")
+        self._marcar_entrega(candidate['id'])
+        print(f"✅ Cerebro Asignado: {candidate['model_name']} (ID: {candidate['id']})")
         
         # Retornamos modelo y ID para reportar éxito o fallo
         return model, candidate['id']
 
-    def _find_available_key(self, task_type, account_tier):
-        try:
-            # Traemos la lista de modelos candidatos
-            response = supabase.table('ai_models').select(
-                'id, model_name, usage_today, daily_limit, safety_margin, last_usage_date, ai_vault!inner(api_key, owner_email, account_type, is_active)'
-            ).eq('ai_vault.is_active', True)\
-             .eq('ai_vault.account_type', account_tier)\
-             .filter('purpose', 'in', f'("general","{task_type}")')\
-             .execute()
+    def _seleccionar_candidato(self, task_type, tokens_estimados):
+        """ FREE -> (espera corta si solo es límite de velocidad) -> PAID. Lanza excepción si no hay nada. """
+        limite_espera = time.monotonic() + ESPERA_MAXIMA_SEGUNDOS
+        while True:
+            # 1. Buscamos modelos (FREE primero)
+            candidate, espera = self._find_available_key(task_type, account_tier='FREE', tokens_estimados=tokens_estimados)
             
-            valid_candidates = []
-            hoy_str = str(date.today()) 
+            # 2. Si no hay gratis CON CUPO, buscamos PAGAS
+            if not candidate and espera is None:
+                print("⚠️ No hay cuentas GRATIS disponibles. Buscando en RESERVA (PAID)...")
+                candidate, espera = self._find_available_key(task_type, account_tier='PAID', tokens_estimados=tokens_estimados)
             
-            for item in response.data:
-                fecha_guardada = item.get('last_usage_date')
-                uso_actual = item['usage_today']
+            if candidate: break
+            if espera is None:
+                raise Exception("❌ ERROR CRÍTICO: Todas las IAs están ocupadas o muertas por hoy.")
+            
+            # 3. Todas frenadas un momento: respiro corto hasta el próximo token
+            restante = limite_espera - time.monotonic()
+            if restante <= 0:
+                raise Exception("❌ ERROR CRÍTICO: Todas las IAs están frenadas por límite de velocidad (429).")
+            time.sleep(min(max(espera, 0.05), restante))
+        return candidate
+
+    def _modelo_desde_pool(self, api_key, model_name):
+        """
+        Reutiliza el GenerativeModel de (api_key, model_name). Si no existe, lo crea
+        atado a un cliente propio de esa llave, así hilos concurrentes nunca se pisan la llave.
+        """
+        clave = (api_key, model_name)
+        with self._lock_pool:
+            model = self._pool_modelos.get(clave)
+            if model is not None:
+                self.metricas_pool["hits"] += 1
+                return model
+            self.metricas_pool["misses"] += 1
+
+            cliente = self._clientes_por_llave.get(api_key)
+            if cliente is None:
+                cliente = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+                self._clientes_por_llave[api_key] = cliente
+
+            model = atar_cliente(genai.GenerativeModel(model_name, safety_settings=SAFETY_SETTINGS), cliente=cliente)
+            self._pool_modelos[clave] = model
+            return model
+
+    def modelo_para_llave(self, api_key, model_name):
+        """ Modelo del pool atado a una llave fija (ej: GOOGLE_API_KEY del chat del dashboard). """
+        return self._modelo_desde_pool(api_key, model_name)
+
+    def estadisticas_pool(self):
+        """ Métricas del pool para el monitor de admin. """
+        with self._lock_pool:
+            total = self.metricas_pool["hits"] + self.metricas_pool["misses"]
+            return {
+                "modelos": len(self._pool_modelos),
+                "llaves": len(self._clientes_por_llave),
+                "hits": self.metricas_pool["hits"],
+                "misses": self.metricas_pool["misses"],
+                "hit_rate": round(self.metricas_pool["hits"] / total, 3) if total else 0,
+            }
+
+    def _find_available_key(self, task_type, account_tier, tokens_estimados=TOKENS_ESTIMADOS_DEFAULT):
+        """
+        Elige un candidato desde la caché local (cupo diario) y lo pasa por el limitador.
+        La caché se recarga en segundo plano cada `ttl_cache` segundos.
+        Siempre devuelve (candidato, espera): espera=None significa "nadie con cupo
+        diario"; un número, "reintentar en X segundos".
+        """
+        descartados = []
+        espera_minima = None
+        while True:
+            elegido = self._elegir_con_cupo(task_type, account_tier, descartados)
+            if not elegido:
+                return None, espera_minima
+            espera = self.limitador.intentar(
+                elegido['id'],
+                elegido.get('rpm_limit') or RPM_DEFAULT,
+                elegido.get('tpm_limit') or TPM_DEFAULT,
+                tokens_estimados
+            )
+            if not espera:
+                return elegido, None
+            descartados.append(elegido['id'])
+            espera_minima = espera if espera_minima is None else min(espera_minima, espera)
+
+    def _elegir_con_cupo(self, task_type, account_tier, excluidos):
+        self._asegurar_cache()
+        hoy_str = str(date.today())
+        
+        with self._lock:
+            valid_candidates = []
+            for item in self._candidatos.values():
+                if item['ai_vault'].get('account_type') != account_tier: continue
+                if item['id'] in excluidos: continue
+                if item.get('purpose') not in ("general", task_type): continue
                 
-                # --- AUTO-LIMPIEZA DIARIA ---
-                if fecha_guardada != hoy_str:
-                    print(f"🔄 Nuevo día detectado para {item['model_name']}. Reseteando contador en DB...")
-                    try:
-                        supabase.table('ai_models').update({
-                            'usage_today': 0,
-                            'last_usage_date': hoy_str
-                        }).eq('id', item['id']).execute()
-                        uso_actual = 0
-                    except Exception as e_reset:
-                        print(f"⚠️ Error intentando resetear fecha en DB: {e_reset}")
+                # --- AUTO-LIMPIEZA DIARIA (solo local; en la DB el rollover lo hace el servidor) ---
+                if item.get('last_usage_date') != hoy_str:
+                    item['usage_today'] = 0
+                    item['last_usage_date'] = hoy_str
                 
                 # --- VERIFICACIÓN DE LÍMITES ---
                 limite_seguro = item['daily_limit'] - item['safety_margin']
                 
-                if uso_actual < limite_seguro:
+                if item['usage_today'] < limite_seguro:
                     valid_candidates.append(item)
             
             if valid_candidates:
-                return random.choice(valid_candidates)
+                elegido = self.estrategia(valid_candidates, self._metricas)
+                self._metricas.setdefault(elegido['id'], {})['ultimo_uso'] = time.monotonic()
+                return elegido
             return None
 
+    # =========================================================================
+    #  MÉTRICAS MEDIDAS: latencia y tasa de error por modelo
+    # =========================================================================
+    def _marcar_entrega(self, model_id):
+        if not hasattr(self._entregas, 'inicio'): self._entregas.inicio = {}
+        self._entregas.inicio[model_id] = time.monotonic()
+
+    def _medir(self, model_id, exito, latencia_ms=None):
+        """ Actualiza latencia (solo en éxito) y tasa de error con media móvil. """
+        inicio = getattr(self._entregas, 'inicio', {}).pop(model_id, None)
+        if latencia_ms is None and inicio is not None:
+            latencia_ms = (time.monotonic() - inicio) * 1000
+        with self._lock:
+            m = self._metricas.setdefault(model_id, {})
+            m['tasa_error'] = (1 - ALFA_METRICAS) * m.get('tasa_error', 0) + ALFA_METRICAS * (0 if exito else 1)
+            if exito and latencia_ms is not None:
+                previa = m.get('latencia_ms')
+                m['latencia_ms'] = latencia_ms if previa is None else (1 - ALFA_METRICAS) * previa + ALFA_METRICAS * latencia_ms
+
+    def capacidad_restante(self, task_type=None):
+        """ Llamadas que aún caben HOY (todas las llaves, respetando el margen de seguridad). """
+        self._asegurar_cache()
+        with self._lock:
+            return sum(
+                _holgura(item) for item in self._candidatos.values()
+                if task_type is None or item.get('purpose') in ("general", task_type)
+            )
+
+    def metricas_modelos(self):
+        """ Copia de las métricas medidas (para diagnóstico). """
+        with self._lock:
+            return {model_id: dict(m) for model_id, m in self._metricas.items()}
+
+    # =========================================================================
+    #  CACHÉ DE CANDIDATOS: carga inicial + refresco en segundo plano
+    # =========================================================================
+    def _asegurar_cache(self):
+        """ Primera vez: carga síncrona. Después: solo despierta al refresco. """
+        if not self._ultima_carga:
+            with self._lock_carga:
+                if not self._ultima_carga:
+                    self._recargar_candidatos()
+        self._iniciar_refresco()
+        if time.time() - self._ultima_carga > self.ttl_cache:
+            self._refresco_forzado.set()
+
+    def _iniciar_refresco(self):
+        if self._hilo_refresco and self._hilo_refresco.is_alive(): return
+        with self._lock:
+            if self._hilo_refresco and self._hilo_refresco.is_alive(): return
+            self._hilo_refresco = threading.Thread(target=self._bucle_refresco, name="ai-cache-refresco", daemon=True)
+            self._hilo_refresco.start()
+
+    def _bucle_refresco(self):
+        while True:
+            self._refresco_forzado.wait(timeout=self.ttl_cache)
+            self._refresco_forzado.clear()
+            self._recargar_candidatos()
+
+    def _recargar_candidatos(self):
+        """ Una sola consulta para TODOS los tiers y propósitos. Reconciliamos con el uso local. """
+        try:
+            # '*' incluye rpm_limit/tpm_limit si existen (migraciones/002); si no, usamos los defaults
+            response = supabase.table('ai_models').select(
+                '*, ai_vault!inner(api_key, owner_email, account_type, is_active)'
+            ).eq('ai_vault.is_active', True).execute()
         except Exception as e:
             print(f"Error consultando DB de IA: {e}")
-            return None
+            # Evitamos martillar la DB si está caída: reintentamos en el próximo ciclo
+            self._ultima_carga = self._ultima_carga or time.time()
+            return
 
-    def register_usage(self, model_id):
-        """ Registra éxito: Suma +1 """
-        try:
-            hoy_str = str(date.today())
-            data = supabase.table('ai_models').select('usage_today, last_usage_date').eq('id', model_id).single().execute()
-            if not data.data: return
+        hoy_str = str(date.today())
+        nuevos = {}
+        for item in response.data:
+            # --- DÍA NUEVO: solo en memoria. La DB NO se toca desde aquí: el rollover
+            # lo hace incrementar_uso_ia en el servidor (migraciones/001); escribir un 0
+            # desde un proceso atrasado borraría lo que otros ya sumaron hoy.
+            if item.get('last_usage_date') != hoy_str:
+                item['usage_today'] = 0
+                item['last_usage_date'] = hoy_str
+            nuevos[item['id']] = item
 
-            stored_date = data.data.get('last_usage_date')
-            current_usage = data.data.get('usage_today', 0)
-            
-            new_usage = 1 if stored_date != hoy_str else current_usage + 1
-            
-            supabase.table('ai_models').update({
-                'usage_today': new_usage,
-                'last_usage_date': hoy_str
-            }).eq('id', model_id).execute()
-            
+        with self._lock_uso:
+            # Lo nuestro que la DB todavía no ve: acumulado + lote en vuelo del flush
+            sin_volcar = dict(self._uso_pendiente)
+            for model_id, cantidad in self._uso_en_vuelo.items():
+                sin_volcar[model_id] = sin_volcar.get(model_id, 0) + cantidad
+
+        with self._lock:
+            # La DB manda (un admin puede desbloquear o bajar el uso a mano);
+            # solo le sumamos lo que este proceso aún no volcó
+            for model_id, item in nuevos.items():
+                item['usage_today'] = (item['usage_today'] or 0) + sin_volcar.get(model_id, 0)
+            self._candidatos = nuevos
+            self._ultima_carga = time.time()
+
+    def _sumar_uso_local(self, model_id, cantidad):
+        with self._lock:
+            item = self._candidatos.get(model_id)
+            if item:
+                item['usage_today'] = (item['usage_today'] or 0) + cantidad
+                item['last_usage_date'] = str(date.today())
+
+    def _fijar_uso_local(self, model_id, uso):
+        with self._lock:
+            item = self._candidatos.get(model_id)
+            if item:
+                item['usage_today'] = uso
+                item['last_usage_date'] = str(date.today())
+
+    def register_usage(self, model_id, latencia_ms=None):
+        """ Registra éxito: Suma +1 (en memoria; se vuelca a la DB por lotes) """
+        self._medir(model_id, exito=True, latencia_ms=latencia_ms)
+        self._sumar_uso_local(model_id, 1)
+        with self._lock_uso:
+            self._uso_pendiente[model_id] = self._uso_pendiente.get(model_id, 0) + 1
+            self._llamadas_pendientes += 1
+            lleno = self._llamadas_pendientes >= FLUSH_USO_LLAMADAS
+        self._iniciar_flush()
+        if lleno:
+            self._flush_forzado.set()
+
+    def flush_usage(self):
+        """
+        Envía TODOS los incrementos acumulados en una sola RPC atómica.
+        El rollover diario lo resuelve la función en la DB (migraciones/001).
+        """
+        with self._lock_uso:
+            lote = self._uso_pendiente
+            if not lote: return
+            self._uso_pendiente = {}
+            self._uso_en_vuelo = lote
+            self._llamadas_pendientes = 0
+
+        try:
+            supabase.rpc('incrementar_uso_ia', {
+                'p_incrementos': {str(model_id): cantidad for model_id, cantidad in lote.items()}
+            }).execute()
+            with self._lock_uso:
+                self._uso_en_vuelo = {}
         except Exception as e:
             print(f"Error actualizando contador: {e}")
+            # Devolvemos el lote al acumulador para no perder uso
+            with self._lock_uso:
+                self._uso_en_vuelo = {}
+                for model_id, cantidad in lote.items():
+                    self._uso_pendiente[model_id] = self._uso_pendiente.get(model_id, 0) + cantidad
+                    self._llamadas_pendientes += cantidad
+
+    def _iniciar_flush(self):
+        if self._hilo_flush and self._hilo_flush.is_alive(): return
+        with self._lock_uso:
+            if self._hilo_flush and self._hilo_flush.is_alive(): return
+            self._hilo_flush = threading.Thread(target=self._bucle_flush, name="ai-uso-flush", daemon=True)
+            self._hilo_flush.start()
+
+    def _bucle_flush(self):
+        while True:
+            self._flush_forzado.wait(timeout=FLUSH_USO_SEGUNDOS)
+            self._flush_forzado.clear()
+            self.flush_usage()
 
     def report_failure(self, model_id, error_message=""):
-        """ SI FALLA: Bloqueo temporal o permanente """
+        """
+        SI FALLA:
+        - 404 / modelo inexistente -> bloqueo permanente.
+        - Cuota DIARIA agotada -> bloqueo por el resto del día.
+        - Cualquier otro (429 por minuto, timeouts...) -> backoff corto en el limitador.
+        """
+        self._medir(model_id, exito=False)
+        err_str = str(error_message).lower()
+        
+        es_permanente = "404" in err_str or "not found" in err_str
+        es_cuota_diaria = any(x in err_str for x in ["per day", "perday", "daily"])
+        
+        if not es_permanente and not es_cuota_diaria:
+            try:
+                espera = self.limitador.penalizar(model_id)
+                print(f"⏳ IA {model_id} frenada {espera:.0f}s (límite transitorio).")
+            except Exception as e:
+                print(f"Error reportando fallo de IA: {e}")
+            return
+        
         try:
             hoy_str = str(date.today())
-            err_str = str(error_message).lower()
             
-            data_limit = supabase.table('ai_models').select('daily_limit').eq('id', model_id).single().execute()
-            limite_diario = data_limit.data.get('daily_limit', 1000) if data_limit.data else 1000
+            # El límite ya está en caché; solo vamos a la DB si no lo conocemos
+            with self._lock:
+                en_cache = self._candidatos.get(model_id)
+                limite_diario = en_cache.get('daily_limit') if en_cache else None
+            if limite_diario is None:
+                data_limit = supabase.table('ai_models').select('daily_limit').eq('id', model_id).single().execute()
+                limite_diario = data_limit.data.get('daily_limit', 1000) if data_limit.data else 1000
             
-            nuevo_uso = limite_diario + 500 
+            nuevo_uso = 999999 if es_permanente else limite_diario + 500
             
-            if "404" in err_str or "not found" in err_str:
-                nuevo_uso = 999999 
+            # El modelo sale de la rotación local al instante
+            self._fijar_uso_local(model_id, nuevo_uso)
             
             supabase.table('ai_models').update({
                 'usage_today': nuevo_uso,
                 'last_usage_date': hoy_str
             }).eq('id', model_id).execute()
+
+            # Recién ahora refrescamos: un refresco anterior al UPDATE leería el uso
+            # viejo y devolvería el modelo a la rotación
+            self._refresco_forzado.set()
             
         except Exception as e:
             print(f"Error reportando fallo de IA: {e}")
 
+    # =========================================================================
+    #  EJECUCIÓN ASÍNCRONA POR LOTES: N prompts ≈ 1 latencia de IA
+    # =========================================================================
+    async def generate_many(self, prompts, task_type="general"):
+        """
+        Reparte los prompts entre las llaves disponibles con concurrencia acotada
+        (AI_CONCURRENCIA) y respetando el limitador RPM/TPM.
+        Devuelve en el MISMO orden: [{"texto": str|None, "error": str|None, "model_id": ...}, ...]
+        """
+        futuro = asyncio.run_coroutine_threadsafe(self._generar_lote(prompts, task_type), self._obtener_loop())
+        return await asyncio.wrap_future(futuro)
+
+    def run_many(self, prompts, task_type="general"):
+        """ Puente síncrono de generate_many para los trabajadores (que no viven en asyncio). """
+        futuro = asyncio.run_coroutine_threadsafe(self._generar_lote(prompts, task_type), self._obtener_loop())
+        return futuro.result()
+
+    def _obtener_loop(self):
+        with self._lock_loop:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="ai-async-loop", daemon=True).start()
+            return self._loop
+
+    async def _generar_lote(self, prompts, task_type):
+        if self._semaforo is None:
+            self._semaforo = asyncio.Semaphore(CONCURRENCIA_IA)
+        return await asyncio.gather(*[self._generar_uno(prompt, task_type) for prompt in prompts])
+
+    async def _generar_uno(self, prompt, task_type):
+        loop = asyncio.get_running_loop()
+        ultimo_error = None
+        async with self._semaforo:
+            for intento in range(REINTENTOS_LOTE + 1):
+                model_id = None
+                respuesta = None
+                try:
+                    # La selección puede esperar al limitador: la sacamos del loop
+                    candidate = await loop.run_in_executor(None, self._seleccionar_candidato, task_type, estimar_tokens(prompt))
+                    model_id = candidate['id']
+                    api_key = candidate['ai_vault']['api_key']
+                    model = self._modelo_desde_pool(api_key, candidate['model_name'])
+                    if model._async_client is None:
+                        atar_cliente(model, cliente_async=self._cliente_async(api_key))
+
+                    inicio = time.monotonic()
+                    respuesta = await model.generate_content_async(prompt)
+                    texto = respuesta.text
+                    self.register_usage(model_id, latencia_ms=(time.monotonic() - inicio) * 1000)
+                    return {"texto": texto, "error": None, "model_id": model_id}
+
+                except Exception as e:
+                    ultimo_error = str(e)
+                    if model_id is None:
+                        break # No hay IA disponible: no tiene sentido reintentar
+                    if not isinstance(e, ERRORES_DE_LLAVE):
+                        # Error del contenido: la llave está sana y otra daría lo mismo.
+                        # Si Google respondió (ej: bloqueo de seguridad), la llamada igual gastó cupo
+                        if respuesta is not None: self.register_usage(model_id)
+                        break
+                    await loop.run_in_executor(None, self.report_failure, model_id, ultimo_error)
+        return {"texto": None, "error": ultimo_error, "model_id": None}
+
+    def _cliente_async(self, api_key):
+        """ Cliente gRPC async por llave. Solo se llama desde el loop propio. """
+        cliente = self._clientes_async.get(api_key)
+        if cliente is None:
+            cliente = glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
+            self._clientes_async[api_key] = cliente
+        return cliente
+
     # =========================================================================
     #  NUEVA FUNCIÓN: Generar Respuesta para el Panel de Control (Chat Admin)
     # =========================================================================
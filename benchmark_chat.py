@@ -0,0 +1,101 @@
+import time
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from flask import Flask, request, jsonify
+
+# ==============================================================================
+#  BENCHMARK DE CHATS CONCURRENTES
+#  Lanza N "prospectos" chateando a la vez contra el servidor y mide cuántos
+#  atiende por segundo y con qué latencia.
+#
+#  Sin gastar cupo de IA: este mismo archivo trae una app mínima (`app`) con
+#  /api/bench/espera, que simula una llamada a Gemini. NO vive en main.py:
+#      gunicorn -c gunicorn.conf.py benchmark_chat:app                      # gthread (producción)
+#      gunicorn -c gunicorn.conf.py -k sync --threads 1 benchmark_chat:app  # comparar
+#      python benchmark_chat.py --url http://localhost:8080 --concurrencia 40
+#  Chat real del Nido contra main.py (necesita un access_token válido):
+#      python benchmark_chat.py --ruta nido --token <access_token> --concurrencia 20
+#
+#  Con sync la capacidad es ~1 chat a la vez por worker; con gthread, decenas.
+# ==============================================================================
+
+# --- APP DE BENCHMARK (solo se sirve a propósito, nunca en producción) ---
+app = Flask(__name__)
+
+@app.route('/api/bench/espera')
+def bench_espera():
+    """ Simula una llamada a Gemini que tarda `ms`: mide cuántos chats aguanta un worker. """
+    ms = min(int(request.args.get('ms', 3000)), 30000)
+    time.sleep(ms / 1000)
+    return jsonify({"ok": True, "ms": ms})
+
+def pedir(sesion, args):
+    inicio = time.perf_counter()
+    primer_byte = None
+    if args.ruta == "espera":
+        resp = sesion.get(f"{args.url}/api/bench/espera", params={"ms": args.ms}, timeout=args.timeout)
+        primer_byte = time.perf_counter()
+    else:
+        cuerpo = {"message": "Hola, ¿cuánto cuesta?", "token": args.token}
+        resp = sesion.post(f"{args.url}/api/chat-nido/stream", json=cuerpo, stream=True, timeout=args.timeout)
+        for _ in resp.iter_content(chunk_size=None):
+            if primer_byte is None: primer_byte = time.perf_counter()
+    fin = time.perf_counter()
+    return resp.status_code, (primer_byte or fin) - inicio, fin - inicio
+
+def percentil(valores, p):
+    if not valores: return 0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Capacidad de chats concurrentes por VM")
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--ruta", choices=["espera", "nido"], default="espera")
+    parser.add_argument("--token", help="access_token de un prospecto (ruta nido)")
+    parser.add_argument("--concurrencia", type=int, default=20)
+    parser.add_argument("--peticiones", type=int, default=100)
+    parser.add_argument("--ms", type=int, default=3000, help="Latencia simulada de Gemini (ruta espera)")
+    parser.add_argument("--timeout", type=int, default=120)
+    args = parser.parse_args()
+    if args.ruta == "nido" and not args.token:
+        parser.error("--ruta nido necesita --token")
+
+    sesion = requests.Session()
+    adaptador = requests.adapters.HTTPAdapter(pool_connections=args.concurrencia, pool_maxsize=args.concurrencia)
+    sesion.mount("http://", adaptador)
+    sesion.mount("https://", adaptador)
+
+    print(f"🚀 {args.peticiones} chats, {args.concurrencia} a la vez contra {args.url} ({args.ruta})")
+    inicio = time.perf_counter()
+    resultados, errores = [], 0
+    with ThreadPoolExecutor(max_workers=args.concurrencia) as pool:
+        futuros = [pool.submit(pedir, sesion, args) for _ in range(args.peticiones)]
+        for futuro in futuros:
+            try:
+                status, ttfb, total = futuro.result()
+                if status == 200: resultados.append((ttfb, total))
+                else: errores += 1
+            except requests.RequestException:
+                errores += 1
+    duracion = time.perf_counter() - inicio
+
+    totales = [r[1] for r in resultados]
+    primeros = [r[0] for r in resultados]
+    # Chats en el sistema = rendimiento * latencia media (ley de Little); incluye la cola.
+    # En la ruta espera el tiempo de servicio es conocido (`ms`): rendimiento * ms = atendidos de verdad
+    rendimiento = len(resultados) / duracion if duracion else 0
+    en_sistema = rendimiento * statistics.mean(totales) if totales else 0
+
+    print(f"✅ OK: {len(resultados)}  ❌ Errores: {errores}  ⏱️ {duracion:.1f}s")
+    print(f"📈 Rendimiento: {rendimiento:.2f} chats/s")
+    print(f"🧵 Chats en el servidor (atendidos + en cola): {en_sistema:.1f}")
+    if args.ruta == "espera":
+        print(f"🧵 Chats atendidos a la vez: {rendimiento * args.ms / 1000:.1f}")
+    print(f"⚡ Primer byte  p50 {percentil(primeros, 50):.2f}s  p95 {percentil(primeros, 95):.2f}s")
+    print(f"🏁 Respuesta    p50 {percentil(totales, 50):.2f}s  p95 {percentil(totales, 95):.2f}s")
+
+if __name__ == "__main__":
+    main()
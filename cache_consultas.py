@@ -0,0 +1,102 @@
+import os
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+
+# ==============================================================================
+#  CACHÉ DEL CEREBRO ARQUITECTO (chat de admin que escribe SQL)
+#  Nivel 1: pregunta normalizada -> SQL generado        (TTL largo: el esquema no cambia)
+#  Nivel 2: SQL -> respuesta narrada + huella de tablas (TTL corto)
+#  La "huella" son los contadores de escrituras de pg_stat_user_tables: si alguien
+#  insertó/actualizó en las tablas que consulta el Arquitecto, la huella cambia y
+#  la respuesta vieja se descarta aunque no haya vencido.
+#  `prospects` NO entra en la huella: los trabajadores la escriben cada segundo y
+#  la caché nunca acertaría. Las respuestas que la leen vencen por TTL propio.
+# ==============================================================================
+
+TTL_SQL_SEGUNDOS = int(os.environ.get("ARQUITECTO_CACHE_SQL_TTL", 24 * 3600))
+TTL_RESULTADOS_SEGUNDOS = int(os.environ.get("ARQUITECTO_CACHE_RESULTADOS_TTL", 300))
+MAX_ENTRADAS = 500
+
+# Tablas que el Arquitecto conoce (ver CerebroArquitecto.schema)
+TABLAS_VIGILADAS = ('clients', 'campaigns', 'finance_logs')
+# Alta rotación (el pipeline escribe sin parar): fuera de la huella, TTL corto
+TABLAS_ALTA_ROTACION = ('prospects',)
+TTL_ALTA_ROTACION_SEGUNDOS = int(os.environ.get("ARQUITECTO_CACHE_PROSPECTOS_TTL", 60))
+
+class CacheTTL:
+    """ LRU con vencimiento, segura entre hilos (gunicorn gthread). """
+    def __init__(self, ttl, maximo=MAX_ENTRADAS):
+        self.ttl = ttl
+        self.maximo = maximo
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.metricas = {"aciertos": 0, "fallos": 0}
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada and entrada[0] > time.monotonic():
+                self._datos.move_to_end(clave)
+                self.metricas["aciertos"] += 1
+                return entrada[1]
+            if entrada: del self._datos[clave]
+            self.metricas["fallos"] += 1
+            return None
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + self.ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+
+    def descartar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+def normalizar_pregunta(texto):
+    """ "¿Total de INGRESOS?" y "total de ingresos" caen en la misma entrada. """
+    texto = unicodedata.normalize('NFKD', texto or "").encode('ascii', 'ignore').decode('ascii')
+    texto = re.sub(r'[^a-z0-9 ]+', ' ', texto.lower())
+    return re.sub(r'\s+', ' ', texto).strip()
+
+def huella_tablas(conn, tablas=TABLAS_VIGILADAS):
+    """ Suma de inserts/updates/deletes registrados en las tablas vigiladas (una consulta barata). """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0)
+            FROM pg_stat_user_tables
+            WHERE relname = ANY(%s)
+        """, (list(tablas),))
+        huella = cur.fetchone()[0]
+    conn.rollback() # No dejar la conexión "idle in transaction"
+    return int(huella)
+
+def toca_alta_rotacion(sql, tablas=TABLAS_ALTA_ROTACION):
+    return any(re.search(rf'\b{t}\b', sql, re.IGNORECASE) for t in tablas)
+
+# Instancias del proceso (cada worker de gunicorn tiene las suyas)
+cache_sql = CacheTTL(TTL_SQL_SEGUNDOS)
+cache_resultados = CacheTTL(TTL_RESULTADOS_SEGUNDOS)
+
+def respuesta_vigente(sql, huella):
+    """ Respuesta guardada para esta SQL si la huella no cambió y no venció su TTL propio. """
+    previo = cache_resultados.obtener(sql)
+    if previo and previo["huella"] == huella and previo["vence"] > time.monotonic():
+        return previo["respuesta"]
+    return None
+
+def guardar_respuesta(sql, huella, respuesta):
+    ttl = TTL_ALTA_ROTACION_SEGUNDOS if toca_alta_rotacion(sql) else TTL_RESULTADOS_SEGUNDOS
+    cache_resultados.guardar(sql, {"huella": huella, "respuesta": respuesta, "vence": time.monotonic() + ttl})
+
+def invalidar_resultados():
+    """ Llamar tras escribir en las tablas vigiladas desde la web (ej: registrar gasto). """
+    cache_resultados.limpiar()
@@ -0,0 +1,120 @@
+import os
+import json
+import gzip
+import time
+import random
+import hashlib
+import logging
+import tempfile
+import contextlib
+import requests
+
+# ==============================================================================
+#  CACHÉ DE PÁGINAS WEB COMPARTIDA (Espía + Analista)
+#  El Espía baja la web del prospecto buscando emails y minutos después el
+#  Analista baja LA MISMA web para leer h1/h2/p. Con esta capa la segunda
+#  lectura sale del disco. Ambos corren en la misma VM que el Orquestador,
+#  así que un directorio local alcanza (no hace falta tocar Postgres).
+#
+#  Cada entrada es un .json.gz con {url, status, etag, last_modified, guardado, html}.
+#  - Dentro del TTL: se sirve directo del disco.
+#  - Vencida: GET condicional (If-None-Match / If-Modified-Since); un 304 la renueva.
+# ==============================================================================
+
+CACHE_DIR = os.environ.get("CACHE_WEB_DIR", os.path.join(tempfile.gettempdir(), "autoneura_cache_web"))
+CACHE_TTL_SEGUNDOS = int(os.environ.get("CACHE_WEB_TTL", 3 * 24 * 3600))
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+}
+
+# Probabilidad de barrer entradas viejas en cada escritura (evita un cron aparte)
+PROBABILIDAD_LIMPIEZA = 0.005
+
+metricas = {"hits": 0, "revalidadas": 0, "descargas": 0}
+
+def _ruta(url):
+    return os.path.join(CACHE_DIR, hashlib.sha256(url.encode('utf-8')).hexdigest() + ".json.gz")
+
+def _leer(url):
+    try:
+        with gzip.open(_ruta(url), 'rt', encoding='utf-8') as f:
+            entrada = json.load(f)
+        return entrada if entrada.get('url') == url else None
+    except (OSError, ValueError):
+        return None
+
+def _guardar(entrada):
+    """ Escritura atómica (tmp + rename): lectores concurrentes nunca ven un archivo a medias. """
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f_raw, gzip.GzipFile(fileobj=f_raw, mode='wb') as f:
+            f.write(json.dumps(entrada).encode('utf-8'))
+        os.replace(tmp, _ruta(entrada['url']))
+    except OSError as e:
+        logging.warning(f"⚠️ No se pudo guardar en caché web: {e}")
+        return
+    if random.random() < PROBABILIDAD_LIMPIEZA:
+        limpiar_cache()
+
+def limpiar_cache(edad_maxima=None):
+    """ Borra entradas que llevan más de 2 TTL sin renovarse. """
+    edad_maxima = edad_maxima or CACHE_TTL_SEGUNDOS * 2
+    limite = time.time() - edad_maxima
+    try:
+        for nombre in os.listdir(CACHE_DIR):
+            ruta = os.path.join(CACHE_DIR, nombre)
+            try:
+                if os.path.getmtime(ruta) < limite: os.remove(ruta)
+            except OSError:
+                pass
+    except OSError:
+        pass
+
+def obtener_html(url, session=None, timeout=10, semaforo=None):
+    """
+    Devuelve (status_code, html) leyendo a través de la caché.
+    `semaforo` (opcional) envuelve SOLO la parte de red: un acierto de caché no ocupa cupo del dominio.
+    Lanza la excepción de requests si la red falla y no hay copia en caché.
+    """
+    entrada = _leer(url)
+    if entrada and time.time() - entrada['guardado'] < CACHE_TTL_SEGUNDOS:
+        metricas["hits"] += 1
+        return entrada['status'], entrada['html']
+
+    cabeceras = {}
+    if entrada:
+        if entrada.get('etag'): cabeceras['If-None-Match'] = entrada['etag']
+        if entrada.get('last_modified'): cabeceras['If-Modified-Since'] = entrada['last_modified']
+
+    # Una sesión ya trae sus propias cabeceras de navegador; requests a secas no
+    cliente = session or requests
+    if not session: cabeceras = {**HEADERS, **cabeceras}
+    try:
+        with semaforo or contextlib.nullcontext():
+            resp = cliente.get(url, timeout=timeout, headers=cabeceras or None)
+    except requests.RequestException:
+        # Sitio caído: mejor una copia vieja que nada
+        if entrada: return entrada['status'], entrada['html']
+        raise
+
+    if resp.status_code == 304 and entrada:
+        metricas["revalidadas"] += 1
+        entrada['guardado'] = time.time()
+        _guardar(entrada)
+        return entrada['status'], entrada['html']
+
+    metricas["descargas"] += 1
+    if resp.status_code == 200:
+        _guardar({
+            "url": url,
+            "status": resp.status_code,
+            "etag": resp.headers.get('ETag'),
+            "last_modified": resp.headers.get('Last-Modified'),
+            "guardado": time.time(),
+            "html": resp.text,
+        })
+    return resp.status_code, resp.text
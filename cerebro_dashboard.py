@@ -1,5 +1,13 @@
 import os
-import google.generativeai as genai
+
+# Sin genai.configure global: el modelo sale del pool de ai_manager atado a SU llave
+try:
+    from ai_manager import brain
+except ImportError:
+    brain = None
+
+GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
+MODELO_DASHBOARD = 'models/gemini-pro-latest'
 
 print(">>> [Cerebro v3.0 - EXPERTO AUTONEURA] Cargando...")
 
@@ -52,12 +60,15 @@ class DashboardBrain:
         # --- FIN DEL PROTOCOLO ---
 
         try:
-            # Mantenemos el modelo que tú tenías configurado
-            self.model = genai.GenerativeModel('models/gemini-pro-latest')
-            self.chat = self.model.start_chat(history=[
+            # Mantenemos el modelo que tú tenías configurado (con la llave GOOGLE_API_KEY)
+            if not brain or not GOOGLE_API_KEY:
+                raise RuntimeError("Falta ai_manager o GOOGLE_API_KEY")
+            self.model = brain.modelo_para_llave(GOOGLE_API_KEY, MODELO_DASHBOARD)
+            self.historia_base = [
                 {'role': 'user', 'parts': [protocolo_vendedor_enfocado]},
                 {'role': 'model', 'parts': ["Protocolo 'Vendedor Enfocado' cargado. Conozco los precios y no inventaré enlaces. Listo para vender."]}
-            ])
+            ]
+            self.chat = self.model.start_chat(history=self.historia_base)
             print(">>> [Cerebro] Modelo de IA y chat con personalidad REFORZADA inicializados.")
         except Exception as e:
             print(f"!!! ERROR [Cerebro]: No se pudo inicializar el modelo o el chat. {e} !!!")
@@ -71,7 +82,9 @@ class DashboardBrain:
             return "Error interno: No se recibió ninguna pregunta."
             
         try:
-            response = self.chat.send_message(question)
+            # Sesión NUEVA por pregunta: con gunicorn gthread varios hilos llaman a invoke()
+            # a la vez y un ChatSession compartido mezclaría historiales (y crecería sin fin)
+            response = self.model.start_chat(history=self.historia_base).send_message(question)
             return response.text
         except Exception as e:
             print(f"!!! ERROR [Cerebro]: Ocurrió un error al enviar el mensaje a la IA. {e} !!!")
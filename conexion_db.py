@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import ThreadedConnectionPool
+from dotenv import load_dotenv
+
+# ==============================================================================
+#  POOL DE CONEXIONES POSTGRES (UNO POR PROCESO Y POR URL)
+#  TLS + autenticación contra el Postgres administrado cuesta decenas de ms.
+#  Aquí las conexiones se abren una vez y se reciclan:
+#  - Chequeo de salud (SELECT 1) si la conexión estuvo ociosa un rato.
+#  - Reciclaje por vida máxima (evita conexiones zombies del proxy/pooler).
+#  - Si el pool está lleno, se ESPERA (ThreadedConnectionPool solo lanza error).
+#
+#  Dos formas de uso:
+#      with conexion() as conn:        # preferida
+#          ...
+#      conn = tomar()                  # compatible con el código viejo:
+#      ...; conn.close()               # close() DEVUELVE al pool, no cierra
+# ==============================================================================
+
+load_dotenv()
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+# Réplica de lectura opcional para consultas pesadas de reportes (consulta_solo_lectura)
+DATABASE_REPLICA_URL = os.environ.get("DATABASE_REPLICA_URL")
+
+POOL_MINIMO = int(os.environ.get("DB_POOL_MIN", 1))
+POOL_MAXIMO = int(os.environ.get("DB_POOL_MAX", 10))
+VIDA_MAXIMA_SEGUNDOS = int(os.environ.get("DB_CONN_VIDA_MAXIMA", 1800))
+CHEQUEO_OCIOSA_SEGUNDOS = int(os.environ.get("DB_CONN_CHEQUEO", 30))
+ESPERA_MAXIMA_SEGUNDOS = int(os.environ.get("DB_POOL_ESPERA", 30))
+
+LECTURA_TIMEOUT_MS = int(os.environ.get("DB_LECTURA_TIMEOUT_MS", 5000))
+LECTURA_MAX_FILAS = int(os.environ.get("DB_LECTURA_MAX_FILAS", 200))
+
+class PoolConexiones:
+    def __init__(self, dsn, minimo=POOL_MINIMO, maximo=POOL_MAXIMO, vida_maxima=VIDA_MAXIMA_SEGUNDOS):
+        self.dsn = dsn
+        self.vida_maxima = vida_maxima
+        self._pool = ThreadedConnectionPool(minimo, maximo, dsn)
+        self._cupos = threading.BoundedSemaphore(maximo)
+        self._nacimiento = {}
+        self._ultimo_uso = {}
+        self._lock = threading.Lock()
+
+    def tomar(self):
+        if not self._cupos.acquire(timeout=ESPERA_MAXIMA_SEGUNDOS):
+            raise psycopg2.OperationalError(f"Pool de conexiones agotado ({ESPERA_MAXIMA_SEGUNDOS}s esperando)")
+        try:
+            for _ in range(3):
+                conn = self._pool.getconn()
+                if self._sana(conn):
+                    return ConexionPrestada(conn, self)
+                self._descartar(conn)
+            raise psycopg2.OperationalError("No se pudo obtener una conexión sana del pool")
+        except Exception:
+            self._cupos.release()
+            raise
+
+    def _sana(self, conn):
+        ahora = time.time()
+        with self._lock:
+            nacimiento = self._nacimiento.setdefault(id(conn), ahora)
+            ultimo_uso = self._ultimo_uso.get(id(conn), ahora)
+        if conn.closed: return False
+        if ahora - nacimiento > self.vida_maxima: return False
+        if ahora - ultimo_uso > CHEQUEO_OCIOSA_SEGUNDOS:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except Exception:
+                return False
+        return True
+
+    def _descartar(self, conn):
+        with self._lock:
+            self._nacimiento.pop(id(conn), None)
+            self._ultimo_uso.pop(id(conn), None)
+        try: self._pool.putconn(conn, close=True)
+        except Exception: pass
+
+    def devolver(self, conn):
+        """ Deja la conexión limpia (sin transacción abierta, autocommit apagado) y la devuelve. """
+        try:
+            if conn.closed:
+                self._descartar(conn)
+                return
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit: conn.autocommit = False
+            except Exception:
+                self._descartar(conn)
+                return
+            with self._lock:
+                self._ultimo_uso[id(conn)] = time.time()
+            self._pool.putconn(conn)
+        finally:
+            self._cupos.release()
+
+class ConexionPrestada:
+    """
+    Envoltorio de una conexión del pool. Se comporta igual que la de psycopg2,
+    salvo que close() la devuelve al pool (y es idempotente).
+    """
+    def __init__(self, conn, pool):
+        self._conn = conn
+        self._pool = pool
+
+    def __getattr__(self, nombre):
+        if self._conn is None:
+            raise psycopg2.InterfaceError("La conexión ya fue devuelta al pool")
+        return getattr(self._conn, nombre)
+
+    @property
+    def closed(self):
+        return 1 if self._conn is None else self._conn.closed
+
+    def close(self):
+        if self._conn is None: return
+        conn, self._conn = self._conn, None
+        self._pool.devolver(conn)
+
+    def __del__(self):
+        # Red de seguridad contra fugas (ej: un `if get_db_connection()` que nunca cierra)
+        try: self.close()
+        except Exception: pass
+
+# --- REGISTRO DE POOLS (uno por URL y por proceso; gunicorn hace fork) ---
+_pools = {}
+_pid = None
+_lock_registro = threading.Lock()
+
+def obtener_pool(dsn=None):
+    global _pid
+    dsn = dsn or DATABASE_URL
+    with _lock_registro:
+        if _pid != os.getpid():
+            # Proceso hijo recién forkeado: las conexiones del padre no sirven aquí
+            _pools.clear()
+            _pid = os.getpid()
+        if dsn not in _pools:
+            _pools[dsn] = PoolConexiones(dsn)
+            logging.info(f"🔌 Pool Postgres creado (máx {POOL_MAXIMO} conexiones, pid {_pid}).")
+        return _pools[dsn]
+
+def tomar(dsn=None):
+    """ Conexión del pool. Llamar a .close() la devuelve. """
+    return obtener_pool(dsn).tomar()
+
+@contextmanager
+def conexion(dsn=None):
+    """ with conexion() as conn: ... -> se devuelve sola al pool (rollback de lo no confirmado). """
+    conn = tomar(dsn)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def salud(dsn=None):
+    """ True si la base responde. Usado por el monitor de admin. """
+    try:
+        with conexion(dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+        return True
+    except Exception as e:
+        logging.error(f"Error DB: {e}")
+        return False
+
+# --- CONSULTAS NO CONFIABLES (SQL escrito por la IA) ---
+
+def recortar_celda(valor, max_caracteres):
+    """ JSON y textos largos (ej: raw_data) recortados: al prompt solo le sirve el comienzo. """
+    if isinstance(valor, (dict, list)):
+        valor = json.dumps(valor, ensure_ascii=False, default=str)
+    if isinstance(valor, str) and len(valor) > max_caracteres:
+        return valor[:max_caracteres] + "…"
+    return valor
+
+def consulta_solo_lectura(sql, parametros=None, max_filas=LECTURA_MAX_FILAS,
+                          timeout_ms=LECTURA_TIMEOUT_MS, max_caracteres_celda=None, usar_replica=True):
+    """
+    Ejecuta SQL ajena (ej: generada por Gemini) sin poder dañar nada:
+    - Transacción READ ONLY: cualquier escritura la rechaza el propio Postgres.
+    - statement_timeout local: una consulta pesada se corta sola.
+    - Cursor del lado del servidor: a este proceso solo llegan `max_filas`.
+    - Va a DATABASE_REPLICA_URL si está configurada.
+    Devuelve (columnas, filas, truncado).
+    """
+    dsn = DATABASE_REPLICA_URL if usar_replica and DATABASE_REPLICA_URL else None
+    sql = sql.strip().rstrip(';')
+    with conexion(dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION READ ONLY")
+            cur.execute("SET LOCAL statement_timeout = %s", (int(timeout_ms),))
+        # Un cursor con nombre es un DECLARE ... CURSOR: solo acepta una consulta (SELECT/VALUES)
+        with conn.cursor(name=f"lectura_{uuid.uuid4().hex[:12]}") as cur:
+            cur.execute(sql, parametros)
+            filas = cur.fetchmany(max_filas + 1)
+            columnas = [d[0] for d in cur.description] if cur.description else []
+        conn.rollback()
+
+    truncado = len(filas) > max_filas
+    filas = filas[:max_filas]
+    if max_caracteres_celda:
+        filas = [tuple(recortar_celda(v, max_caracteres_celda) for v in fila) for fila in filas]
+    return columnas, filas, truncado
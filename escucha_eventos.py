@@ -0,0 +1,89 @@
+import os
+import json
+import select
+import logging
+import threading
+import psycopg2
+
+# ==============================================================================
+#  OÍDO DEL ORQUESTADOR (LISTEN / NOTIFY)
+#  Los triggers de migraciones/004 avisan por el canal 'autoneura_eventos'
+#  cuando un prospecto entra a una cola o nace una campaña. Este hilo los
+#  escucha en una conexión PROPIA (fuera del pool: queda abierta para siempre
+#  y en autocommit, si no los avisos no llegan) y se los pasa a `al_recibir`.
+#
+#  Si la conexión se cae, reconecta con espera creciente y entrega un evento
+#  {"tabla": "*"}: pudimos perder avisos, así que conviene barrer todo.
+# ==============================================================================
+
+CANAL = "autoneura_eventos"
+INTERVALO_POLL_SEGUNDOS = 5
+ESPERA_MAXIMA_RECONEXION = 60
+
+class EscuchaEventos:
+    def __init__(self, al_recibir, dsn=None):
+        self.al_recibir = al_recibir
+        self.dsn = dsn or os.environ.get("DATABASE_URL")
+        self._detener = threading.Event()
+        self._hilo = None
+        self.conectado = False
+        self.recibidos = 0
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._bucle, name="escucha-eventos", daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo: self._hilo.join(timeout=INTERVALO_POLL_SEGUNDOS * 2)
+
+    def _entregar(self, evento):
+        try:
+            self.al_recibir(evento)
+        except Exception as e:
+            logging.error(f"⚠️ Error despachando evento {evento}: {e}")
+
+    def _escuchar(self, conn):
+        while not self._detener.is_set():
+            # select() sobre el socket: cero consultas mientras no haya avisos
+            if select.select([conn], [], [], INTERVALO_POLL_SEGUNDOS) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                aviso = conn.notifies.pop(0)
+                self.recibidos += 1
+                try:
+                    evento = json.loads(aviso.payload)
+                except ValueError:
+                    logging.warning(f"⚠️ Aviso ilegible en {CANAL}: {aviso.payload!r}")
+                    continue
+                self._entregar(evento)
+
+    def _bucle(self):
+        espera = 1
+        primera_vez = True
+        while not self._detener.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CANAL}")
+                self.conectado = True
+                espera = 1
+                logging.info(f"👂 Escuchando '{CANAL}' (avisos en tiempo real).")
+                if not primera_vez:
+                    self._entregar({"tabla": "*"})
+                primera_vez = False
+                self._escuchar(conn)
+            except Exception as e:
+                self.conectado = False
+                logging.error(f"⚠️ Escucha de eventos caída: {e}. Reintentando en {espera}s...")
+                self._detener.wait(espera)
+                espera = min(espera * 2, ESPERA_MAXIMA_RECONEXION)
+            finally:
+                self.conectado = False
+                if conn:
+                    try: conn.close()
+                    except Exception: pass
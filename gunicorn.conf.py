@@ -0,0 +1,29 @@
+import os
+
+# ==============================================================================
+#  GUNICORN (Procfile y Dockerfile lo cargan con -c gunicorn.conf.py)
+#  Las rutas de chat pasan segundos esperando a Gemini sin usar CPU. Con
+#  workers "sync" cada chat bloqueaba un proceso entero; con gthread cada
+#  worker atiende GUNICORN_HILOS peticiones a la vez, y la espera de red
+#  libera el GIL. En la VM de 512MB: pocos procesos, muchos hilos.
+# ==============================================================================
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("GUNICORN_HILOS", 32))
+
+# Gemini puede tardar; el stream de /api/chat-nido/stream mantiene viva la conexión
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+# Reciclar workers de vez en cuando (fugas lentas de memoria en librerías de IA)
+max_requests = 2000
+max_requests_jitter = 200
+
+# Sin preload: cada worker arma SUS hilos de ai_manager y SU pool de conexiones
+# (conexion_db ya detecta el fork, pero los hilos de fondo no sobreviven un fork)
+preload_app = False
+
+accesslog = "-"
@@ -1,17 +1,19 @@
 import os
-import psycopg2
 import json
-import google.generativeai as genai
 import uuid
 import logging
 import re
+import threading
 import sys          # NUEVO: Para diagnósticos
 import traceback    # NUEVO: Para ver el error real
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash, Response, stream_with_context
 from flask_babel import Babel, gettext
 from psycopg2.extras import Json
+from psycopg2 import errors as errores_pg
 from werkzeug.routing import BaseConverter
 from dotenv import load_dotenv
+import conexion_db
+import cache_consultas
 
 # --- IMPORTACIÓN DE MÓDULOS PROPIOS ---
 try:
@@ -105,16 +107,18 @@ GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
 
 dashboard_brain = None
 nutridor_brain = None
+# gunicorn gthread: varios hilos por worker comparten estos globales
+_lock_dashboard_brain = threading.Lock()
 
-# Configuración Legacy para el Nutridor (se actualizará en el siguiente paso)
-if GOOGLE_API_KEY:
-    genai.configure(api_key=GOOGLE_API_KEY)
-    if TrabajadorNutridor:
-        nutridor_brain = TrabajadorNutridor()
+# Sin genai.configure global: cada modelo se ata a su llave en ai_manager
+# (el del dashboard usa GOOGLE_API_KEY vía brain.modelo_para_llave)
+if GOOGLE_API_KEY and TrabajadorNutridor:
+    nutridor_brain = TrabajadorNutridor()
 
 def get_db_connection():
+    # Conexión del pool del proceso (conexion_db): conn.close() la devuelve, no la cierra
     try:
-        return psycopg2.connect(DATABASE_URL)
+        return conexion_db.tomar()
     except Exception as e:
         print(f"Error DB: {e}")
         return None
@@ -127,6 +131,10 @@ def get_current_user_email():
 # ==========================================
 # CEREBRO ARQUITECTO (ACTUALIZADO CON ROTACIÓN DE LLAVES)
 # ==========================================
+# Límites de lo que el Arquitecto le trae a la IA (el prompt no necesita toda la tabla)
+MAX_FILAS_ARQUITECTO = int(os.environ.get("ARQUITECTO_MAX_FILAS", 50))
+MAX_CARACTERES_CELDA_ARQUITECTO = 200
+
 class CerebroArquitecto:
     def __init__(self):
         # ESQUEMA PARA SQL
@@ -153,66 +161,94 @@ class CerebroArquitecto:
         """
 
     def pensar(self, pregunta_usuario):
-        conn = get_db_connection()
-        if not conn:
-            return "Error crítico: No hay conexión a la base de datos."
-        
-        # 1. SOLICITAR CEREBRO AL MANAGER (ROTACIÓN)
-        if not brain:
+        """
+        Pregunta de negocio -> SQL (Gemini) -> datos -> respuesta narrada (Gemini).
+        Con caché de dos niveles (cache_consultas): una pregunta repetida con los
+        datos sin cambios sale de memoria, sin tokens.
+        """
+        clave = cache_consultas.normalizar_pregunta(pregunta_usuario)
+        sql_query = cache_consultas.cache_sql.obtener(clave)
+
+        # 1. SOLICITAR CEREBRO AL MANAGER (ROTACIÓN) - solo si vamos a necesitarlo
+        if not brain and not sql_query:
             return "Error: El sistema de rotación de IA (ai_manager) no está activo. Revisa el LOG de arranque."
+
+        try:
+            # La huella SIEMPRE del primario (las estadísticas de una réplica no cuentan escrituras)
+            with conexion_db.conexion() as conn:
+                huella = cache_consultas.huella_tablas(conn)
+        except Exception as e:
+            logging.error(f"Error DB: {e}")
+            return "Error crítico: No hay conexión a la base de datos."
             
         try:
+            # NIVEL 2: misma SQL y las tablas no cambiaron -> misma respuesta
+            if sql_query:
+                previo = cache_consultas.respuesta_vigente(sql_query, huella)
+                if previo: return previo
+            if not brain:
+                return "Error: El sistema de rotación de IA (ai_manager) no está activo. Revisa el LOG de arranque."
+
             # Pedimos un modelo 'inteligente' (Pro) o 'general' para escribir SQL bien
-            # Esto buscará en Supabase qué llave tiene saldo/cupo
             model, model_id = brain.get_optimal_model(task_type="inteligencia")
             
-            # PASO 1: Generar SQL
-            prompt_sql = f"""
-            Genera SOLO un código SQL (PostgreSQL) para responder: "{pregunta_usuario}"
-            CONTEXTO: {self.schema}
-            REGLAS:
-            1. Devuelve SOLO el SQL puro. Sin markdown.
-            2. Usa 'LEFT JOIN' para contar prospectos.
-            3. Si preguntan finanzas, usa la tabla finance_logs.
-            """
-            
-            response_sql = model.generate_content(prompt_sql)
-            # REGISTRAMOS EL USO (SEMAFORO)
-            brain.register_usage(model_id)
-            
-            sql_query = response_sql.text.strip().replace('```sql', '').replace('```', '').replace('\n', ' ')
-            
-            # Seguridad
-            if any(x in sql_query.lower() for x in ["delete", "update", "drop", "insert", "alter"]):
-                return "Lo siento, solo tengo permisos de LECTURA."
-
-            # PASO 2: Ejecutar SQL
-            cursor = conn.cursor()
-            cursor.execute(sql_query)
-            resultados = cursor.fetchall()
-            nombres_columnas = [desc[0] for desc in cursor.description] if cursor.description else []
-            cursor.close()
-            conn.close()
+            # PASO 1: Generar SQL (NIVEL 1: solo si esta pregunta no se hizo antes)
+            if not sql_query:
+                prompt_sql = f"""
+                Genera SOLO un código SQL (PostgreSQL) para responder: "{pregunta_usuario}"
+                CONTEXTO: {self.schema}
+                REGLAS:
+                1. Devuelve SOLO el SQL puro. Sin markdown.
+                2. Usa 'LEFT JOIN' para contar prospectos.
+                3. Si preguntan finanzas, usa la tabla finance_logs.
+                """
+                
+                response_sql = model.generate_content(prompt_sql)
+                # REGISTRAMOS EL USO (SEMAFORO)
+                brain.register_usage(model_id)
+                
+                sql_query = response_sql.text.strip().replace('```sql', '').replace('```', '').replace('\n', ' ')
+                
+                # Seguridad
+                if any(x in sql_query.lower() for x in ["delete", "update", "drop", "insert", "alter"]):
+                    return "Lo siento, solo tengo permisos de LECTURA."
+                cache_consultas.cache_sql.guardar(clave, sql_query)
+
+            # PASO 2: Ejecutar SQL (solo lectura, con tiempo y filas acotados, en réplica si hay)
+            nombres_columnas, resultados, truncado = conexion_db.consulta_solo_lectura(
+                sql_query, max_filas=MAX_FILAS_ARQUITECTO, max_caracteres_celda=MAX_CARACTERES_CELDA_ARQUITECTO
+            )
             
             if not resultados:
-                return f"Consulté la base de datos y no encontré datos para esa pregunta."
-
-            # PASO 3: Interpretar Resultados (Reutilizamos el modelo o pedimos otro)
-            prompt_final = f"""
-            ACTÚA COMO ANALISTA DE NEGOCIOS.
-            PREGUNTA: "{pregunta_usuario}"
-            DATOS (SQL): Columnas {nombres_columnas}, Filas {resultados}
-            RESPONDE: Directo, profesional, usa signo $ si es dinero.
-            """
-            response_final = model.generate_content(prompt_final)
-            brain.register_usage(model_id) # Cobramos el segundo uso
-            
-            return response_final.text
-
+                respuesta = f"Consulté la base de datos y no encontré datos para esa pregunta."
+            else:
+                # PASO 3: Interpretar Resultados (Reutilizamos el modelo o pedimos otro)
+                prompt_final = f"""
+                ACTÚA COMO ANALISTA DE NEGOCIOS.
+                PREGUNTA: "{pregunta_usuario}"
+                DATOS (SQL): Columnas {nombres_columnas}, Filas {resultados}
+                {f"(Solo se muestran las primeras {MAX_FILAS_ARQUITECTO} filas; hay más.)" if truncado else ""}
+                RESPONDE: Directo, profesional, usa signo $ si es dinero.
+                """
+                response_final = model.generate_content(prompt_final)
+                brain.register_usage(model_id) # Cobramos el segundo uso
+                respuesta = response_final.text
+
+            cache_consultas.guardar_respuesta(sql_query, huella, respuesta)
+            return respuesta
+
+        except errores_pg.ReadOnlySqlTransaction:
+            cache_consultas.cache_sql.descartar(clave)
+            return "Lo siento, solo tengo permisos de LECTURA."
+        except errores_pg.QueryCanceled:
+            cache_consultas.cache_sql.descartar(clave)
+            return "Esa consulta es demasiado pesada. ¿Puedes acotarla (por fechas o por campaña)?"
         except Exception as e:
+            # Una SQL que falla no debe quedar pegada a la pregunta
+            cache_consultas.cache_sql.descartar(clave)
             return f"Error técnico o de IA: {str(e)}"
 
-# Instancia global del Arquitecto
+# Instancia global del Arquitecto (sin estado por petición: segura entre hilos)
 arquitecto_brain = CerebroArquitecto()
 
 
@@ -240,32 +276,19 @@ def obtener_datos_dashboard():
     try:
         cur = conn.cursor()
         client_email = get_current_user_email()
-        
-        cur.execute("""
-            SELECT 
-                COUNT(p.id) as total,
-                COUNT(p.id) FILTER (WHERE p.interactions_count >= 3) as calificados
-            FROM prospects p
-            JOIN campaigns c ON p.campaign_id = c.id
-            JOIN clients cl ON c.client_id = cl.id
-            WHERE cl.email = %s
-        """, (client_email,))
-        kpis = cur.fetchone()
-        total_prospectos = kpis[0] or 0
-        total_calificados = kpis[1] or 0
-        tasa_conversion = round((total_calificados / total_prospectos * 100), 1) if total_prospectos > 0 else 0
 
+        # Contadores precalculados (migraciones/007): una fila por campaña, sin escanear prospects
         cur.execute("""
-            SELECT 
+            SELECT
                 c.campaign_name, c.created_at, c.status,
-                COUNT(p.id) as encontrados,
-                COUNT(p.id) FILTER (WHERE p.interactions_count >= 3) as leads,
-                c.id
+                COALESCE(s.encontrados, 0), COALESCE(s.calificados, 0), c.id,
+                (SELECT jsonb_object_agg(e.status, e.cantidad)
+                 FROM campaign_stats_estado e
+                 WHERE e.campaign_id = c.id::text AND e.cantidad > 0) as por_estado
             FROM campaigns c
             JOIN clients cl ON c.client_id = cl.id
-            LEFT JOIN prospects p ON c.id = p.campaign_id
+            LEFT JOIN campaign_stats s ON s.campaign_id = c.id::text
             WHERE cl.email = %s
-            GROUP BY c.id
             ORDER BY c.created_at DESC
         """, (client_email,))
         
@@ -273,9 +296,14 @@ def obtener_datos_dashboard():
         for row in cur.fetchall():
             campanas.append({
                 "nombre": row[0], "fecha": row[1].strftime('%Y-%m-%d') if row[1] else "-",
-                "estado": row[2], "encontrados": row[3], "calificados": row[4], "id": row[5]
+                "estado": row[2], "encontrados": row[3], "calificados": row[4], "id": row[5],
+                "por_estado": row[6] or {}
             })
 
+        total_prospectos = sum(c["encontrados"] for c in campanas)
+        total_calificados = sum(c["calificados"] for c in campanas)
+        tasa_conversion = round((total_calificados / total_prospectos * 100), 1) if total_prospectos > 0 else 0
+
         return jsonify({
             "kpis": {"total": total_prospectos, "calificados": total_calificados, "tasa": f"{tasa_conversion}%"},
             "campanas": campanas
@@ -364,9 +392,10 @@ def api_mis_campanas():
     try:
         cur = conn.cursor()
         cur.execute("""
-            SELECT id, campaign_name, status, created_at, 
-            (SELECT COUNT(*) FROM prospects WHERE campaign_id = campaigns.id) as count
-            FROM campaigns ORDER BY created_at DESC
+            SELECT c.id, c.campaign_name, c.status, c.created_at, COALESCE(s.encontrados, 0) as count
+            FROM campaigns c
+            LEFT JOIN campaign_stats s ON s.campaign_id = c.id::text
+            ORDER BY c.created_at DESC
         """)
         rows = cur.fetchall()
         data = []
@@ -383,13 +412,15 @@ def api_mis_campanas():
         conn.close()
 
 # --- RUTAS DE NIDO (CORREGIDAS PARA JSON DINÁMICO) ---
+SQL_NIDO_POR_TOKEN = "SELECT id, business_name, generated_copy FROM prospects WHERE access_token = %s"
+
 @app.route('/ver-pre-nido/<string:token>')
 def mostrar_pre_nido(token):
     conn = get_db_connection()
     if not conn: return "Error DB", 500
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT id, business_name, generated_copy FROM prospects WHERE access_token = %s", (token,))
+            cur.execute(SQL_NIDO_POR_TOKEN, (token,))
             res = cur.fetchone()
             if res:
                 prospect_id = res[0]
@@ -420,7 +451,8 @@ def generar_nido_y_entrar():
         with conn.cursor() as cur:
             # 1. Actualizamos el email y el estado
             cur.execute("""
-                UPDATE prospects SET captured_email = %s, status = 'nutriendo', last_interaction_at = NOW()
+                UPDATE prospects SET captured_email = %s, status = 'nutriendo', last_interaction_at = NOW(),
+                    next_step_at = NOW() -- Primera jugada del Nido: ya
                 WHERE id = %s RETURNING business_name, access_token, generated_copy
             """, (email, pid))
             res = cur.fetchone()
@@ -469,6 +501,35 @@ def chat_nido_api():
         
     return jsonify({"respuesta": "El Asistente está desconectado temporalmente."})
 
+@app.route('/api/chat-nido/stream', methods=['POST'])
+def chat_nido_stream():
+    """
+    Mismo chat, pero en Server-Sent Events: el prospecto ve la respuesta
+    a medida que Gemini la escribe. Cada trozo sale como `data: {"t": "..."}`
+    y el cierre como `event: fin`.
+    """
+    d = request.json or {}
+    mensaje = d.get('message')
+    token = d.get('token')
+
+    def evento(texto):
+        return f"data: {json.dumps({'t': texto}, ensure_ascii=False)}\n\n"
+
+    def generar():
+        if not mensaje or not token:
+            yield evento("Error: Datos incompletos.")
+        elif not nutridor_brain:
+            yield evento("El Asistente está desconectado temporalmente.")
+        else:
+            for trozo in nutridor_brain.responder_chat_stream(mensaje, token):
+                yield evento(trozo)
+        yield "event: fin\ndata: {}\n\n"
+
+    return Response(stream_with_context(generar()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no', # Que ningún proxy junte los trozos
+    })
+
 # --- RUTAS DEBUG ---
 @app.route('/ver-pre-nido')
 def debug_pre(): return render_template('persuasor.html', prospecto_id="TEST", contenido={})
@@ -500,8 +561,11 @@ def chat_admin():
             
     # INTENTO 2: Usar sistema viejo (Fallback)
     global dashboard_brain
-    if not dashboard_brain and create_chatbot: 
-        dashboard_brain = create_chatbot()
+    if not dashboard_brain and create_chatbot:
+        # Doble chequeo: con varios hilos, solo UNO crea el cerebro
+        with _lock_dashboard_brain:
+            if not dashboard_brain:
+                dashboard_brain = create_chatbot("")
         
     if dashboard_brain: 
         return jsonify({"response": dashboard_brain.invoke({"question": mensaje})})
@@ -686,6 +750,8 @@ def admin_registrar_gasto():
         """, ('Operativo', d.get('concepto'), d.get('monto'), monto_neto))
         
         conn.commit()
+        # Las respuestas del Arquitecto sobre finanzas ya no valen
+        cache_consultas.invalidar_resultados()
         return jsonify({"success": True})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -696,7 +762,7 @@ def admin_registrar_gasto():
 @app.route('/api/admin/monitor', methods=['GET'])
 def admin_monitor():
     # Verificamos DB
-    db_status = "🟢 Online" if get_db_connection() else "🔴 Error Conexión"
+    db_status = "🟢 Online" if conexion_db.salud() else "🔴 Error Conexión"
     
     # Verificamos Google IA
     ia_status = "🟢 Rotación Activa" if brain else "🔴 Error Manager"
@@ -707,7 +773,8 @@ def admin_monitor():
     return jsonify({
         "database": db_status,
         "google_ai": ia_status,
-        "apify": apify_status
+        "apify": apify_status,
+        "pool_modelos": brain.estadisticas_pool() if brain and hasattr(brain, 'estadisticas_pool') else {}
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,117 @@
+import os
+import logging
+import conexion_db
+from psycopg2.extras import execute_values
+
+# ==============================================================================
+#  MEMORIA DE CONVERSACIONES (Chat del Nido + script de seguimiento)
+#  Cada mensaje se AGREGA a conversation_turns (nunca se edita ni se borra).
+#  Cuando quedan más de 2*N turnos sin resumir, los más viejos se funden en
+#  conversation_summaries con la IA. El modelo recibe siempre:
+#      resumen + últimos N turnos, recortado a MAX_CARACTERES_CONTEXTO
+#  así el costo por mensaje queda plano aunque la charla dure semanas.
+# ==============================================================================
+
+TURNOS_VENTANA = int(os.environ.get("CHAT_MEMORIA_TURNOS", 8))
+MAX_CARACTERES_CONTEXTO = int(os.environ.get("CHAT_MEMORIA_MAX_CARACTERES", 3000))
+MAX_CARACTERES_TURNO = 600
+
+ETIQUETAS = {"user": "CLIENTE", "ai": "TÚ"}
+
+def cargar_memoria(token):
+    """ (resumen, [(rol, texto), ...] en orden cronológico) en un solo viaje a la DB. """
+    with conexion_db.conexion() as conn, conn.cursor() as cur:
+        cur.execute("""
+            WITH r AS (
+                SELECT summary, summarized_until FROM conversation_summaries WHERE session_token = %s
+            )
+            SELECT NULL::bigint, 'resumen', summary FROM r
+            UNION ALL
+            (SELECT t.id, t.role, t.content
+             FROM conversation_turns t
+             WHERE t.session_token = %s
+             AND t.id > COALESCE((SELECT summarized_until FROM r), 0)
+             ORDER BY t.id DESC
+             LIMIT %s)
+        """, (token, token, TURNOS_VENTANA))
+        filas = cur.fetchall()
+    resumen = next((f[2] for f in filas if f[1] == 'resumen'), "")
+    turnos = [(f[1], f[2]) for f in reversed(filas) if f[1] != 'resumen']
+    return resumen, turnos
+
+def formatear_contexto(resumen, turnos, max_caracteres=MAX_CARACTERES_CONTEXTO):
+    """
+    Texto listo para el prompt. Si no entra en `max_caracteres` se sueltan
+    primero los turnos más viejos; el resumen se recorta al final.
+    """
+    lineas = [f"{ETIQUETAS.get(rol, rol)}: {texto[:MAX_CARACTERES_TURNO]}" for rol, texto in turnos]
+    cabecera = f"RESUMEN DE LO ANTERIOR: {resumen}" if resumen else ""
+    while lineas and len(cabecera) + sum(len(l) + 1 for l in lineas) > max_caracteres:
+        lineas.pop(0)
+    texto = "\n".join(([cabecera] if cabecera else []) + lineas)
+    return texto[-max_caracteres:]
+
+def contexto_conversacion(token):
+    """ Contexto acotado de la conversación ("" si aún no hay). """
+    return formatear_contexto(*cargar_memoria(token))
+
+def registrar_intercambio(token, mensaje_usuario, respuesta_ia):
+    """ Agrega el mensaje del cliente y la respuesta en UN insert; compacta si hace falta. """
+    turnos = [(token, 'user', mensaje_usuario)]
+    if respuesta_ia: turnos.append((token, 'ai', respuesta_ia))
+    with conexion_db.conexion() as conn, conn.cursor() as cur:
+        execute_values(cur, "INSERT INTO conversation_turns (session_token, role, content) VALUES %s", turnos)
+        conn.commit()
+    compactar_si_hace_falta(token)
+
+def compactar_si_hace_falta(token):
+    """ Funde en el resumen todo lo que quedó fuera de la ventana de N turnos. """
+    with conexion_db.conexion() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT t.id, t.role, t.content, s.summary
+            FROM conversation_turns t
+            LEFT JOIN conversation_summaries s ON s.session_token = t.session_token
+            WHERE t.session_token = %s AND t.id > COALESCE(s.summarized_until, 0)
+            ORDER BY t.id
+        """, (token,))
+        pendientes = cur.fetchall()
+    if len(pendientes) <= TURNOS_VENTANA * 2: return
+
+    a_resumir = pendientes[:-TURNOS_VENTANA]
+    resumen_previo = pendientes[0][3] or ""
+    nuevo_resumen = resumir(resumen_previo, [(f[1], f[2]) for f in a_resumir])
+    if not nuevo_resumen: return
+
+    with conexion_db.conexion() as conn, conn.cursor() as cur:
+        # Solo avanza: si otra compactación llegó más lejos, gana ella
+        cur.execute("""
+            INSERT INTO conversation_summaries (session_token, summary, summarized_until, updated_at)
+            VALUES (%s, %s, %s, NOW())
+            ON CONFLICT (session_token) DO UPDATE
+            SET summary = EXCLUDED.summary, summarized_until = EXCLUDED.summarized_until, updated_at = NOW()
+            WHERE conversation_summaries.summarized_until < EXCLUDED.summarized_until
+        """, (token, nuevo_resumen, a_resumir[-1][0]))
+        conn.commit()
+
+def resumir(resumen_previo, turnos):
+    try:
+        from ai_manager import brain
+    except ImportError:
+        brain = None
+    if not brain: return None
+
+    prompt = f"""
+    Resume esta conversación de ventas para que otro vendedor la retome.
+    Conserva: nombre y necesidades del cliente, objeciones, precios o fechas mencionados y compromisos.
+    Máximo 120 palabras, en el idioma de la conversación. Solo el resumen.
+
+    RESUMEN ANTERIOR: {resumen_previo or "(ninguno)"}
+
+    MENSAJES NUEVOS:
+    {formatear_contexto("", turnos, max_caracteres=MAX_CARACTERES_CONTEXTO * 2)}
+    """
+    resultado = brain.run_many([prompt], task_type="velocidad")[0]
+    if resultado["error"]:
+        logging.warning(f"⚠️ No se pudo resumir la conversación: {resultado['error']}")
+        return None
+    return resultado["texto"].strip()
@@ -0,0 +1,22 @@
+-- =============================================================================
+--  001: Contabilidad atómica de uso de IA (usada por AIManager.flush_usage)
+--  Recibe {"<model_id>": <cantidad>, ...} y suma todo en un solo UPDATE.
+--  Si el contador es de otro día, arranca desde cero (rollover en el servidor).
+-- =============================================================================
+
+CREATE OR REPLACE FUNCTION incrementar_uso_ia(p_incrementos jsonb)
+RETURNS void
+LANGUAGE sql
+AS $$
+    UPDATE ai_models m
+    SET usage_today = CASE
+            WHEN m.last_usage_date = CURRENT_DATE THEN COALESCE(m.usage_today, 0) + d.cantidad
+            ELSE d.cantidad
+        END,
+        last_usage_date = CURRENT_DATE
+    FROM (
+        SELECT key AS model_id, value::int AS cantidad
+        FROM jsonb_each_text(p_incrementos)
+    ) d
+    WHERE m.id::text = d.model_id;
+$$;
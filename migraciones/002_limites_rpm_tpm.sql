@@ -0,0 +1,7 @@
+-- =============================================================================
+--  002: Límites por minuto de cada modelo (usados por ai_manager.LimitadorTokens)
+--  NULL = usar los defaults del proceso (AI_RPM_DEFAULT / AI_TPM_DEFAULT).
+-- =============================================================================
+
+ALTER TABLE ai_models ADD COLUMN IF NOT EXISTS rpm_limit INTEGER;
+ALTER TABLE ai_models ADD COLUMN IF NOT EXISTS tpm_limit INTEGER;
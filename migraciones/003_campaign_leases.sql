@@ -0,0 +1,12 @@
+-- =============================================================================
+--  003: Arriendos (leases) de campañas para el Orquestador paralelo
+--  Un orquestador solo procesa una campaña si tiene su lease vigente:
+--  dos instancias nunca trabajan la misma campaña a la vez. Si un proceso
+--  muere, el lease vence solo (expires_at) y otra instancia la retoma.
+-- =============================================================================
+
+CREATE TABLE IF NOT EXISTS campaign_leases (
+    campaign_id TEXT PRIMARY KEY,
+    owner       TEXT NOT NULL,
+    expires_at  TIMESTAMPTZ NOT NULL
+);
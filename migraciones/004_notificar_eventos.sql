@@ -0,0 +1,53 @@
+-- =============================================================================
+--  004: Avisos en tiempo real para el Orquestador (LISTEN autoneura_eventos)
+--  Cada vez que un prospecto ENTRA a una cola de etapa, o se crea/activa una
+--  campaña, se emite un NOTIFY con {tabla, campaign_id, status}.
+--  Postgres descarta avisos idénticos dentro de una misma transacción, así que
+--  un lote de 200 'cazado' del Cazador genera UN solo aviso por campaña.
+-- =============================================================================
+
+CREATE OR REPLACE FUNCTION notificar_evento_autoneura()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM pg_notify('autoneura_eventos', json_build_object(
+        'tabla', TG_TABLE_NAME,
+        'campaign_id', CASE WHEN TG_TABLE_NAME = 'campaigns' THEN NEW.id::text ELSE NEW.campaign_id::text END,
+        'status', NEW.status
+    )::text);
+    RETURN NULL;
+END;
+$$;
+
+-- Prospectos: solo los estados que son cabeza de cola (los transitorios
+-- 'espiando' / 'analizando' / 'persuadiendo' no despiertan a nadie)
+DROP TRIGGER IF EXISTS prospects_notificar_insert ON prospects;
+CREATE TRIGGER prospects_notificar_insert
+    AFTER INSERT ON prospects
+    FOR EACH ROW
+    WHEN (NEW.status IN ('cazado', 'espiado', 'analizado_exitoso', 'nutriendo'))
+    EXECUTE FUNCTION notificar_evento_autoneura();
+
+DROP TRIGGER IF EXISTS prospects_notificar_status ON prospects;
+CREATE TRIGGER prospects_notificar_status
+    AFTER UPDATE OF status ON prospects
+    FOR EACH ROW
+    WHEN (OLD.status IS DISTINCT FROM NEW.status
+          AND NEW.status IN ('cazado', 'espiado', 'analizado_exitoso', 'nutriendo'))
+    EXECUTE FUNCTION notificar_evento_autoneura();
+
+-- Campañas: nuevas o reactivadas
+DROP TRIGGER IF EXISTS campaigns_notificar_insert ON campaigns;
+CREATE TRIGGER campaigns_notificar_insert
+    AFTER INSERT ON campaigns
+    FOR EACH ROW
+    WHEN (NEW.status = 'active')
+    EXECUTE FUNCTION notificar_evento_autoneura();
+
+DROP TRIGGER IF EXISTS campaigns_notificar_status ON campaigns;
+CREATE TRIGGER campaigns_notificar_status
+    AFTER UPDATE OF status ON campaigns
+    FOR EACH ROW
+    WHEN (OLD.status IS DISTINCT FROM NEW.status AND NEW.status = 'active')
+    EXECUTE FUNCTION notificar_evento_autoneura();
@@ -0,0 +1,21 @@
+-- =============================================================================
+--  005: Agenda del Nutridor
+--  next_step_at = cuándo le toca la siguiente jugada del Nido a un prospecto.
+--  El Nutridor ya no carga todo 'nutriendo' para filtrar las 48h en Python:
+--  pide solo los vencidos, por índice parcial.
+-- =============================================================================
+
+ALTER TABLE prospects ADD COLUMN IF NOT EXISTS next_step_at TIMESTAMPTZ;
+
+-- Relleno de los que ya están en el Nido: la primera jugada sale ya,
+-- las siguientes 48h después de la última actualización
+UPDATE prospects
+SET next_step_at = CASE
+        WHEN COALESCE((nido_data->>'fase')::int, 0) = 0 THEN NOW()
+        ELSE updated_at + INTERVAL '48 hours'
+    END
+WHERE status = 'nutriendo' AND next_step_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_prospects_nutriendo_next_step
+    ON prospects (next_step_at)
+    WHERE status = 'nutriendo';
@@ -0,0 +1,25 @@
+-- =============================================================================
+--  006: Memoria de conversaciones del Nido (memoria_chat.py)
+--  conversation_turns: bitácora append-only, un renglón por mensaje.
+--  conversation_summaries: resumen acumulado de todo lo anterior a
+--  `summarized_until` (id del último turno ya resumido). Al modelo le llega
+--  resumen + últimos N turnos: el prompt no crece con la conversación.
+-- =============================================================================
+
+CREATE TABLE IF NOT EXISTS conversation_turns (
+    id            BIGSERIAL PRIMARY KEY,
+    session_token TEXT NOT NULL,
+    role          TEXT NOT NULL CHECK (role IN ('user', 'ai')),
+    content       TEXT NOT NULL,
+    created_at    TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_conversation_turns_sesion
+    ON conversation_turns (session_token, id);
+
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    session_token    TEXT PRIMARY KEY,
+    summary          TEXT NOT NULL,
+    summarized_until BIGINT NOT NULL,
+    updated_at       TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,191 @@
+-- =============================================================================
+--  007: Resumen (rollup) de estadísticas por campaña
+--  Los dashboards (/api/dashboard-data, /api/mis-campanas) leen estas tablas:
+--  O(campañas) filas en vez de contar toda la tabla prospects en cada carga.
+--
+--  campaign_stats          : totales por campaña (encontrados, calificados)
+--  campaign_stats_estado   : prospectos por campaña y estado (embudo)
+--  campaign_stats_diarias  : encontrados y calificados por campaña y día
+--
+--  Las mantienen triggers POR SENTENCIA con tablas de transición: un lote de
+--  200 inserts del Cazador (execute_values) es UNA actualización por campaña,
+--  no 200. "calificado" = interactions_count >= 3 (misma regla que el Nutridor).
+-- =============================================================================
+
+CREATE TABLE IF NOT EXISTS campaign_stats (
+    campaign_id  TEXT PRIMARY KEY,
+    encontrados  BIGINT NOT NULL DEFAULT 0,
+    calificados  BIGINT NOT NULL DEFAULT 0,
+    actualizado  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS campaign_stats_estado (
+    campaign_id  TEXT NOT NULL,
+    status       TEXT NOT NULL,
+    cantidad     BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (campaign_id, status)
+);
+
+CREATE TABLE IF NOT EXISTS campaign_stats_diarias (
+    campaign_id  TEXT NOT NULL,
+    dia          DATE NOT NULL,
+    encontrados  BIGINT NOT NULL DEFAULT 0,
+    calificados  BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (campaign_id, dia)
+);
+
+-- -----------------------------------------------------------------------------
+-- Aplica una lista de deltas [{campaign_id, status, n, calificado, dia, encontrado}, ...]
+-- n          : +1/-1 al conteo del estado (y al total de encontrados de la campaña)
+-- calificado : +1/-1 cuando un prospecto entra/sale de "calificado"
+-- encontrado : +1/-1 al día en que el prospecto fue creado
+-- Orden fijo por clave para que sentencias concurrentes no se bloqueen en cruz.
+-- -----------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION aplicar_deltas_stats(p_deltas jsonb)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF p_deltas IS NULL THEN RETURN; END IF;
+
+    INSERT INTO campaign_stats AS s (campaign_id, encontrados, calificados, actualizado)
+    SELECT d.campaign_id, SUM(d.n), SUM(d.calificado), NOW()
+    FROM jsonb_to_recordset(p_deltas) AS d(campaign_id text, status text, n int, calificado int, dia date, encontrado int)
+    WHERE d.campaign_id IS NOT NULL
+    GROUP BY d.campaign_id
+    HAVING SUM(d.n) <> 0 OR SUM(d.calificado) <> 0
+    ORDER BY d.campaign_id
+    ON CONFLICT (campaign_id) DO UPDATE
+    SET encontrados = s.encontrados + EXCLUDED.encontrados,
+        calificados = s.calificados + EXCLUDED.calificados,
+        actualizado = NOW();
+
+    INSERT INTO campaign_stats_estado AS s (campaign_id, status, cantidad)
+    SELECT d.campaign_id, d.status, SUM(d.n)
+    FROM jsonb_to_recordset(p_deltas) AS d(campaign_id text, status text, n int, calificado int, dia date, encontrado int)
+    WHERE d.campaign_id IS NOT NULL AND d.status IS NOT NULL
+    GROUP BY d.campaign_id, d.status
+    HAVING SUM(d.n) <> 0
+    ORDER BY d.campaign_id, d.status
+    ON CONFLICT (campaign_id, status) DO UPDATE
+    SET cantidad = s.cantidad + EXCLUDED.cantidad;
+
+    INSERT INTO campaign_stats_diarias AS s (campaign_id, dia, encontrados, calificados)
+    SELECT d.campaign_id, d.dia, SUM(d.encontrado), SUM(d.calificado)
+    FROM jsonb_to_recordset(p_deltas) AS d(campaign_id text, status text, n int, calificado int, dia date, encontrado int)
+    WHERE d.campaign_id IS NOT NULL
+    GROUP BY d.campaign_id, d.dia
+    HAVING SUM(d.encontrado) <> 0 OR SUM(d.calificado) <> 0
+    ORDER BY d.campaign_id, d.dia
+    ON CONFLICT (campaign_id, dia) DO UPDATE
+    SET encontrados = s.encontrados + EXCLUDED.encontrados,
+        calificados = s.calificados + EXCLUDED.calificados;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION stats_prospectos_insert()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM aplicar_deltas_stats((
+        SELECT jsonb_agg(d) FROM (
+            SELECT n.campaign_id::text AS campaign_id, n.status, 1 AS n,
+                   (COALESCE(n.interactions_count, 0) >= 3)::int AS calificado,
+                   COALESCE(n.created_at::date, CURRENT_DATE) AS dia, 1 AS encontrado
+            FROM nuevas n
+        ) d
+    ));
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION stats_prospectos_delete()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM aplicar_deltas_stats((
+        SELECT jsonb_agg(d) FROM (
+            SELECT o.campaign_id::text AS campaign_id, o.status, -1 AS n,
+                   -(COALESCE(o.interactions_count, 0) >= 3)::int AS calificado,
+                   COALESCE(o.created_at::date, CURRENT_DATE) AS dia, -1 AS encontrado
+            FROM viejas o
+        ) d
+    ));
+    RETURN NULL;
+END;
+$$;
+
+-- Solo las filas que cambiaron de estado, de campaña o de "calificado" generan deltas.
+-- Un cambio de calificación cuenta el día en que ocurre.
+CREATE OR REPLACE FUNCTION stats_prospectos_update()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM aplicar_deltas_stats((
+        SELECT jsonb_agg(d) FROM (
+            WITH cambios AS (
+                SELECT o.campaign_id AS c_vieja, o.status AS s_viejo, (COALESCE(o.interactions_count, 0) >= 3) AS q_viejo,
+                       n.campaign_id AS c_nueva, n.status AS s_nuevo, (COALESCE(n.interactions_count, 0) >= 3) AS q_nuevo
+                FROM viejas o
+                JOIN nuevas n ON n.id = o.id
+                WHERE (o.campaign_id, o.status, COALESCE(o.interactions_count, 0) >= 3)
+                      IS DISTINCT FROM
+                      (n.campaign_id, n.status, COALESCE(n.interactions_count, 0) >= 3)
+            )
+            SELECT c_vieja::text AS campaign_id, s_viejo AS status, -1 AS n,
+                   -(q_viejo)::int AS calificado, CURRENT_DATE AS dia, 0 AS encontrado
+            FROM cambios
+            UNION ALL
+            SELECT c_nueva::text, s_nuevo, 1, (q_nuevo)::int, CURRENT_DATE, 0
+            FROM cambios
+        ) d
+    ));
+    RETURN NULL;
+END;
+$$;
+
+-- Relleno inicial bajo candado: nadie escribe prospects entre el conteo y los triggers
+LOCK TABLE prospects IN SHARE ROW EXCLUSIVE MODE;
+
+DROP TRIGGER IF EXISTS prospects_stats_insert ON prospects;
+CREATE TRIGGER prospects_stats_insert
+    AFTER INSERT ON prospects
+    REFERENCING NEW TABLE AS nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION stats_prospectos_insert();
+
+DROP TRIGGER IF EXISTS prospects_stats_update ON prospects;
+CREATE TRIGGER prospects_stats_update
+    AFTER UPDATE ON prospects
+    REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION stats_prospectos_update();
+
+DROP TRIGGER IF EXISTS prospects_stats_delete ON prospects;
+CREATE TRIGGER prospects_stats_delete
+    AFTER DELETE ON prospects
+    REFERENCING OLD TABLE AS viejas
+    FOR EACH STATEMENT EXECUTE FUNCTION stats_prospectos_delete();
+
+TRUNCATE campaign_stats, campaign_stats_estado, campaign_stats_diarias;
+
+INSERT INTO campaign_stats (campaign_id, encontrados, calificados)
+SELECT campaign_id::text, COUNT(*), COUNT(*) FILTER (WHERE COALESCE(interactions_count, 0) >= 3)
+FROM prospects
+WHERE campaign_id IS NOT NULL
+GROUP BY campaign_id;
+
+INSERT INTO campaign_stats_estado (campaign_id, status, cantidad)
+SELECT campaign_id::text, status, COUNT(*)
+FROM prospects
+WHERE campaign_id IS NOT NULL AND status IS NOT NULL
+GROUP BY campaign_id, status;
+
+-- Histórico: la fecha de calificación no se guardaba; se atribuye al día de creación
+INSERT INTO campaign_stats_diarias (campaign_id, dia, encontrados, calificados)
+SELECT campaign_id::text, COALESCE(created_at::date, CURRENT_DATE), COUNT(*),
+       COUNT(*) FILTER (WHERE COALESCE(interactions_count, 0) >= 3)
+FROM prospects
+WHERE campaign_id IS NOT NULL
+GROUP BY 1, 2;
@@ -0,0 +1,75 @@
+-- =============================================================================
+--  008: Índices de las consultas calientes del pipeline + clave anti-duplicados
+--  `python migrador.py verificar` comprueba con EXPLAIN que se usan.
+--
+--  idx_prospects_cola                : reclamos de Espía / Analista / Persuasor
+--                                      (solo estados de cola: índice chico)
+--  idx_prospects_campana_estado_fecha: presupuesto mensual y "cazados hoy"
+--  idx_prospects_access_token        : entrada al Nido por token (único)
+--  idx_prospects_dedupe              : ON CONFLICT del Cazador por campaña
+-- =============================================================================
+
+CREATE INDEX IF NOT EXISTS idx_prospects_cola
+    ON prospects (status, campaign_id)
+    WHERE status IN ('cazado', 'espiando', 'espiado', 'analizando', 'analizado_exitoso', 'persuadiendo');
+
+CREATE INDEX IF NOT EXISTS idx_prospects_campana_estado_fecha
+    ON prospects (campaign_id, status, created_at);
+
+-- Único si los tokens actuales lo permiten; si hay repetidos, índice normal y aviso
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM prospects WHERE access_token IS NOT NULL
+        GROUP BY access_token HAVING COUNT(*) > 1
+    ) THEN
+        RAISE WARNING 'prospects.access_token tiene repetidos: se crea un índice NO único';
+        CREATE INDEX IF NOT EXISTS idx_prospects_access_token ON prospects (access_token);
+    ELSE
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_prospects_access_token
+            ON prospects (access_token) WHERE access_token IS NOT NULL;
+    END IF;
+END $$;
+
+-- -----------------------------------------------------------------------------
+-- Clave anti-duplicados: mismo nombre + web + teléfono (normalizados) = mismo negocio.
+-- El Cazador la calcula en el INSERT con esta misma función (una sola definición).
+-- -----------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION clave_dedupe_prospecto(p_nombre text, p_web text, p_telefono text)
+RETURNS text
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT md5(concat_ws('|',
+        lower(regexp_replace(btrim(COALESCE(p_nombre, '')), '\s+', ' ', 'g')),
+        lower(regexp_replace(regexp_replace(btrim(COALESCE(p_web, '')), '^https?://(www\.)?', '', 'i'), '/+$', '')),
+        regexp_replace(COALESCE(p_telefono, ''), '\D', '', 'g')
+    ));
+$$;
+
+ALTER TABLE prospects ADD COLUMN IF NOT EXISTS dedupe_key TEXT;
+
+-- Relleno: el prospecto más viejo de cada grupo se queda la clave; los duplicados
+-- históricos quedan con NULL (no se borran datos) y no bloquean el índice único.
+UPDATE prospects p
+SET dedupe_key = k.clave
+FROM (
+    SELECT id, campaign_id, clave,
+           row_number() OVER (PARTITION BY campaign_id, clave ORDER BY created_at, id) AS orden
+    FROM (
+        SELECT id, campaign_id, created_at,
+               clave_dedupe_prospecto(business_name, website_url, phone_number) AS clave
+        FROM prospects
+        WHERE dedupe_key IS NULL
+    ) s
+) k
+WHERE p.id = k.id
+AND k.orden = 1
+AND NOT EXISTS (
+    SELECT 1 FROM prospects q
+    WHERE q.campaign_id = k.campaign_id AND q.dedupe_key = k.clave
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_prospects_dedupe
+    ON prospects (campaign_id, dedupe_key)
+    WHERE dedupe_key IS NOT NULL;
@@ -0,0 +1,160 @@
+-- =============================================================================
+--  009: Contadores diarios por campaña para presupuesto y cuotas
+--  campaign_stats_diarias (007) suma EVENTOS del día, que no se deshacen cuando
+--  el prospecto sigue avanzando de estado:
+--      cazados     : filas ingresadas por el Cazador (lo que cuesta Apify)
+--      analizados  : salieron de la cola del Analista (exitoso o descartado)
+--      persuadidos : llegaron a 'persuadido'
+--      facturables : llegaron a 'validado_facturable'
+--  El presupuesto mensual y la meta de hoy pasan a ser lecturas por clave
+--  primaria, en vez de contar prospects en estado 'cazado' (que además dejaba
+--  de contar a los que ya habían avanzado).
+-- =============================================================================
+
+ALTER TABLE campaign_stats_diarias ADD COLUMN IF NOT EXISTS cazados     BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE campaign_stats_diarias ADD COLUMN IF NOT EXISTS analizados  BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE campaign_stats_diarias ADD COLUMN IF NOT EXISTS persuadidos BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE campaign_stats_diarias ADD COLUMN IF NOT EXISTS facturables BIGINT NOT NULL DEFAULT 0;
+
+-- Mismos deltas que en 007 + los cuatro eventos del día (claves ausentes = 0)
+CREATE OR REPLACE FUNCTION aplicar_deltas_stats(p_deltas jsonb)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF p_deltas IS NULL THEN RETURN; END IF;
+
+    INSERT INTO campaign_stats AS s (campaign_id, encontrados, calificados, actualizado)
+    SELECT d.campaign_id, COALESCE(SUM(d.n), 0), COALESCE(SUM(d.calificado), 0), NOW()
+    FROM jsonb_to_recordset(p_deltas) AS d(campaign_id text, status text, n int, calificado int, dia date, encontrado int)
+    WHERE d.campaign_id IS NOT NULL
+    GROUP BY d.campaign_id
+    HAVING COALESCE(SUM(d.n), 0) <> 0 OR COALESCE(SUM(d.calificado), 0) <> 0
+    ORDER BY d.campaign_id
+    ON CONFLICT (campaign_id) DO UPDATE
+    SET encontrados = s.encontrados + EXCLUDED.encontrados,
+        calificados = s.calificados + EXCLUDED.calificados,
+        actualizado = NOW();
+
+    INSERT INTO campaign_stats_estado AS s (campaign_id, status, cantidad)
+    SELECT d.campaign_id, d.status, SUM(d.n)
+    FROM jsonb_to_recordset(p_deltas) AS d(campaign_id text, status text, n int)
+    WHERE d.campaign_id IS NOT NULL AND d.status IS NOT NULL
+    GROUP BY d.campaign_id, d.status
+    HAVING SUM(d.n) <> 0
+    ORDER BY d.campaign_id, d.status
+    ON CONFLICT (campaign_id, status) DO UPDATE
+    SET cantidad = s.cantidad + EXCLUDED.cantidad;
+
+    INSERT INTO campaign_stats_diarias AS s
+        (campaign_id, dia, encontrados, calificados, cazados, analizados, persuadidos, facturables)
+    SELECT d.campaign_id, d.dia,
+           COALESCE(SUM(d.encontrado), 0), COALESCE(SUM(d.calificado), 0),
+           COALESCE(SUM(d.cazado), 0), COALESCE(SUM(d.analizado), 0),
+           COALESCE(SUM(d.persuadido), 0), COALESCE(SUM(d.facturable), 0)
+    FROM jsonb_to_recordset(p_deltas) AS d(campaign_id text, dia date, encontrado int, calificado int,
+                                           cazado int, analizado int, persuadido int, facturable int)
+    WHERE d.campaign_id IS NOT NULL
+    GROUP BY d.campaign_id, d.dia
+    HAVING COALESCE(SUM(d.encontrado), 0) <> 0 OR COALESCE(SUM(d.calificado), 0) <> 0
+        OR COALESCE(SUM(d.cazado), 0) <> 0 OR COALESCE(SUM(d.analizado), 0) <> 0
+        OR COALESCE(SUM(d.persuadido), 0) <> 0 OR COALESCE(SUM(d.facturable), 0) <> 0
+    ORDER BY d.campaign_id, d.dia
+    ON CONFLICT (campaign_id, dia) DO UPDATE
+    SET encontrados = s.encontrados + EXCLUDED.encontrados,
+        calificados = s.calificados + EXCLUDED.calificados,
+        cazados     = s.cazados + EXCLUDED.cazados,
+        analizados  = s.analizados + EXCLUDED.analizados,
+        persuadidos = s.persuadidos + EXCLUDED.persuadidos,
+        facturables = s.facturables + EXCLUDED.facturables;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION stats_prospectos_insert()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM aplicar_deltas_stats((
+        SELECT jsonb_agg(d) FROM (
+            SELECT n.campaign_id::text AS campaign_id, n.status, 1 AS n,
+                   (COALESCE(n.interactions_count, 0) >= 3)::int AS calificado,
+                   COALESCE(n.created_at::date, CURRENT_DATE) AS dia, 1 AS encontrado,
+                   1 AS cazado,
+                   (n.status IN ('analizado_exitoso', 'descartado'))::int AS analizado,
+                   (n.status = 'persuadido')::int AS persuadido,
+                   (n.status = 'validado_facturable')::int AS facturable
+            FROM nuevas n
+        ) d
+    ));
+    RETURN NULL;
+END;
+$$;
+
+-- Los eventos son historia: borrar un prospecto no devuelve presupuesto
+-- (stats_prospectos_delete de 007 solo toca encontrados/calificados)
+
+-- Un prospecto "se analiza" al salir de los estados previos al Analista; así
+-- devolverlo de 'persuadiendo' a 'analizado_exitoso' no cuenta dos veces.
+CREATE OR REPLACE FUNCTION stats_prospectos_update()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM aplicar_deltas_stats((
+        SELECT jsonb_agg(d) FROM (
+            WITH cambios AS (
+                SELECT o.campaign_id AS c_vieja, o.status AS s_viejo, (COALESCE(o.interactions_count, 0) >= 3) AS q_viejo,
+                       n.campaign_id AS c_nueva, n.status AS s_nuevo, (COALESCE(n.interactions_count, 0) >= 3) AS q_nuevo
+                FROM viejas o
+                JOIN nuevas n ON n.id = o.id
+                WHERE (o.campaign_id, o.status, COALESCE(o.interactions_count, 0) >= 3)
+                      IS DISTINCT FROM
+                      (n.campaign_id, n.status, COALESCE(n.interactions_count, 0) >= 3)
+            )
+            SELECT c_vieja::text AS campaign_id, s_viejo AS status, -1 AS n,
+                   -(q_viejo)::int AS calificado, CURRENT_DATE AS dia, 0 AS encontrado,
+                   0 AS cazado, 0 AS analizado, 0 AS persuadido, 0 AS facturable
+            FROM cambios
+            UNION ALL
+            SELECT c_nueva::text, s_nuevo, 1, (q_nuevo)::int, CURRENT_DATE, 0,
+                   0,
+                   (COALESCE(s_viejo, 'cazado') IN ('cazado', 'espiando', 'espiado', 'analizando')
+                    AND s_nuevo IN ('analizado_exitoso', 'descartado'))::int,
+                   (s_nuevo = 'persuadido' AND s_viejo IS DISTINCT FROM 'persuadido')::int,
+                   (s_nuevo = 'validado_facturable' AND s_viejo IS DISTINCT FROM 'validado_facturable')::int
+            FROM cambios
+        ) d
+    ));
+    RETURN NULL;
+END;
+$$;
+
+-- Relleno aproximado del histórico: no se guardaba la fecha de cada transición,
+-- se usa created_at para cazados y updated_at para el resto.
+LOCK TABLE prospects IN SHARE ROW EXCLUSIVE MODE;
+
+UPDATE campaign_stats_diarias SET cazados = 0, analizados = 0, persuadidos = 0, facturables = 0;
+
+INSERT INTO campaign_stats_diarias AS s (campaign_id, dia, cazados, analizados, persuadidos, facturables)
+SELECT campaign_id, dia, SUM(cazado), SUM(analizado), SUM(persuadido), SUM(facturable)
+FROM (
+    SELECT campaign_id::text AS campaign_id, COALESCE(created_at::date, CURRENT_DATE) AS dia,
+           1 AS cazado, 0 AS analizado, 0 AS persuadido, 0 AS facturable
+    FROM prospects WHERE campaign_id IS NOT NULL
+    UNION ALL
+    SELECT campaign_id::text, COALESCE(updated_at::date, created_at::date, CURRENT_DATE),
+           0,
+           (status NOT IN ('cazado', 'espiando', 'espiado', 'analizando'))::int,
+           (status IN ('persuadido', 'nutriendo', 'validado_facturable', 'lead_frio'))::int,
+           (status = 'validado_facturable')::int
+    FROM prospects
+    WHERE campaign_id IS NOT NULL AND status IS NOT NULL
+    AND status NOT IN ('cazado', 'espiando', 'espiado', 'analizando')
+) eventos
+GROUP BY campaign_id, dia
+ON CONFLICT (campaign_id, dia) DO UPDATE
+SET cazados     = EXCLUDED.cazados,
+    analizados  = EXCLUDED.analizados,
+    persuadidos = EXCLUDED.persuadidos,
+    facturables = EXCLUDED.facturables;
@@ -0,0 +1,62 @@
+-- =============================================================================
+--  010: Identidad de negocios entre campañas
+--  Un mismo negocio llega una y otra vez (cada ciclo, y en varias campañas) con
+--  el nombre escrito distinto. Se reconoce por cualquiera de tres claves:
+--      dominio_canonico : 'acme.com' (sin esquema, www, ruta ni redes sociales)
+--      telefono_e164    : '+15551234567' (solo dígitos si no trae prefijo internacional)
+--      place_id         : raw_data->>'placeId' de Google Maps
+--  El Cazador las consulta en bloque antes de insertar (trabajador_cazador.py):
+--  misma campaña -> se descarta; otra campaña -> se reutiliza el email del Espía
+--  y, si el producto es el mismo, el veredicto del Analista.
+-- =============================================================================
+
+-- Hosts compartidos: una URL de Instagram/Facebook/acortadores no identifica a un negocio
+CREATE OR REPLACE FUNCTION dominio_canonico(p_url text)
+RETURNS text
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN h !~ '^[a-z0-9.-]+\.[a-z]{2,}$' THEN NULL
+        WHEN h ~ '(^|\.)(facebook\.com|fb\.com|instagram\.com|tiktok\.com|twitter\.com|x\.com|youtube\.com|linkedin\.com|linktr\.ee|wa\.me|whatsapp\.com|google\.com|g\.page|goo\.gl|bit\.ly|business\.site|wixsite\.com|blogspot\.com)$' THEN NULL
+        ELSE h
+    END
+    FROM (
+        SELECT regexp_replace(
+                   lower(split_part(split_part(split_part(split_part(
+                       regexp_replace(btrim(COALESCE(p_url, '')), '^[a-z][a-z0-9+.-]*://', '', 'i'),
+                   '/', 1), '?', 1), '#', 1), ':', 1)),
+               '^www\.', '') AS h
+    ) s;
+$$;
+
+CREATE OR REPLACE FUNCTION telefono_e164(p_telefono text)
+RETURNS text
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN length(d) < 7 THEN NULL
+        WHEN btrim(p_telefono) LIKE '+%' THEN '+' || d
+        WHEN d LIKE '00%' THEN '+' || substr(d, 3)
+        ELSE d
+    END
+    FROM (SELECT regexp_replace(COALESCE(p_telefono, ''), '\D', '', 'g') AS d) s;
+$$;
+
+ALTER TABLE prospects ADD COLUMN IF NOT EXISTS dominio_canonico TEXT;
+ALTER TABLE prospects ADD COLUMN IF NOT EXISTS telefono_e164 TEXT;
+ALTER TABLE prospects ADD COLUMN IF NOT EXISTS place_id TEXT;
+
+UPDATE prospects
+SET dominio_canonico = dominio_canonico(website_url),
+    telefono_e164 = telefono_e164(COALESCE(raw_data->>'phoneUnformatted', phone_number)),
+    place_id = NULLIF(raw_data->>'placeId', '')
+WHERE dominio_canonico IS NULL AND telefono_e164 IS NULL AND place_id IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_prospects_dominio_canonico
+    ON prospects (dominio_canonico) WHERE dominio_canonico IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_prospects_telefono_e164
+    ON prospects (telefono_e164) WHERE telefono_e164 IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_prospects_place_id
+    ON prospects (place_id) WHERE place_id IS NOT NULL;
@@ -0,0 +1,101 @@
+-- =============================================================================
+--  011: Limitador RPM/TPM de IA en Postgres (usado por ai_manager.LimitadorTokens)
+--  Un token bucket por modelo, compartido por TODAS las máquinas y procesos
+--  (gunicorn, orquestador, cada VM de fly). La fila se bloquea con FOR UPDATE
+--  solo durante la llamada, así dos procesos nunca gastan el mismo token.
+--  El backoff de 429 (fallos / bloqueo_hasta) vive en la misma fila y se
+--  limpia cuando incrementar_uso_ia anota éxitos de ese modelo.
+-- =============================================================================
+
+CREATE TABLE IF NOT EXISTS ai_rate_buckets (
+    model_id      TEXT PRIMARY KEY,
+    rpm           DOUBLE PRECISION NOT NULL DEFAULT 0,
+    tpm           DOUBLE PRECISION NOT NULL DEFAULT 0,
+    actualizado   TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp(),
+    bloqueo_hasta TIMESTAMPTZ,
+    fallos        INTEGER NOT NULL DEFAULT 0
+);
+
+-- Consume 1 petición + p_tokens del cubo. Devuelve 0 si pasó, o los segundos a esperar.
+CREATE OR REPLACE FUNCTION consumir_cupo_ia(p_model_id text, p_rpm int, p_tpm int, p_tokens int)
+RETURNS double precision
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    c ai_rate_buckets%ROWTYPE;
+    ahora timestamptz := clock_timestamp();
+    transcurrido double precision;
+    tokens double precision := LEAST(p_tokens, p_tpm);
+    espera double precision := 0;
+BEGIN
+    INSERT INTO ai_rate_buckets (model_id, rpm, tpm, actualizado)
+    VALUES (p_model_id, p_rpm, p_tpm, ahora)
+    ON CONFLICT (model_id) DO NOTHING;
+
+    SELECT * INTO c FROM ai_rate_buckets WHERE model_id = p_model_id FOR UPDATE;
+
+    transcurrido := GREATEST(EXTRACT(EPOCH FROM ahora - c.actualizado), 0);
+    c.rpm := LEAST(p_rpm, c.rpm + transcurrido * p_rpm / 60.0);
+    c.tpm := LEAST(p_tpm, c.tpm + transcurrido * p_tpm / 60.0);
+
+    IF c.bloqueo_hasta > ahora THEN
+        espera := EXTRACT(EPOCH FROM c.bloqueo_hasta - ahora);
+    ELSIF c.rpm >= 1 AND c.tpm >= tokens THEN
+        c.rpm := c.rpm - 1;
+        c.tpm := c.tpm - tokens;
+    ELSE
+        espera := GREATEST(
+            CASE WHEN c.rpm < 1 THEN (1 - c.rpm) * 60.0 / p_rpm ELSE 0 END,
+            CASE WHEN c.tpm < tokens THEN (tokens - c.tpm) * 60.0 / p_tpm ELSE 0 END
+        );
+    END IF;
+
+    UPDATE ai_rate_buckets SET rpm = c.rpm, tpm = c.tpm, actualizado = ahora
+    WHERE model_id = p_model_id;
+    RETURN espera;
+END;
+$$;
+
+-- 429 transitorio: backoff exponencial (p_base, 2x, 4x... máx p_maximo). Devuelve los segundos.
+CREATE OR REPLACE FUNCTION penalizar_ia(p_model_id text, p_base int, p_maximo int)
+RETURNS double precision
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    espera double precision;
+BEGIN
+    INSERT INTO ai_rate_buckets (model_id) VALUES (p_model_id)
+    ON CONFLICT (model_id) DO NOTHING;
+
+    UPDATE ai_rate_buckets
+    SET fallos = fallos + 1,
+        bloqueo_hasta = clock_timestamp() + LEAST(p_base * 2 ^ fallos, p_maximo) * INTERVAL '1 second'
+    WHERE model_id = p_model_id
+    RETURNING LEAST(p_base * 2 ^ (fallos - 1), p_maximo) INTO espera;
+    RETURN espera;
+END;
+$$;
+
+-- Igual que 001, y además un éxito anotado levanta el backoff de ese modelo
+-- (antes lo hacía cada proceso con su propio set de penalizados).
+CREATE OR REPLACE FUNCTION incrementar_uso_ia(p_incrementos jsonb)
+RETURNS void
+LANGUAGE sql
+AS $$
+    UPDATE ai_models m
+    SET usage_today = CASE
+            WHEN m.last_usage_date = CURRENT_DATE THEN COALESCE(m.usage_today, 0) + d.cantidad
+            ELSE d.cantidad
+        END,
+        last_usage_date = CURRENT_DATE
+    FROM (
+        SELECT key AS model_id, value::int AS cantidad
+        FROM jsonb_each_text(p_incrementos)
+    ) d
+    WHERE m.id::text = d.model_id;
+
+    UPDATE ai_rate_buckets b
+    SET fallos = 0, bloqueo_hasta = NULL
+    FROM jsonb_each_text(p_incrementos) d
+    WHERE b.model_id = d.key AND b.fallos > 0;
+$$;
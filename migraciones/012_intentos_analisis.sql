@@ -0,0 +1,11 @@
+-- =============================================================================
+--  012: Reintentos acotados del Analista
+--  intentos_analisis      : cuántas veces se reclamó el prospecto para analizar.
+--                           Al llegar a ANALISTA_MAX_INTENTOS pasa a
+--                           'error_analisis' (no cuenta como analizado).
+--  estado_previo_analisis : de dónde lo sacó el reclamo ('cazado' / 'espiado'),
+--                           para devolverlo AHÍ si la IA falla.
+-- =============================================================================
+
+ALTER TABLE prospects ADD COLUMN IF NOT EXISTS intentos_analisis INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE prospects ADD COLUMN IF NOT EXISTS estado_previo_analisis TEXT;
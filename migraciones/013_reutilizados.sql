@@ -0,0 +1,93 @@
+-- =============================================================================
+--  013: Prospectos reutilizados de otra campaña (EscritorProspectos, migraciones/010)
+--  El Cazador puede insertar un negocio ya conocido heredando el email del Espía
+--  o directamente el veredicto del Analista ('analizado_exitoso' / 'descartado').
+--  Esos no pasaron por el Analista: el trigger de INSERT de 009 los contaba como
+--  `analizados`. Ahora llegan con prospects.reutilizado = TRUE y se cuentan
+--  aparte, en campaign_stats_diarias.reutilizados.
+--  (El histórico anterior no se puede distinguir: queda como estaba.)
+-- =============================================================================
+
+ALTER TABLE prospects ADD COLUMN IF NOT EXISTS reutilizado BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE campaign_stats_diarias ADD COLUMN IF NOT EXISTS reutilizados BIGINT NOT NULL DEFAULT 0;
+
+-- Igual que 009 + la clave `reutilizado` (ausente = 0)
+CREATE OR REPLACE FUNCTION aplicar_deltas_stats(p_deltas jsonb)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF p_deltas IS NULL THEN RETURN; END IF;
+
+    INSERT INTO campaign_stats AS s (campaign_id, encontrados, calificados, actualizado)
+    SELECT d.campaign_id, COALESCE(SUM(d.n), 0), COALESCE(SUM(d.calificado), 0), NOW()
+    FROM jsonb_to_recordset(p_deltas) AS d(campaign_id text, status text, n int, calificado int, dia date, encontrado int)
+    WHERE d.campaign_id IS NOT NULL
+    GROUP BY d.campaign_id
+    HAVING COALESCE(SUM(d.n), 0) <> 0 OR COALESCE(SUM(d.calificado), 0) <> 0
+    ORDER BY d.campaign_id
+    ON CONFLICT (campaign_id) DO UPDATE
+    SET encontrados = s.encontrados + EXCLUDED.encontrados,
+        calificados = s.calificados + EXCLUDED.calificados,
+        actualizado = NOW();
+
+    INSERT INTO campaign_stats_estado AS s (campaign_id, status, cantidad)
+    SELECT d.campaign_id, d.status, SUM(d.n)
+    FROM jsonb_to_recordset(p_deltas) AS d(campaign_id text, status text, n int)
+    WHERE d.campaign_id IS NOT NULL AND d.status IS NOT NULL
+    GROUP BY d.campaign_id, d.status
+    HAVING SUM(d.n) <> 0
+    ORDER BY d.campaign_id, d.status
+    ON CONFLICT (campaign_id, status) DO UPDATE
+    SET cantidad = s.cantidad + EXCLUDED.cantidad;
+
+    INSERT INTO campaign_stats_diarias AS s
+        (campaign_id, dia, encontrados, calificados, cazados, analizados, persuadidos, facturables, reutilizados)
+    SELECT d.campaign_id, d.dia,
+           COALESCE(SUM(d.encontrado), 0), COALESCE(SUM(d.calificado), 0),
+           COALESCE(SUM(d.cazado), 0), COALESCE(SUM(d.analizado), 0),
+           COALESCE(SUM(d.persuadido), 0), COALESCE(SUM(d.facturable), 0),
+           COALESCE(SUM(d.reutilizado), 0)
+    FROM jsonb_to_recordset(p_deltas) AS d(campaign_id text, dia date, encontrado int, calificado int,
+                                           cazado int, analizado int, persuadido int, facturable int,
+                                           reutilizado int)
+    WHERE d.campaign_id IS NOT NULL
+    GROUP BY d.campaign_id, d.dia
+    HAVING COALESCE(SUM(d.encontrado), 0) <> 0 OR COALESCE(SUM(d.calificado), 0) <> 0
+        OR COALESCE(SUM(d.cazado), 0) <> 0 OR COALESCE(SUM(d.analizado), 0) <> 0
+        OR COALESCE(SUM(d.persuadido), 0) <> 0 OR COALESCE(SUM(d.facturable), 0) <> 0
+        OR COALESCE(SUM(d.reutilizado), 0) <> 0
+    ORDER BY d.campaign_id, d.dia
+    ON CONFLICT (campaign_id, dia) DO UPDATE
+    SET encontrados  = s.encontrados + EXCLUDED.encontrados,
+        calificados  = s.calificados + EXCLUDED.calificados,
+        cazados      = s.cazados + EXCLUDED.cazados,
+        analizados   = s.analizados + EXCLUDED.analizados,
+        persuadidos  = s.persuadidos + EXCLUDED.persuadidos,
+        facturables  = s.facturables + EXCLUDED.facturables,
+        reutilizados = s.reutilizados + EXCLUDED.reutilizados;
+END;
+$$;
+
+-- Un reutilizado sigue contando como cazado (Apify lo cobró), pero no como analizado
+CREATE OR REPLACE FUNCTION stats_prospectos_insert()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM aplicar_deltas_stats((
+        SELECT jsonb_agg(d) FROM (
+            SELECT n.campaign_id::text AS campaign_id, n.status, 1 AS n,
+                   (COALESCE(n.interactions_count, 0) >= 3)::int AS calificado,
+                   COALESCE(n.created_at::date, CURRENT_DATE) AS dia, 1 AS encontrado,
+                   1 AS cazado,
+                   (n.status IN ('analizado_exitoso', 'descartado') AND NOT n.reutilizado)::int AS analizado,
+                   (n.status = 'persuadido')::int AS persuadido,
+                   (n.status = 'validado_facturable')::int AS facturable,
+                   (n.reutilizado)::int AS reutilizado
+            FROM nuevas n
+        ) d
+    ));
+    RETURN NULL;
+END;
+$$;
@@ -0,0 +1,9 @@
+-- =============================================================================
+--  014: Reintentos acotados del Persuasor (igual que 012 para el Analista)
+--  intentos_persuasion: cuántas veces se reclamó el prospecto para persuadir.
+--  Al llegar a PERSUASOR_MAX_INTENTOS sin salir de la cola (IA que falla o
+--  devuelve vacío) pasa a 'contacto_fallido' en vez de volver a
+--  'analizado_exitoso' para siempre.
+-- =============================================================================
+
+ALTER TABLE prospects ADD COLUMN IF NOT EXISTS intentos_persuasion INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,10 @@
+-- =============================================================================
+--  015: Reintentos acotados del Nutridor (igual que 012 / 014)
+--  intentos_jugada: reclamos seguidos sin jugada nueva (IA que falla, JSON
+--  ilegible o vacío). Cada reclamo empuja next_step_at MINUTOS_RECLAMO x 2^intentos
+--  (15, 30, 60... min) y una jugada guardada lo vuelve a 0. Al llegar a
+--  NUTRIDOR_MAX_INTENTOS el prospecto pasa a 'error_nutricion' en vez de
+--  reprogramarse cada 15 minutos para siempre.
+-- =============================================================================
+
+ALTER TABLE prospects ADD COLUMN IF NOT EXISTS intentos_jugada INTEGER NOT NULL DEFAULT 0;
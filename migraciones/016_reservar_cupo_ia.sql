@@ -0,0 +1,51 @@
+-- =============================================================================
+--  016: Reserva del limitador de IA por bloques (ai_manager.LimitadorTokens)
+--  consumir_cupo_ia (011) cobra 1 petición por RPC: un viaje a Supabase por
+--  cada llamada a Gemini. reservar_cupo_ia entrega hasta p_cantidad peticiones
+--  (de p_tokens cada una) en UN viaje; el proceso las gasta en memoria.
+--  Mismo cubo, mismo bloqueo de 429: si no alcanza ni para una, devuelve la espera.
+-- =============================================================================
+
+CREATE OR REPLACE FUNCTION reservar_cupo_ia(p_model_id text, p_rpm int, p_tpm int, p_tokens int, p_cantidad int)
+RETURNS TABLE (concedidas int, espera double precision)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    c ai_rate_buckets%ROWTYPE;
+    ahora timestamptz := clock_timestamp();
+    transcurrido double precision;
+    tokens double precision := GREATEST(LEAST(p_tokens, p_tpm), 1);
+BEGIN
+    concedidas := 0;
+    espera := 0;
+
+    INSERT INTO ai_rate_buckets (model_id, rpm, tpm, actualizado)
+    VALUES (p_model_id, p_rpm, p_tpm, ahora)
+    ON CONFLICT (model_id) DO NOTHING;
+
+    SELECT * INTO c FROM ai_rate_buckets WHERE model_id = p_model_id FOR UPDATE;
+
+    transcurrido := GREATEST(EXTRACT(EPOCH FROM ahora - c.actualizado), 0);
+    c.rpm := LEAST(p_rpm, c.rpm + transcurrido * p_rpm / 60.0);
+    c.tpm := LEAST(p_tpm, c.tpm + transcurrido * p_tpm / 60.0);
+
+    IF c.bloqueo_hasta > ahora THEN
+        espera := EXTRACT(EPOCH FROM c.bloqueo_hasta - ahora);
+    ELSE
+        concedidas := GREATEST(LEAST(p_cantidad, floor(c.rpm), floor(c.tpm / tokens)), 0);
+        IF concedidas > 0 THEN
+            c.rpm := c.rpm - concedidas;
+            c.tpm := c.tpm - concedidas * tokens;
+        ELSE
+            espera := GREATEST(
+                CASE WHEN c.rpm < 1 THEN (1 - c.rpm) * 60.0 / p_rpm ELSE 0 END,
+                CASE WHEN c.tpm < tokens THEN (tokens - c.tpm) * 60.0 / p_tpm ELSE 0 END
+            );
+        END IF;
+    END IF;
+
+    UPDATE ai_rate_buckets SET rpm = c.rpm, tpm = c.tpm, actualizado = ahora
+    WHERE model_id = p_model_id;
+    RETURN NEXT;
+END;
+$$;
@@ -0,0 +1,214 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import logging
+import conexion_db
+
+# ==============================================================================
+#  MIGRADOR DE ESQUEMA (migraciones/NNN_nombre.sql, en orden)
+#  Cada archivo se aplica UNA vez, en su propia transacción, y queda anotado en
+#  schema_migrations con su suma de control. Un candado consultivo de Postgres
+#  (pg_advisory_lock) garantiza que si arrancan varias máquinas a la vez solo
+#  una migra; las demás esperan y luego ven todo aplicado.
+#
+#      python migrador.py aplicar      # aplica lo pendiente (release de fly.io)
+#      python migrador.py estado       # aplicadas / pendientes / modificadas
+#      python migrador.py verificar    # EXPLAIN de las consultas calientes
+#
+#  Las migraciones deben ser idempotentes (IF NOT EXISTS / OR REPLACE): las
+#  bases que ya tenían 001..007 aplicadas a mano las re-corren sin daño.
+# ==============================================================================
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - MIGRADOR - %(levelname)s - %(message)s')
+
+CARPETA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migraciones")
+CLAVE_CANDADO = 4_281_007  # Cualquier entero fijo; compartido por todos los procesos
+
+PATRON_ARCHIVO = re.compile(r'^(\d+)_(.+)\.sql$')
+
+def archivos_migracion(carpeta=CARPETA):
+    """ [(version, nombre, ruta), ...] ordenados por número de versión. """
+    encontrados = []
+    for archivo in os.listdir(carpeta):
+        m = PATRON_ARCHIVO.match(archivo)
+        if m: encontrados.append((m.group(1), m.group(2), os.path.join(carpeta, archivo)))
+    return sorted(encontrados, key=lambda a: int(a[0]))
+
+def suma_control(sql):
+    return hashlib.sha256(sql.encode('utf-8')).hexdigest()
+
+def asegurar_tabla(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version     TEXT PRIMARY KEY,
+            nombre      TEXT NOT NULL,
+            checksum    TEXT NOT NULL,
+            aplicada_en TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """)
+
+def aplicadas(cur):
+    """ {version: checksum} de lo que ya corrió. """
+    cur.execute("SELECT version, checksum FROM schema_migrations")
+    return dict(cur.fetchall())
+
+def aplicar(carpeta=CARPETA):
+    """ Aplica las migraciones pendientes. Devuelve la lista de versiones aplicadas. """
+    nuevas = []
+    with conexion_db.conexion() as conn:
+        cur = conn.cursor()
+        # Candado de SESIÓN: sobrevive a los commits de cada migración
+        cur.execute("SELECT pg_advisory_lock(%s)", (CLAVE_CANDADO,))
+        try:
+            asegurar_tabla(cur)
+            conn.commit()
+            hechas = aplicadas(cur)
+            for version, nombre, ruta in archivos_migracion(carpeta):
+                with open(ruta, encoding='utf-8') as f:
+                    sql = f.read()
+                if version in hechas:
+                    if hechas[version] != suma_control(sql):
+                        logging.warning(f"⚠️ {version}_{nombre} cambió después de aplicarse (no se re-ejecuta).")
+                    continue
+
+                logging.info(f"🧱 Aplicando {version}_{nombre}...")
+                try:
+                    cur.execute(sql)
+                    cur.execute(
+                        "INSERT INTO schema_migrations (version, nombre, checksum) VALUES (%s, %s, %s)",
+                        (version, nombre, suma_control(sql))
+                    )
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    logging.error(f"❌ Falló {version}_{nombre}: {e}")
+                    raise
+                nuevas.append(version)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (CLAVE_CANDADO,))
+            conn.commit()
+            cur.close()
+
+    if nuevas: logging.info(f"✅ Migraciones aplicadas: {', '.join(nuevas)}")
+    else: logging.info("✅ Esquema al día.")
+    return nuevas
+
+def estado(carpeta=CARPETA):
+    """ [(version, nombre, 'aplicada' | 'pendiente' | 'modificada'), ...] """
+    with conexion_db.conexion() as conn, conn.cursor() as cur:
+        asegurar_tabla(cur)
+        hechas = aplicadas(cur)
+        conn.commit()
+    resultado = []
+    for version, nombre, ruta in archivos_migracion(carpeta):
+        with open(ruta, encoding='utf-8') as f:
+            sql = f.read()
+        if version not in hechas: situacion = 'pendiente'
+        elif hechas[version] != suma_control(sql): situacion = 'modificada'
+        else: situacion = 'aplicada'
+        resultado.append((version, nombre, situacion))
+    return resultado
+
+# --- VERIFICACIÓN DE ÍNDICES ---
+# Las consultas calientes son las MISMAS constantes que ejecutan los trabajadores
+# (nada de copias a mano). Se importan al verificar, no al migrar: `aplicar`
+# corre en el release y no necesita cargar los trabajadores.
+# (nombre, sql, parámetros, índice esperado). 'CAMPANA' se reemplaza por una campaña real.
+MINUTOS_RECLAMO = 15
+LOTE_PRUEBA = 40
+
+def consultas_calientes():
+    import main
+    import pipeline
+    import trabajador_analista
+    import trabajador_cazador
+    import trabajador_espia
+    import trabajador_nutridor
+    import trabajador_orquestador
+    import trabajador_persuasor
+
+    return [
+        ("analista.rendir_agotados", trabajador_analista.SQL_RENDIR_AGOTADOS,
+         ('CAMPANA', 'CAMPANA', MINUTOS_RECLAMO, 3), "idx_prospects_cola"),
+        ("analista.reclamar_lote", trabajador_analista.SQL_RECLAMAR_LOTE,
+         ('CAMPANA', 'CAMPANA', MINUTOS_RECLAMO, LOTE_PRUEBA), "idx_prospects_cola"),
+        ("espia.reclamar_objetivos", trabajador_espia.SQL_RECLAMAR_OBJETIVOS,
+         (None, None, MINUTOS_RECLAMO, LOTE_PRUEBA), "idx_prospects_cola"),
+        ("persuasor.rendir_agotados", trabajador_persuasor.SQL_RENDIR_AGOTADOS,
+         ('CAMPANA', 'CAMPANA', MINUTOS_RECLAMO, 3), "idx_prospects_cola"),
+        ("persuasor.reclamar_lote", trabajador_persuasor.SQL_RECLAMAR_LOTE,
+         ('CAMPANA', 'CAMPANA', MINUTOS_RECLAMO, LOTE_PRUEBA), "idx_prospects_cola"),
+        ("nutridor.rendir_agotados", trabajador_nutridor.SQL_RENDIR_AGOTADOS,
+         (None, None, 3), "idx_prospects_nutriendo_next_step"),
+        ("nutridor.reclamar_vencidos", trabajador_nutridor.SQL_RECLAMAR_VENCIDOS,
+         (MINUTOS_RECLAMO, None, None, LOTE_PRUEBA), "idx_prospects_nutriendo_next_step"),
+        ("pipeline.contar_pendientes", pipeline.SQL_CONTAR_PENDIENTES,
+         (['analizado_exitoso'],), "idx_prospects_cola"),
+        ("cazador.verificar_presupuesto_mensual", trabajador_cazador.SQL_PRESUPUESTO_MENSUAL,
+         ('CAMPANA',), "campaign_stats_diarias_pkey"),
+        ("orquestador.cazar_si_falta", trabajador_orquestador.SQL_CAZADOS_HOY,
+         ('CAMPANA',), "campaign_stats_diarias_pkey"),
+        ("cazador.consultar_conocidos", trabajador_cazador.SQL_CONSULTAR_CONOCIDOS,
+         ('CAMPANA', ['ejemplo.com'], ['+15550000000'], ['ChIJ0000'], 'CAMPANA'), "idx_prospects_dominio_canonico"),
+        ("nido.por_token", main.SQL_NIDO_POR_TOKEN,
+         ('00000000-0000-0000-0000-000000000000',), "idx_prospects_access_token"),
+    ]
+
+def _nodos(plan):
+    yield plan
+    for hijo in plan.get("Plans", []):
+        yield from _nodos(hijo)
+
+def verificar_indices():
+    """
+    EXPLAIN de cada consulta caliente con enable_seqscan = off: con tablas chicas
+    el planner prefiere leer todo, así que se comprueba que el índice SEA USABLE
+    (si no lo es, aparece un Seq Scan igual). Devuelve [(nombre, ok, detalle)].
+    """
+    resultados = []
+    with conexion_db.conexion() as conn, conn.cursor() as cur:
+        cur.execute("SELECT id FROM campaigns LIMIT 1")
+        fila = cur.fetchone()
+        campana = str(fila[0]) if fila else None
+        cur.execute("SET LOCAL enable_seqscan = off")
+        for nombre, sql, parametros, indice in consultas_calientes():
+            if campana is None and 'CAMPANA' in parametros and 'IS NULL OR' not in sql:
+                resultados.append((nombre, True, "sin campañas: no se puede probar"))
+                continue
+            parametros = tuple(campana if p == 'CAMPANA' else p for p in parametros)
+            cur.execute("SAVEPOINT explicar")
+            try:
+                cur.execute("EXPLAIN (FORMAT JSON) " + sql, parametros)
+                plan = cur.fetchone()[0]
+                if isinstance(plan, str): plan = json.loads(plan)
+                nodos = list(_nodos(plan[0]["Plan"]))
+                usados = {n["Index Name"] for n in nodos if "Index Name" in n}
+                secuenciales = [n for n in nodos if n["Node Type"] == "Seq Scan" and n.get("Relation Name") == "prospects"]
+                ok = indice in usados and not secuenciales
+                detalle = f"índices: {', '.join(sorted(usados)) or 'ninguno'}"
+                if secuenciales: detalle += " | Seq Scan sobre prospects"
+            except Exception as e:
+                cur.execute("ROLLBACK TO SAVEPOINT explicar")
+                ok, detalle = False, f"error: {e}"
+            resultados.append((nombre, ok, detalle))
+        conn.rollback()
+    return resultados
+
+if __name__ == "__main__":
+    comando = sys.argv[1] if len(sys.argv) > 1 else "aplicar"
+    if comando == "aplicar":
+        aplicar()
+    elif comando == "estado":
+        for version, nombre, situacion in estado():
+            print(f"{version}_{nombre}: {situacion}")
+    elif comando == "verificar":
+        fallas = 0
+        for nombre, ok, detalle in verificar_indices():
+            print(f"{'✅' if ok else '❌'} {nombre}: {detalle}")
+            if not ok: fallas += 1
+        sys.exit(1 if fallas else 0)
+    else:
+        print("Uso: python migrador.py [aplicar | estado | verificar]")
+        sys.exit(2)
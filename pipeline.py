@@ -0,0 +1,174 @@
+import os
+import logging
+import threading
+import conexion_db
+
+from trabajador_espia import ejecutar_espia
+from trabajador_analista import trabajar_analista_concurrente
+from trabajador_persuasor import trabajar_persuasor
+
+# ==============================================================================
+#  PIPELINE POR ETAPAS (ORQUESTADOR_MODO=pipeline)
+#  En vez de correr cazador → espía → analista → persuasor → nutridor en fila
+#  para cada campaña, cada etapa es un consumidor de larga vida de SU cola de
+#  estado, con su propia concurrencia:
+#
+#      cazador   -> produce 'cazado'
+#      espía     : 'cazado'            -> 'espiado'
+#      analista  : 'espiado'           -> 'analizado_exitoso' / 'descartado'
+#      persuasor : 'analizado_exitoso' -> 'persuadido' / 'contacto_fallido'
+#      nutridor  : 'nutriendo'         -> 'validado_facturable' / 'lead_frio' / 'error_nutricion'
+#
+#  - Los reclamos usan FOR UPDATE SKIP LOCKED (varios hilos por etapa sin choques).
+#  - Contrapresión: si la cola de SALIDA de una etapa pasa de PIPELINE_MAX_PENDIENTES,
+#    la etapa espera a que la siguiente se ponga al día.
+#  - Un Apify lento solo frena al cazador; análisis y nutrición siguen solos.
+# ==============================================================================
+
+MAX_PENDIENTES = int(os.environ.get("PIPELINE_MAX_PENDIENTES", 500))
+PAUSA_VACIA_SEGUNDOS = int(os.environ.get("PIPELINE_PAUSA_VACIA", 30))
+PAUSA_ERROR_SEGUNDOS = 60
+# Lease del cazador sobre una campaña: cubre una corrida de Apify completa
+LEASE_CAZA_SEGUNDOS = 1800
+
+def _hilos(etapa, por_defecto):
+    return int(os.environ.get(f"PIPELINE_HILOS_{etapa.upper()}", por_defecto))
+
+SQL_CONTAR_PENDIENTES = "SELECT COUNT(*) FROM prospects WHERE status = ANY(%s)"
+
+def contar_pendientes(estados):
+    """ Profundidad de una cola: prospectos en cualquiera de esos estados. """
+    with conexion_db.conexion() as conn, conn.cursor() as cur:
+        cur.execute(SQL_CONTAR_PENDIENTES, (list(estados),))
+        return cur.fetchone()[0]
+
+class Etapa:
+    """
+    Consumidor de larga vida. `trabajo()` procesa un lote y devuelve cuántos
+    prospectos movió; si devuelve 0 la etapa duerme hasta `pausa_vacia`
+    o hasta que alguien la despierte (despertar()). `pausa_minima` obliga a
+    descansar incluso tras un lote con trabajo (ej: no relanzar Apify en seguida).
+    """
+    def __init__(self, nombre, trabajo, hilos=1, cola_salida=(), max_pendientes=MAX_PENDIENTES,
+                 pausa_vacia=PAUSA_VACIA_SEGUNDOS, pausa_minima=0, requiere_ia=None):
+        self.nombre = nombre
+        self.trabajo = trabajo
+        self.hilos = max(0, hilos)
+        self.cola_salida = tuple(cola_salida)
+        self.max_pendientes = max_pendientes
+        self.pausa_vacia = pausa_vacia
+        self.pausa_minima = pausa_minima
+        self.requiere_ia = requiere_ia # callable -> bool (el Gobernador)
+        self._aviso = threading.Event()
+        self._lock = threading.Lock()
+        self.metricas = {"procesados": 0, "lotes": 0, "errores": 0, "frenadas": 0}
+
+    def despertar(self):
+        self._aviso.set()
+
+    def _dormir(self, detener, segundos):
+        # Se corta antes si piden apagar o si llega un aviso
+        if self._aviso.wait(segundos): self._aviso.clear()
+        return not detener.is_set()
+
+    def saturada(self):
+        if not self.cola_salida or not self.max_pendientes: return False
+        try:
+            return contar_pendientes(self.cola_salida) >= self.max_pendientes
+        except Exception as e:
+            logging.error(f"⚠️ Etapa {self.nombre}: no se pudo medir la cola de salida: {e}")
+            return False
+
+    def _sumar(self, clave, n=1):
+        with self._lock:
+            self.metricas[clave] += n
+
+    def _bucle(self, detener):
+        while not detener.is_set():
+            if self.saturada():
+                self._sumar("frenadas")
+                logging.info(f"🚧 Etapa {self.nombre}: cola de salida llena. Esperando a la siguiente etapa.")
+                self._dormir(detener, self.pausa_vacia)
+                continue
+            if self.requiere_ia and not self.requiere_ia():
+                self._dormir(detener, self.pausa_vacia)
+                continue
+            try:
+                movidos = self.trabajo() or 0
+            except Exception as e:
+                self._sumar("errores")
+                logging.error(f"🔥 Etapa {self.nombre}: {e}")
+                self._dormir(detener, PAUSA_ERROR_SEGUNDOS)
+                continue
+            self._sumar("lotes")
+            self._sumar("procesados", movidos)
+            # Lote con trabajo: vamos por el siguiente sin esperar
+            if not movidos:
+                # Los avisos que llegaron durante un lote vacío o fallido son casi siempre
+                # nuestras propias devoluciones a la cola: no deben relanzarnos en caliente
+                self._aviso.clear()
+                self._dormir(detener, self.pausa_vacia)
+            elif self.pausa_minima:
+                self._dormir(detener, self.pausa_minima)
+
+    def iniciar(self, detener):
+        hilos = []
+        for i in range(self.hilos):
+            hilo = threading.Thread(target=self._bucle, args=(detener,), name=f"etapa-{self.nombre}-{i}", daemon=True)
+            hilo.start()
+            hilos.append(hilo)
+        return hilos
+
+class PipelineEtapas:
+    def __init__(self, orquestador):
+        self.orquestador = orquestador
+        self.detener_evento = threading.Event()
+        self._hilos = []
+        ia = orquestador.verificar_salud_global_ia
+        self.etapas = {
+            "cazador": Etapa("cazador", self.cazar, _hilos("cazador", 1), cola_salida=("cazado",),
+                             pausa_vacia=PAUSA_VACIA_SEGUNDOS * 20, pausa_minima=PAUSA_VACIA_SEGUNDOS * 20),
+            "espia": Etapa("espia", ejecutar_espia, _hilos("espia", 2), cola_salida=("espiado",)),
+            "analista": Etapa("analista", trabajar_analista_concurrente, _hilos("analista", 2),
+                              cola_salida=("analizado_exitoso",), requiere_ia=ia),
+            "persuasor": Etapa("persuasor", trabajar_persuasor, _hilos("persuasor", 1), requiere_ia=ia),
+            # El Nido va a ritmo de 48h: sin vencidos, el Nutridor no tiene apuro
+            "nutridor": Etapa("nutridor", orquestador.nutridor.ejecutar_ciclo_seguimiento, _hilos("nutridor", 1),
+                              pausa_vacia=PAUSA_VACIA_SEGUNDOS * 10, requiere_ia=ia),
+        }
+
+    def cazar(self):
+        """ Una pasada del cazador por las campañas activas (con lease, como el modo paralelo). """
+        cazadas = 0
+        for campana in self.orquestador.obtener_campanas_activas():
+            if self.detener_evento.is_set(): break
+            camp_id = campana[0]
+            lease = self.orquestador.tomar_lease(camp_id, LEASE_CAZA_SEGUNDOS)
+            if not lease:
+                continue
+            try:
+                if self.orquestador.cazar_si_falta(campana):
+                    cazadas += 1
+                    # Hay materia prima nueva: el espía no tiene que esperar su pausa
+                    self.etapas["espia"].despertar()
+            finally:
+                self.orquestador.liberar_lease(camp_id, lease)
+        return cazadas
+
+    def iniciar(self):
+        for etapa in self.etapas.values():
+            self._hilos += etapa.iniciar(self.detener_evento)
+        resumen = ", ".join(f"{e.nombre}={e.hilos}" for e in self.etapas.values())
+        logging.info(f"🏭 Pipeline por etapas en marcha ({resumen}).")
+
+    def despertar(self, nombre):
+        if nombre in self.etapas: self.etapas[nombre].despertar()
+
+    def detener(self, espera=30):
+        self.detener_evento.set()
+        for etapa in self.etapas.values(): etapa.despertar()
+        for hilo in self._hilos: hilo.join(timeout=espera)
+        logging.info("🛑 Pipeline detenido.")
+
+    def estado(self):
+        return {nombre: dict(etapa.metricas, hilos=etapa.hilos) for nombre, etapa in self.etapas.items()}
@@ -1,5 +1,6 @@
 import os
 import requests
+import memoria_chat
 from datetime import datetime, timedelta
 from sqlalchemy import create_engine, text
 from langchain_google_genai import ChatGoogleGenerativeAI
@@ -59,10 +60,14 @@ def run_follow_up():
                 session_id = session[0]
                 print(f"--- Procesando a: {session_id} ---")
 
-                history_query = text("SELECT message FROM message_store WHERE session_id = :sid ORDER BY id DESC LIMIT 6")
-                messages_raw = connection.execute(history_query, {"sid": session_id}).fetchall()
-                # Adaptamos el formato del historial
-                conversation_history = "\n".join([f"{msg[0]['type']}: {msg[0]['data']['content']}" for msg in reversed(messages_raw)])
+                # Misma memoria acotada que el chat del Nido (resumen + últimos turnos)
+                conversation_history = memoria_chat.contexto_conversacion(session_id)
+                if not conversation_history:
+                    # Sesiones viejas que solo existen en message_store
+                    history_query = text("SELECT message FROM message_store WHERE session_id = :sid ORDER BY id DESC LIMIT :n")
+                    messages_raw = connection.execute(history_query, {"sid": session_id, "n": memoria_chat.TURNOS_VENTANA}).fetchall()
+                    turnos = [('user' if msg[0]['type'] == 'human' else 'ai', msg[0]['data']['content']) for msg in reversed(messages_raw)]
+                    conversation_history = memoria_chat.formatear_contexto("", turnos)
 
                 # Ya no necesitamos extraer el tema ni buscar en Tavily
                 
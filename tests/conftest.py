@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Los módulos del proyecto viven en la raíz (no es un paquete)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# ai_manager crea el cliente de Supabase al importarse: con una URL de mentira
+# basta (los tests no hablan con la red)
+os.environ.setdefault("SUPABASE_URL", "https://pruebas.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "clave-de-pruebas")
@@ -0,0 +1,156 @@
+"""
+trabajador_cazador.consumir_en_streaming contra un Apify falso en memoria:
+paginado con el run vivo, aborto al llegar a la meta, drenado después de un
+estado final, tope de espera y aborto si algo revienta a mitad de camino.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("apify_client")
+cazador = pytest.importorskip("trabajador_cazador")
+
+
+class ApifyFalso:
+    """
+    Un run que produce `por_sondeo` items cada vez que se consulta su estado
+    (start cuenta como la primera) y pasa a SUCCEEDED al llegar a `total`.
+    Hace de actor, run y dataset a la vez.
+    """
+    def __init__(self, total, por_sondeo, produce_al_arrancar=True, termina=True):
+        self.total = total
+        self.por_sondeo = por_sondeo
+        self.produce_al_arrancar = produce_al_arrancar
+        self.termina = termina
+        self.items = []
+        self.status = 'RUNNING'
+        self.abortos = 0
+        self.lecturas = []  # (offset, limit, estado del run en ese momento)
+
+    def _producir(self):
+        if self.status != 'RUNNING': return
+        base = len(self.items)
+        nuevos = min(self.por_sondeo, self.total - base)
+        self.items.extend({"n": base + k} for k in range(nuevos))
+        if self.termina and len(self.items) >= self.total:
+            self.status = 'SUCCEEDED'
+
+    def actor(self, actor_id): return self
+    def run(self, run_id): return self
+    def dataset(self, dataset_id): return self
+
+    def start(self, run_input=None):
+        if self.produce_al_arrancar: self._producir()
+        return {"id": "run-1", "defaultDatasetId": "ds-1", "status": self.status}
+
+    def get(self):
+        self._producir()
+        return {"status": self.status}
+
+    def abort(self):
+        self.abortos += 1
+        self.status = 'ABORTED'
+
+    def list_items(self, offset=0, limit=100):
+        self.lecturas.append((offset, limit, self.status))
+        return SimpleNamespace(items=self.items[offset:offset + limit])
+
+
+class EscritorFalso:
+    """ Misma interfaz que EscritorProspectos: pendientes -> vaciar() -> insertados. """
+    def __init__(self, tamano_chunk=25, falla_en=None):
+        self.tamano_chunk = tamano_chunk
+        self.falla_en = falla_en
+        self.pendientes = []
+        self.insertados = 0
+        self.vistos = []
+
+    def agregar(self, item):
+        if self.falla_en is not None and item["n"] == self.falla_en:
+            raise RuntimeError("DB caída")
+        self.vistos.append(item["n"])
+        self.pendientes.append(item)
+        if len(self.pendientes) >= self.tamano_chunk:
+            self.vaciar()
+
+    def vaciar(self):
+        self.insertados += len(self.pendientes)
+        self.pendientes = []
+
+
+def consumir(apify, escritor, objetivo, **kwargs):
+    kwargs.setdefault("pagina", 40)
+    kwargs.setdefault("pausa", 5)
+    kwargs.setdefault("max_espera", 1000)
+    kwargs.setdefault("dormir", lambda segundos: None)
+    return cazador.consumir_en_streaming(apify, "actor/prueba", {}, escritor, objetivo, **kwargs)
+
+
+def test_pagina_mientras_el_run_sigue_vivo():
+    apify = ApifyFalso(total=250, por_sondeo=100)
+    escritor = EscritorFalso()
+
+    estado = consumir(apify, escritor, objetivo=10_000)
+
+    assert estado == 'SUCCEEDED'
+    assert escritor.insertados == 250
+    assert escritor.vistos == list(range(250))  # sin saltos ni repetidos
+    assert any(e == 'RUNNING' and off > 0 for off, _, e in apify.lecturas)
+    assert all(limite == 40 for _, limite, _ in apify.lecturas)
+    assert apify.abortos == 0
+
+
+def test_aborta_al_llegar_a_la_meta():
+    apify = ApifyFalso(total=10_000, por_sondeo=100)
+    escritor = EscritorFalso()
+
+    estado = consumir(apify, escritor, objetivo=150)
+
+    assert estado == 'ABORTED'
+    assert apify.abortos == 1
+    assert escritor.insertados == 150
+    assert not escritor.pendientes
+    # No se leyó más allá de lo necesario para la meta
+    assert max(off for off, _, _ in apify.lecturas) < 150
+
+
+def test_drena_el_dataset_despues_del_estado_final():
+    # Los últimos items aparecen en el MISMO sondeo que reporta SUCCEEDED
+    apify = ApifyFalso(total=30, por_sondeo=30, produce_al_arrancar=False)
+    escritor = EscritorFalso()
+
+    estado = consumir(apify, escritor, objetivo=10_000)
+
+    assert estado == 'SUCCEEDED'
+    assert escritor.insertados == 30
+    assert any(e == 'SUCCEEDED' and off == 0 for off, _, e in apify.lecturas)
+    assert apify.abortos == 0
+
+
+def test_aborta_al_exceder_max_espera():
+    apify = ApifyFalso(total=10_000, por_sondeo=0, termina=False)
+    escritor = EscritorFalso()
+    reloj = {"t": 0.0}
+    siestas = []
+
+    def dormir(segundos):
+        siestas.append(segundos)
+        reloj["t"] += segundos
+
+    estado = consumir(apify, escritor, objetivo=10, pausa=5, max_espera=20,
+                      dormir=dormir, reloj=lambda: reloj["t"])
+
+    assert estado == 'ABORTED'
+    assert apify.abortos == 1
+    assert escritor.insertados == 0
+    assert len(siestas) == 5  # 0, 5, 10, 15, 20 s: el corte llega al pasar los 20
+
+
+def test_aborta_el_run_si_revienta_a_mitad_de_camino():
+    apify = ApifyFalso(total=10_000, por_sondeo=100)
+    escritor = EscritorFalso(falla_en=60)
+
+    with pytest.raises(RuntimeError):
+        consumir(apify, escritor, objetivo=500)
+
+    assert apify.abortos == 1
@@ -0,0 +1,89 @@
+"""
+ai_manager.LimitadorTokens contra un Supabase falso: el cupo se reserva por
+bloques (un RPC cada varias peticiones), el bloque vence, un 429 lo suelta y
+si el cubo no da ni una petición se devuelve la espera.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+ai_manager = pytest.importorskip("ai_manager")
+
+
+class SupabaseFalso:
+    """ reservar_cupo_ia que concede lo pedido (o `espera` si está puesta); penalizar_ia devuelve p_base. """
+    def __init__(self, espera=0):
+        self.espera = espera
+        self.llamadas = []
+
+    def rpc(self, nombre, params):
+        self.llamadas.append((nombre, params))
+        if nombre == 'penalizar_ia':
+            return SimpleNamespace(execute=lambda: SimpleNamespace(data=params["p_base"]))
+        if self.espera:
+            fila = {"concedidas": 0, "espera": self.espera}
+        else:
+            fila = {"concedidas": params["p_cantidad"], "espera": 0}
+        return SimpleNamespace(execute=lambda: SimpleNamespace(data=[fila]))
+
+
+@pytest.fixture
+def supabase(monkeypatch):
+    falso = SupabaseFalso()
+    monkeypatch.setattr(ai_manager, "supabase", falso)
+    return falso
+
+
+def reservas(supabase):
+    return [p for nombre, p in supabase.llamadas if nombre == 'reservar_cupo_ia']
+
+
+def test_un_rpc_por_bloque(supabase):
+    limitador = ai_manager.LimitadorTokens(tamano_bloque=5)
+
+    esperas = [limitador.intentar("m1", 60, 1_000_000, 1000) for _ in range(12)]
+
+    assert esperas == [0] * 12
+    assert len(reservas(supabase)) == 3  # 5 + 5 + 2
+    assert all(p["p_cantidad"] == 5 for p in reservas(supabase))
+
+
+def test_rpm_bajo_achica_el_bloque(supabase):
+    limitador = ai_manager.LimitadorTokens(tamano_bloque=5)
+
+    limitador.intentar("m1", 8, 1_000_000, 1000)
+
+    assert reservas(supabase)[0]["p_cantidad"] == 2
+
+
+def test_tokens_del_bloque_se_agotan(supabase):
+    limitador = ai_manager.LimitadorTokens(tamano_bloque=5)
+
+    limitador.intentar("m1", 60, 1_000_000, 1000)
+    limitador.intentar("m1", 60, 1_000_000, 5000)  # no entra en lo reservado (4 x 1000)
+
+    assert len(reservas(supabase)) == 2
+
+
+def test_bloque_vencido_y_penalizado_se_descartan(supabase, monkeypatch):
+    reloj = {"t": 100.0}
+    monkeypatch.setattr(ai_manager.time, "monotonic", lambda: reloj["t"])
+    limitador = ai_manager.LimitadorTokens(tamano_bloque=5, ttl_bloque=10)
+
+    limitador.intentar("m1", 60, 1_000_000, 1000)
+    reloj["t"] += 11
+    limitador.intentar("m1", 60, 1_000_000, 1000)
+    assert len(reservas(supabase)) == 2
+
+    limitador.penalizar("m1")
+    limitador.intentar("m1", 60, 1_000_000, 1000)
+    assert len(reservas(supabase)) == 3
+
+
+def test_sin_cupo_devuelve_la_espera(supabase):
+    supabase.espera = 4.5
+    limitador = ai_manager.LimitadorTokens(tamano_bloque=5)
+
+    assert limitador.intentar("m1", 60, 1_000_000, 1000) == 4.5
+    assert limitador.intentar("m1", 60, 1_000_000, 1000) == 4.5
+    assert len(reservas(supabase)) == 2
@@ -0,0 +1,56 @@
+"""
+Contrato con google-generativeai del que depende ai_manager.atar_cliente:
+el modelo manda sus llamadas por `_client` / `_async_client` si están puestos
+(un cliente por llave) en vez del cliente global de genai.configure.
+Si una actualización del SDK rompe esto, estos tests fallan antes del deploy.
+"""
+import asyncio
+import pytest
+
+genai = pytest.importorskip("google.generativeai")
+from google.ai import generativelanguage as glm
+
+
+def respuesta(texto):
+    return glm.GenerateContentResponse(candidates=[
+        glm.Candidate(content=glm.Content(role="model", parts=[glm.Part(text=texto)]), finish_reason=1)
+    ])
+
+
+class ClienteFalso:
+    def __init__(self, texto):
+        self.texto = texto
+        self.llamadas = 0
+
+    def generate_content(self, request, **kwargs):
+        self.llamadas += 1
+        return respuesta(self.texto)
+
+
+class ClienteAsyncFalso(ClienteFalso):
+    async def generate_content(self, request, **kwargs):
+        self.llamadas += 1
+        return respuesta(self.texto)
+
+
+def test_modelo_tiene_atributos_de_cliente():
+    model = genai.GenerativeModel("models/gemini-1.5-flash")
+    assert hasattr(model, "_client")
+    assert hasattr(model, "_async_client")
+
+
+def test_generate_content_usa_el_cliente_atado():
+    cliente = ClienteFalso("llave A")
+    model = genai.GenerativeModel("models/gemini-1.5-flash")
+    model._client = cliente
+    assert model.generate_content("hola").text == "llave A"
+    assert cliente.llamadas == 1
+
+
+def test_generate_content_async_usa_el_cliente_atado():
+    cliente = ClienteAsyncFalso("llave B")
+    model = genai.GenerativeModel("models/gemini-1.5-flash")
+    model._async_client = cliente
+    resultado = asyncio.run(model.generate_content_async("hola"))
+    assert resultado.text == "llave B"
+    assert cliente.llamadas == 1
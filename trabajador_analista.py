@@ -1,13 +1,13 @@
 import os
-import time
 import json
 import logging
-import requests
-import psycopg2
+import conexion_db
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
 import google.generativeai as genai
-from psycopg2.extras import Json
+from psycopg2.extras import Json, execute_batch
 from dotenv import load_dotenv
+from cache_web import obtener_html
 
 # --- CONEXIÓN AL CEREBRO ROTATIVO (NUEVO) ---
 try:
@@ -23,6 +23,14 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - ANALISTA - %(level
 DATABASE_URL = os.environ.get("DATABASE_URL")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 
+# --- MODO CONCURRENTE ---
+TAMANO_LOTE = int(os.environ.get("ANALISTA_LOTE", 40))
+HILOS_ANALISTA = int(os.environ.get("ANALISTA_HILOS", 8))
+# Si un analista muere a mitad de lote, sus prospectos se liberan tras este tiempo
+MINUTOS_RECLAMO = 15
+# Reclamos sin veredicto antes de rendirse con un prospecto ('error_analisis')
+MAX_INTENTOS = int(os.environ.get("ANALISTA_MAX_INTENTOS", 3))
+
 # --- IA BLINDADA (YA NO ES FIJA) ---
 # El control ahora lo tiene ai_manager.
 
@@ -35,13 +43,12 @@ def escanear_web_simple(url):
     if not url: return ""
     if not url.startswith("http"): url = "http://" + url
     
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-    
     try:
-        response = requests.get(url, headers=headers, timeout=10)
-        if response.status_code != 200: return ""
+        # Misma caché que el Espía: si ya bajó esta web, no volvemos a descargarla
+        status, html = obtener_html(url, timeout=10)
+        if status != 200: return ""
         
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = BeautifulSoup(html, 'html.parser')
         textos = []
         for tag in soup.find_all(['h1', 'h2', 'h3', 'p', 'meta']):
             if tag.name == 'meta' and tag.get('name') == 'description':
@@ -57,11 +64,9 @@ def escanear_web_simple(url):
 
 # --- 2. EL PSICÓLOGO (GEMINI ROTATIVO) ---
 
-def realizar_psicoanalisis(prospecto, campana, texto_web):
-    if not brain: return None
-
+def construir_prompt_psicoanalisis(prospecto, campana, texto_web):
     # Prompt optimizado para Venta Consultiva
-    prompt = f"""
+    return f"""
     ERES UN ANALISTA DE VENTAS B2B DE ÉLITE.
     
     --- DATOS DE LA CAMPAÑA (LO QUE VENDEMOS) ---
@@ -99,6 +104,15 @@ def realizar_psicoanalisis(prospecto, campana, texto_web):
     }}
     """
 
+def interpretar_respuesta_ia(texto):
+    texto_limpio = texto.replace("```json", "").replace("```", "").strip()
+    return json.loads(texto_limpio)
+
+def realizar_psicoanalisis(prospecto, campana, texto_web):
+    if not brain: return None
+
+    prompt = construir_prompt_psicoanalisis(prospecto, campana, texto_web)
+
     model_id = None # Para reportar fallos
     try:
         # CAMBIO: Pedimos cerebro RÁPIDO (Flash) al Manager
@@ -109,14 +123,13 @@ def realizar_psicoanalisis(prospecto, campana, texto_web):
         # CAMBIO: Registramos uso
         brain.register_usage(model_id)
         
-        texto_limpio = respuesta.text.replace("```json", "").replace("```", "").strip()
-        return json.loads(texto_limpio)
+        return interpretar_respuesta_ia(respuesta.text)
 
     except Exception as e:
         logging.error(f"Error interpretando a Gemini: {e}")
-        # CAMBIO: Reportamos muerte si es 429
+        # CAMBIO: Reportamos 429 (el limitador decide si es backoff corto o cuota diaria)
         if model_id and "429" in str(e):
-            brain.report_failure(model_id)
+            brain.report_failure(model_id, str(e))
         return None
 
 # --- 3. FUNCIÓN PRINCIPAL DEL TRABAJADOR (MODIFICADO PARA SECUENCIA) ---
@@ -127,7 +140,7 @@ def trabajar_analista():
     
     conn = None
     try:
-        conn = psycopg2.connect(DATABASE_URL)
+        conn = conexion_db.tomar()
         cur = conn.cursor()
 
         # --- SELECCIÓN OPORTUNISTA ---
@@ -180,7 +193,6 @@ def trabajar_analista():
 
             if not analisis_ia:
                 logging.warning(f"⚠️ Fallo análisis IA ID {prospecto['id']}")
-                time.sleep(2) 
                 continue 
 
             if analisis_ia.get("veredicto") == "DESCARTADO":
@@ -199,9 +211,7 @@ def trabajar_analista():
                 WHERE id = %s
             """, (nuevo_estado, pain_points_json, prospecto['id']))
             conn.commit()
-            
-            # Pausa breve para no saturar
-            time.sleep(2) 
+            # (Sin pausas fijas: el ritmo lo marca el limitador RPM/TPM de ai_manager)
 
         cur.close()
 
@@ -210,5 +220,161 @@ def trabajar_analista():
     finally:
         if conn: conn.close()
 
+# --- 4. MODO CONCURRENTE (LOTES GRANDES + POOL DE HILOS) ---
+
+# Consultas calientes del reclamo (migrador.py verificar las pasa por EXPLAIN)
+SQL_RENDIR_AGOTADOS = """
+    UPDATE prospects
+    SET status = 'error_analisis', updated_at = NOW()
+    WHERE (%s IS NULL OR campaign_id = %s)
+    AND status = 'analizando' AND updated_at < NOW() - %s * INTERVAL '1 minute'
+    AND intentos_analisis >= %s
+"""
+
+SQL_RECLAMAR_LOTE = """
+    UPDATE prospects p
+    SET status = 'analizando', updated_at = NOW(),
+        intentos_analisis = p.intentos_analisis + 1,
+        estado_previo_analisis = CASE WHEN p.status = 'analizando' THEN p.estado_previo_analisis ELSE p.status END
+    FROM (
+        SELECT id FROM prospects
+        WHERE (%s IS NULL OR campaign_id = %s)
+        AND (
+            status = 'espiado'
+            OR (status = 'cazado' AND (captured_email IS NOT NULL OR phone_number IS NOT NULL))
+            OR (status = 'analizando' AND updated_at < NOW() - %s * INTERVAL '1 minute')
+        )
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ) sel
+    WHERE p.id = sel.id
+    RETURNING p.id
+"""
+
+def reclamar_lote(cur, tamano_lote, campana_id=None):
+    """
+    Toma prospectos pendientes marcándolos 'analizando' en UNA sentencia.
+    SKIP LOCKED: dos analistas en paralelo nunca agarran el mismo prospecto.
+    Con `campana_id` solo reclama de esa campaña (Orquestador paralelo).
+    Cada reclamo suma un intento y recuerda el estado de origen; los colgados
+    que ya gastaron MAX_INTENTOS pasan a 'error_analisis' en vez de volver a la cola.
+    """
+    cur.execute(SQL_RENDIR_AGOTADOS, (campana_id, campana_id, MINUTOS_RECLAMO, MAX_INTENTOS))
+    if cur.rowcount:
+        logging.warning(f"🧯 {cur.rowcount} prospectos agotaron {MAX_INTENTOS} intentos de análisis: 'error_analisis'.")
+
+    cur.execute(SQL_RECLAMAR_LOTE, (campana_id, campana_id, MINUTOS_RECLAMO, tamano_lote))
+    ids = [r[0] for r in cur.fetchall()]
+    if not ids: return []
+
+    cur.execute("""
+        SELECT 
+            p.id, p.business_name, p.website_url, p.raw_data, p.captured_email,
+            c.id as campaign_id, c.product_description, c.ticket_price, 
+            c.red_flags, c.pain_points_defined, c.competitors, c.tone_voice
+        FROM prospects p
+        JOIN campaigns c ON p.campaign_id = c.id
+        WHERE p.id = ANY(%s)
+    """, (ids,))
+    return cur.fetchall()
+
+def preparar_prompt(fila):
+    """ Escaneo web + prompt para UN prospecto. Corre dentro del pool: los scrapings se solapan entre sí. """
+    prospecto = {
+        "id": fila[0], "business_name": fila[1], "website_url": fila[2], 
+        "raw_data": fila[3], "email": fila[4]
+    }
+    campana = {
+        "product_description": fila[6], "ticket_price": fila[7],
+        "red_flags": fila[8], "pain_points_defined": fila[9],
+        "competitors": fila[10], "tone_voice": fila[11]
+    }
+
+    texto_web = escanear_web_simple(prospecto["website_url"]) if prospecto["website_url"] else ""
+    return construir_prompt_psicoanalisis(prospecto, campana, texto_web)
+
+def interpretar_resultado(pid, resultado):
+    """ Resultado de run_many -> dict del análisis, o None si la IA falló. """
+    if resultado["error"]:
+        logging.warning(f"⚠️ Fallo análisis IA ID {pid}: {resultado['error']}")
+        return None
+    try:
+        return interpretar_respuesta_ia(resultado["texto"])
+    except Exception as e:
+        logging.error(f"Error interpretando a Gemini (ID {pid}): {e}")
+        return None
+
+def trabajar_analista_concurrente(tamano_lote=TAMANO_LOTE, hilos=HILOS_ANALISTA, campana_id=None):
+    """
+    Igual que trabajar_analista, pero:
+    1. Reclama lotes grandes con FOR UPDATE SKIP LOCKED y suelta la conexión.
+    2. Scraping en un pool acotado de hilos + TODO el lote en un solo run_many.
+    3. Escribe todos los veredictos en un solo viaje a la DB.
+    Los fallos de IA vuelven a su estado de origen ('cazado' / 'espiado') hasta
+    MAX_INTENTOS; después quedan en 'error_analisis'.
+    Devuelve cuántos prospectos quedaron analizados.
+    """
+    logging.info(f"🧠 Analista Iniciado (Modo Concurrente - Lote {tamano_lote}, {hilos} hilos).")
+    if not brain: return 0
+
+    try:
+        # 1. Reclamo: la conexión vuelve al pool antes de scraping + IA
+        with conexion_db.conexion() as conn, conn.cursor() as cur:
+            lote = reclamar_lote(cur, tamano_lote, campana_id)
+            conn.commit()
+
+        if not lote:
+            logging.info("💤 Nada que analizar en este turno.")
+            return 0
+
+        logging.info(f"🧠 Procesando lote de {len(lote)} prospectos...")
+
+        # 2. Webs en paralelo, IA de todo el lote en una sola tanda (ai_manager reparte llaves)
+        with ThreadPoolExecutor(max_workers=hilos) as pool:
+            prompts = list(pool.map(preparar_prompt, lote))
+        resultados = brain.run_many(prompts, task_type="velocidad")
+
+        veredictos, fallidos = [], []
+        for fila, resultado in zip(lote, resultados):
+            pid = fila[0]
+            analisis_ia = interpretar_resultado(pid, resultado)
+            if not analisis_ia:
+                fallidos.append((MAX_INTENTOS, pid))
+            elif analisis_ia.get("veredicto") == "DESCARTADO":
+                logging.info(f"🚫 DESCARTADO ID {pid}: {analisis_ia.get('razon_descarte')}")
+                veredictos.append(('descartado', None, pid))
+            else:
+                logging.info(f"✅ APROBADO ID {pid}")
+                veredictos.append(('analizado_exitoso', Json(analisis_ia), pid))
+
+        # 3. Un solo viaje de red para todo el lote
+        with conexion_db.conexion() as conn, conn.cursor() as cur:
+            if veredictos:
+                execute_batch(cur, """
+                    UPDATE prospects 
+                    SET status = %s,
+                        pain_points = %s,
+                        updated_at = NOW()
+                    WHERE id = %s AND status = 'analizando'
+                """, veredictos, page_size=len(veredictos))
+            if fallidos:
+                # Vuelve a la cola de la que salió; agotados los intentos, 'error_analisis'
+                execute_batch(cur, """
+                    UPDATE prospects
+                    SET status = CASE WHEN intentos_analisis >= %s THEN 'error_analisis'
+                                      ELSE COALESCE(estado_previo_analisis, 'espiado') END,
+                        updated_at = NOW()
+                    WHERE id = %s AND status = 'analizando'
+                """, fallidos, page_size=len(fallidos))
+            conn.commit()
+
+        logging.info(f"🏁 Lote terminado: {len(veredictos)}/{len(lote)} analizados.")
+        return len(veredictos)
+
+    except Exception as e:
+        # Los 'analizando' de este lote se recuperan solos a los MINUTOS_RECLAMO
+        logging.error(f"🔥 Error Crítico Analista: {e}")
+        return 0
+
 if __name__ == "__main__":
     trabajar_analista()
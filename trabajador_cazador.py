@@ -1,11 +1,10 @@
 import os
 import json
 import logging
-import datetime
 import time
 from apify_client import ApifyClient
-import psycopg2
-from psycopg2.extras import Json
+import conexion_db
+from psycopg2.extras import Json, execute_values
 from dotenv import load_dotenv
 
 # --- IMPORTACIÓN DEL GERENTE DE IA ---
@@ -28,7 +27,28 @@ DATABASE_URL = os.environ.get("DATABASE_URL")
 PRESUPUESTO_POR_PROSPECTO_CONTRATADO = 4.0
 MULTIPLICADOR_RAW_LEADS = 200
 
+# --- INGESTA POR LOTES ---
+TAMANO_CHUNK = int(os.environ.get("CAZADOR_CHUNK", 200))
+
+# --- CAZA EN STREAMING (leer el dataset mientras el actor corre) ---
+MODO_STREAMING = os.environ.get("CAZADOR_STREAMING", "1") == "1"
+PAGINA_DATASET = int(os.environ.get("CAZADOR_PAGINA", 100))
+PAUSA_SONDEO_SEGUNDOS = float(os.environ.get("CAZADOR_SONDEO", 5))
+# Se piden más items crudos que la meta: muchos se descartan o son duplicados,
+# y al llegar a la meta el run se aborta igual (no se pagan los que sobran)
+FACTOR_SOBRECAZA = float(os.environ.get("CAZADOR_SOBRECAZA", 2))
+# Tope de una corrida (cabe dentro del lease de caza del pipeline)
+MAX_ESPERA_RUN_SEGUNDOS = int(os.environ.get("CAZADOR_MAX_ESPERA", 1500))
+ESTADOS_FINALES_APIFY = ('SUCCEEDED', 'FAILED', 'ABORTED', 'TIMED-OUT')
+
 # --- 1. CEREBRO FINANCIERO ---
+# Contadores diarios que mantienen los triggers (migraciones/009): <= 31 filas por clave
+# primaria, y cuentan lo cazado aunque el prospecto ya haya avanzado de estado
+SQL_PRESUPUESTO_MENSUAL = """
+    SELECT COALESCE(SUM(cazados), 0) FROM campaign_stats_diarias
+    WHERE campaign_id = %s AND dia >= date_trunc('month', CURRENT_DATE)::date
+"""
+
 def verificar_presupuesto_mensual(campana_id, limite_diario_contratado):
     if not limite_diario_contratado: limite_diario_contratado = 4
     try:
@@ -42,15 +62,9 @@ def verificar_presupuesto_mensual(campana_id, limite_diario_contratado):
 
     conn = None
     try:
-        conn = psycopg2.connect(DATABASE_URL)
+        conn = conexion_db.tomar()
         cur = conn.cursor()
-        hoy = datetime.date.today()
-        inicio_mes = hoy.replace(day=1)
-        query = """
-            SELECT count(*) FROM prospects 
-            WHERE campaign_id = %s AND status = 'cazado' AND created_at >= %s;
-        """
-        cur.execute(query, (campana_id, inicio_mes))
+        cur.execute(SQL_PRESUPUESTO_MENSUAL, (str(campana_id),))
         cazados_mes_actual = cur.fetchone()[0]
         cur.close()
 
@@ -79,7 +93,7 @@ def optimizar_busqueda_con_ia(campana_id, busqueda_original, plataforma):
     conn = None
     model_id = None
     try:
-        conn = psycopg2.connect(DATABASE_URL)
+        conn = conexion_db.tomar()
         cur = conn.cursor()
         cur.execute("SELECT campaign_name, product_description, target_audience, cta_goal FROM campaigns WHERE id = %s", (campana_id,))
         row = cur.fetchone()
@@ -104,7 +118,7 @@ def optimizar_busqueda_con_ia(campana_id, busqueda_original, plataforma):
 
     except Exception as e:
         logging.warning(f"⚠️ IA Falló búsqueda. Usando original. Error: {e}")
-        if model_id and hasattr(brain, 'report_failure'): brain.report_failure(model_id)
+        if model_id and hasattr(brain, 'report_failure'): brain.report_failure(model_id, str(e))
         return busqueda_original
     finally:
         if conn: conn.close()
@@ -113,7 +127,7 @@ def optimizar_busqueda_con_ia(campana_id, busqueda_original, plataforma):
 def consultar_arsenal(plataforma_objetivo, tipo_producto):
     conn = None
     try:
-        conn = psycopg2.connect(DATABASE_URL)
+        conn = conexion_db.tomar()
         cur = conn.cursor()
         # Buscamos la herramienta activa con mayor confianza
         query = """
@@ -217,8 +231,226 @@ def validar_y_normalizar(item, plataforma, bot_id):
     if not datos["business_name"]: return None
     return datos
 
+# --- 5b. ESCRITOR POR LOTES (UN INSERT POR CHUNK, NO POR ITEM) ---
+# Estados cuyo análisis ya está hecho: un negocio conocido en ellos no vuelve al Analista
+ESTADOS_POST_ANALISIS = ('analizado_exitoso', 'persuadiendo', 'persuadido', 'contacto_fallido',
+                         'nutriendo', 'validado_facturable', 'lead_frio', 'error_nutricion')
+
+# Mejor antecedente de cada item entrante por identidad normalizada (migraciones/010).
+# Parámetros: campaña, webs[], teléfonos[], place_ids[], campaña (texto).
+SQL_CONSULTAR_CONOCIDOS = """
+    WITH mi AS (
+        SELECT product_description FROM campaigns WHERE id = %s
+    ),
+    entrantes AS (
+        SELECT e.i, dominio_canonico(e.web) AS dom, telefono_e164(e.tel) AS tel, NULLIF(e.place, '') AS place
+        FROM unnest(%s::text[], %s::text[], %s::text[]) WITH ORDINALITY AS e(web, tel, place, i)
+    )
+    SELECT e.dom, e.tel, e.place,
+           p.misma_campana, p.mismo_producto, p.captured_email, p.status, p.pain_points
+    FROM entrantes e
+    LEFT JOIN LATERAL (
+        SELECT q.campaign_id::text = %s AS misma_campana,
+               c.product_description IS NOT DISTINCT FROM (SELECT product_description FROM mi) AS mismo_producto,
+               q.captured_email, q.status, q.pain_points
+        FROM prospects q
+        JOIN campaigns c ON c.id = q.campaign_id
+        WHERE q.dominio_canonico = e.dom OR q.telefono_e164 = e.tel OR q.place_id = e.place
+        ORDER BY 1 DESC, 2 DESC, (q.pain_points IS NOT NULL) DESC,
+                 (q.captured_email IS NOT NULL) DESC, q.created_at
+        LIMIT 1
+    ) p ON TRUE
+    ORDER BY e.i
+"""
+
+class EscritorProspectos:
+    """
+    Recibe items crudos de Apify en streaming, los normaliza y los inserta
+    en chunks con execute_values (un viaje + un commit por chunk).
+    Antes de insertar, cada chunk se cruza en UNA consulta contra la identidad
+    de todos los negocios ya cazados (dominio / teléfono / place id, migraciones/010):
+    - Ya está en esta campaña -> duplicado, no se inserta.
+    - Está en otra campaña    -> se inserta reutilizando el email del Espía y, si
+      el producto es el mismo, el veredicto del Analista (no se paga dos veces).
+    Lleva la cuenta de insertados / duplicados / descartados / reutilizados / fallidos.
+    """
+    def __init__(self, conn, campana_id, plataforma, actor_id, tamano_chunk=TAMANO_CHUNK):
+        self.conn = conn
+        self.campana_id = campana_id
+        self.plataforma = plataforma
+        self.actor_id = actor_id
+        self.tamano_chunk = tamano_chunk
+        self.pendientes = []
+        self.insertados = 0
+        self.duplicados = 0
+        self.descartados = 0
+        self.reutilizados = 0
+        self.fallidos = 0
+
+    def agregar(self, item):
+        datos = validar_y_normalizar(item, self.plataforma, self.actor_id)
+        if not datos:
+            self.descartados += 1
+            return
+        self.pendientes.append(datos)
+        if len(self.pendientes) >= self.tamano_chunk:
+            self.vaciar()
+
+    def consultar_conocidos(self, cur, chunk):
+        """
+        Identidad normalizada (en la DB, misma función que usa el INSERT) y el mejor
+        antecedente de cada item: primero esta campaña, luego mismo producto,
+        luego el que tenga análisis o email. Una fila por item, en orden.
+        """
+        raw = [d["raw_data"] if isinstance(d["raw_data"], dict) else {} for d in chunk]
+        cur.execute(SQL_CONSULTAR_CONOCIDOS, (
+            self.campana_id,
+            [d["website_url"] for d in chunk],
+            [r.get("phoneUnformatted") or d["phone_number"] for d, r in zip(chunk, raw)],
+            [r.get("placeId") for r in raw],
+            str(self.campana_id),
+        ))
+        return cur.fetchall()
+
+    def preparar_filas(self, chunk, conocidos):
+        """ Filas para el INSERT; omite duplicados (de la campaña o dentro del mismo chunk). Sin contar: eso es tras el commit. """
+        filas, vistos = [], set()
+        for d, (dom, tel, place, misma_campana, mismo_producto, email_previo, status_previo, dolores_previos) in zip(chunk, conocidos):
+            claves = {c for c in (("d", dom), ("t", tel), ("p", place)) if c[1]}
+            if misma_campana or claves & vistos:
+                continue
+            vistos |= claves
+
+            email, status, dolores = d["email"], 'cazado', None
+            if status_previo is not None:
+                if not email and email_previo: email = email_previo
+                if mismo_producto and status_previo == 'descartado':
+                    status = 'descartado'
+                elif mismo_producto and dolores_previos and status_previo in ESTADOS_POST_ANALISIS:
+                    status, dolores = 'analizado_exitoso', Json(dolores_previos)
+            # Marcado en la fila: el trigger de stats no lo cuenta como analizado (migraciones/013)
+            reutilizado = email != d["email"] or status != 'cazado'
+
+            filas.append((
+                self.campana_id, d["business_name"], d["website_url"], d["phone_number"], email,
+                Json(d["social_profiles"]), self.actor_id, status, Json(d["raw_data"]), dolores,
+                d["business_name"], d["website_url"], d["phone_number"],
+                dom, tel, place, reutilizado
+            ))
+        return filas
+
+    def _guardar(self, chunk):
+        """ Cruce de identidad + INSERT + commit de un chunk. Devuelve las filas nuevas [(reutilizado,)]. Lanza si falla. """
+        nuevos = []
+        with self.conn.cursor() as cur:
+            filas = self.preparar_filas(chunk, self.consultar_conocidos(cur, chunk))
+            if filas:
+                # Insertar o ignorar si ya existe (Evitar duplicados)
+                # La clave anti-duplicados la calcula la DB (migraciones/008, idx_prospects_dedupe)
+                # OJO: Guardamos 'social_profiles' como JSON
+                nuevos = execute_values(cur,
+                    """INSERT INTO prospects (campaign_id, business_name, website_url, phone_number, captured_email, social_profiles, source_bot_id, status, raw_data, pain_points, created_at, dedupe_key,
+                                              dominio_canonico, telefono_e164, place_id, reutilizado)
+                       VALUES %s
+                       ON CONFLICT DO NOTHING RETURNING reutilizado;""",
+                    filas,
+                    template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), clave_dedupe_prospecto(%s, %s, %s), %s, %s, %s, %s)",
+                    page_size=len(filas),
+                    fetch=True
+                )
+        self.conn.commit()
+        return nuevos
+
+    def vaciar(self):
+        """
+        Guarda los pendientes en UN viaje. Si el chunk falla (una fila mala tumba
+        todo el INSERT), se reintenta de a uno: solo se pierde la fila mala, y
+        queda contada en `fallidos`. Los contadores se suman recién tras el commit.
+        """
+        if not self.pendientes: return
+        chunk, self.pendientes = self.pendientes, []
+        try:
+            guardados = [(len(chunk), self._guardar(chunk))]
+        except Exception as e_db:
+            self.conn.rollback()
+            logging.warning(f"⚠️ Falló el chunk de {len(chunk)} prospectos ({e_db}). Reintentando de a uno...")
+            guardados = []
+            for d in chunk:
+                try:
+                    guardados.append((1, self._guardar([d])))
+                except Exception as e_fila:
+                    self.conn.rollback()
+                    self.fallidos += 1
+                    logging.error(f"❌ Prospecto no guardado ({d.get('business_name')}): {e_fila}")
+
+        nuevos_chunk = 0
+        for intentados, nuevos in guardados:
+            nuevos_chunk += len(nuevos)
+            self.insertados += len(nuevos)
+            self.duplicados += intentados - len(nuevos)
+            self.reutilizados += sum(1 for (reutilizado,) in nuevos if reutilizado)
+        logging.info(f"📦 Chunk: {nuevos_chunk} nuevos de {len(chunk)} (total guardados: {self.insertados}, reutilizados: {self.reutilizados}, fallidos: {self.fallidos})")
+
+# --- 5c. CONSUMO EN STREAMING DEL DATASET ---
+def consumir_en_streaming(client, actor_id, run_input, escritor, objetivo,
+                          pagina=PAGINA_DATASET, pausa=PAUSA_SONDEO_SEGUNDOS,
+                          max_espera=MAX_ESPERA_RUN_SEGUNDOS, dormir=time.sleep, reloj=time.monotonic):
+    """
+    Arranca el actor SIN esperar (actor.start) y pagina su dataset mientras el
+    run sigue produciendo: normalizar e insertar se solapa con el scraping.
+    En cuanto hay `objetivo` prospectos NUEVOS guardados, aborta el run.
+    Cualquier salida con el run vivo (meta, timeout o excepción) lo aborta:
+    un run huérfano sigue cobrando en Apify.
+
+    `client` solo necesita: actor(id).start(run_input=...) -> {"id", "defaultDatasetId", "status"},
+    dataset(id).list_items(offset=, limit=) -> objeto con .items,
+    run(id).get() -> {"status"} y run(id).abort(). Ver tests/test_cazador_streaming.py.
+    Devuelve el estado final del run ('ABORTED' si lo cortamos nosotros).
+    """
+    run = client.actor(actor_id).start(run_input=run_input)
+    corrida = client.run(run["id"])
+    dataset = client.dataset(run["defaultDatasetId"])
+    estado = run.get("status")
+    offset = 0
+    inicio = reloj()
+
+    try:
+        while True:
+            # Estado visto ANTES de leer: si ya terminó, esta lectura drena lo último
+            terminado = estado in ESTADOS_FINALES_APIFY
+            items = dataset.list_items(offset=offset, limit=pagina).items
+            for item in items:
+                escritor.agregar(item)
+                offset += 1
+                # No pasarse del presupuesto: lo que sobra de la página se relee si hiciera falta
+                if escritor.insertados + len(escritor.pendientes) >= objetivo: break
+
+            if escritor.insertados + len(escritor.pendientes) >= objetivo:
+                escritor.vaciar()
+                if escritor.insertados >= objetivo:
+                    if not terminado:
+                        logging.info(f"🎯 Meta cumplida ({escritor.insertados}/{objetivo}). Abortando run de Apify.")
+                    break
+
+            if items: continue
+            if terminado: break
+            if reloj() - inicio > max_espera:
+                logging.warning(f"⏱️ Run de Apify excedió {max_espera}s. Abortando.")
+                break
+            dormir(pausa)
+            estado = (corrida.get() or {}).get("status", estado)
+
+        escritor.vaciar()
+    finally:
+        if estado not in ESTADOS_FINALES_APIFY:
+            try: corrida.abort()
+            except Exception as e: logging.warning(f"⚠️ No se pudo abortar el run: {e}")
+            estado = 'ABORTED'
+    return estado
+
 # --- 6. EJECUCIÓN PRINCIPAL CON AUTO-CURACIÓN ---
-def ejecutar_caza(campana_id, prompt_busqueda, ubicacion, plataforma="Google Maps", tipo_producto="Tangible", limite_diario_contratado=4):
+def ejecutar_caza(campana_id, prompt_busqueda, ubicacion, plataforma="Google Maps", tipo_producto="Tangible", limite_diario_contratado=4,
+                  cliente_apify=None, streaming=MODO_STREAMING):
     cantidad_a_cazar = verificar_presupuesto_mensual(campana_id, limite_diario_contratado)
     if cantidad_a_cazar <= 0:
         logging.info("⏸️ Cazador en pausa (Presupuesto).")
@@ -237,7 +469,24 @@ def ejecutar_caza(campana_id, prompt_busqueda, ubicacion, plataforma="Google Map
     logging.info(f"🛠️ Herramienta seleccionada: {actor_id} para {plataforma}")
 
     try:
-        client = ApifyClient(APIFY_TOKEN)
+        client = cliente_apify or ApifyClient(APIFY_TOKEN)
+
+        if streaming:
+            max_items = max(cantidad_a_cazar, int(cantidad_a_cazar * FACTOR_SOBRECAZA))
+            run_input = preparar_input_blindado(actor_id, busqueda_final, ubicacion, max_items, bot_info["config_extra"])
+            logging.info(f"📡 Apify Run en streaming ({actor_id}) -> '{busqueda_final}'")
+            conn = conexion_db.tomar()
+            try:
+                escritor = EscritorProspectos(conn, campana_id, plataforma, actor_id)
+                estado = consumir_en_streaming(client, actor_id, run_input, escritor, cantidad_a_cazar)
+            finally:
+                conn.close()
+            logging.info(f"✅ FINALIZADO ({estado}). Guardados: {escritor.insertados} | Duplicados: {escritor.duplicados} | Descartados: {escritor.descartados} | Reutilizados: {escritor.reutilizados} | Fallidos: {escritor.fallidos}")
+            if estado not in ('SUCCEEDED', 'ABORTED') and not escritor.insertados:
+                logging.error(f"❌ Fallo en Apify (Status {estado}).")
+                return False
+            return True
+
         run_input = preparar_input_blindado(actor_id, busqueda_final, ubicacion, cantidad_a_cazar, bot_info["config_extra"])
         
         logging.info(f"📡 Apify Run ({actor_id}) -> '{busqueda_final}'")
@@ -249,34 +498,16 @@ def ejecutar_caza(campana_id, prompt_busqueda, ubicacion, plataforma="Google Map
 
         dataset_id = run["defaultDatasetId"]
         
-        # Guardado en Base de Datos
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        contador = 0
-        
-        for item in client.dataset(dataset_id).iterate_items():
-            datos = validar_y_normalizar(item, plataforma, actor_id)
-            if not datos: continue 
-            
-            try:
-                # Insertar o ignorar si ya existe (Evitar duplicados)
-                # OJO: Guardamos 'social_profiles' como JSON
-                cur.execute(
-                    """INSERT INTO prospects (campaign_id, business_name, website_url, phone_number, captured_email, social_profiles, source_bot_id, status, raw_data, created_at)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s, 'cazado', %s, NOW()) 
-                       ON CONFLICT DO NOTHING RETURNING id;""",
-                    (campana_id, datos["business_name"], datos["website_url"], datos["phone_number"], datos["email"], Json(datos["social_profiles"]), actor_id, Json(datos["raw_data"]))
-                )
-                if cur.rowcount > 0: contador += 1
-            except Exception as e_db:
-                conn.rollback()
-                logging.error(f"Error guardando prospecto: {e_db}")
-            else:
-                conn.commit()
-                
-        cur.close()
-        conn.close()
-        logging.info(f"✅ FINALIZADO. Guardados: {contador}")
+        # Guardado en Base de Datos (streaming por chunks)
+        conn = conexion_db.tomar()
+        try:
+            escritor = EscritorProspectos(conn, campana_id, plataforma, actor_id)
+            for item in client.dataset(dataset_id).iterate_items():
+                escritor.agregar(item)
+            escritor.vaciar()
+        finally:
+            conn.close()
+        logging.info(f"✅ FINALIZADO. Guardados: {escritor.insertados} | Duplicados: {escritor.duplicados} | Descartados: {escritor.descartados} | Reutilizados: {escritor.reutilizados} | Fallidos: {escritor.fallidos}")
         return True
 
     except Exception as e:
@@ -289,7 +520,7 @@ def ejecutar_caza(campana_id, prompt_busqueda, ubicacion, plataforma="Google Map
         if "Actor with this name was not found" in error_msg or "Actor not found" in error_msg:
             logging.info(f"🔧 AUTO-REPARACIÓN: La herramienta {actor_id} está rota. Apagándola en DB...")
             try:
-                conn_fix = psycopg2.connect(DATABASE_URL)
+                conn_fix = conexion_db.tomar()
                 cur_fix = conn_fix.cursor()
                 
                 # 1. Apagamos la herramienta rota
@@ -337,7 +568,7 @@ def analizar_prospecto_ia(datos, contexto_campana):
 def procesar_prospectos_pendientes():
     conn = None
     try:
-        conn = psycopg2.connect(DATABASE_URL)
+        conn = conexion_db.tomar()
         cur = conn.cursor()
         
         cur.execute("""
@@ -1,11 +1,17 @@
 import os
 import re
+import atexit
 import logging
 import requests
-import psycopg2
+import threading
+import conexion_db
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from psycopg2.extras import execute_batch
+from requests.adapters import HTTPAdapter
 from urllib.parse import urljoin, urlparse
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
+from cache_web import obtener_html
 
 # --- CONFIGURACIÓN ---
 load_dotenv()
@@ -13,6 +19,16 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - SUPER ESPIA - %(le
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
+# --- MOTOR DE RASTREO CONCURRENTE ---
+TAMANO_LOTE = int(os.environ.get("ESPIA_LOTE", 50))          # Webs por turno
+HILOS_SITIOS = int(os.environ.get("ESPIA_HILOS", 10))        # Sitios en paralelo
+MAX_POR_HOST = int(os.environ.get("ESPIA_MAX_POR_HOST", 2))  # Cortesía: peticiones simultáneas por dominio
+MAX_SATELITES = 3                                            # Sub-páginas por sitio (Contacto, About...)
+MINUTOS_RECLAMO = 15                                         # 'espiando' más viejo = abandonado
+
+# Emails que cortan la búsqueda apenas aparecen
+PALABRAS_PRIORITARIAS = ['info', 'contact', 'hello', 'hola', 'admin']
+
 # --- LISTA NEGRA DE EMAILS BASURA (Para no guardar basura) ---
 EMAILS_IGNORAR = [
     "sentry", "noreply", "no-reply", "example", "domain", "email", 
@@ -29,9 +45,40 @@ HEADERS = {
 }
 
 class SuperEspiaWeb:
-    def __init__(self):
+    def __init__(self, hilos_paginas=HILOS_SITIOS * MAX_SATELITES, max_por_host=MAX_POR_HOST):
+        # Una sola sesión compartida por todos los hilos, con pool de conexiones amplio
         self.session = requests.Session()
         self.session.headers.update(HEADERS)
+        adaptador = HTTPAdapter(pool_connections=HILOS_SITIOS * 2, pool_maxsize=hilos_paginas)
+        self.session.mount('http://', adaptador)
+        self.session.mount('https://', adaptador)
+
+        # Cortesía por dominio: nunca más de `max_por_host` peticiones a la vez al mismo sitio
+        self.max_por_host = max_por_host
+        self._semaforos_host = {}
+        self._lock_hosts = threading.Lock()
+
+        # Pool para las sub-páginas (separado del de sitios para no bloquearnos a nosotros mismos)
+        self._pool_paginas = ThreadPoolExecutor(max_workers=hilos_paginas)
+
+    def cerrar(self):
+        self._pool_paginas.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def _semaforo_de(self, url):
+        host = urlparse(url).netloc.lower()
+        with self._lock_hosts:
+            if host not in self._semaforos_host:
+                self._semaforos_host[host] = threading.BoundedSemaphore(self.max_por_host)
+            return self._semaforos_host[host]
+
+    def _descargar(self, url, timeout):
+        """ GET (vía caché web compartida) respetando el tope por dominio. Devuelve (status, html). """
+        return obtener_html(url, session=self.session, timeout=timeout, semaforo=self._semaforo_de(url))
+
+    @staticmethod
+    def es_prioritario(email):
+        return any(x in email for x in PALABRAS_PRIORITARIAS)
 
     def es_email_valido(self, email):
         """ Filtra emails falsos, imágenes o de librerías JS """
@@ -52,10 +99,10 @@ class SuperEspiaWeb:
     def escanear_pagina(self, url):
         """ Descarga y analiza una URL específica """
         try:
-            resp = self.session.get(url, timeout=10) # Timeout corto para ser rápido
-            if resp.status_code != 200: return set()
+            status, html = self._descargar(url, timeout=10) # Timeout corto para ser rápido
+            if status != 200: return set()
             
-            soup = BeautifulSoup(resp.text, 'html.parser')
+            soup = BeautifulSoup(html, 'html.parser')
             
             # 1. Buscar en mailto: links (Lo más efectivo)
             emails_encontrados = set()
@@ -86,14 +133,18 @@ class SuperEspiaWeb:
 
         try:
             # 1. Escaneo Home
-            resp = self.session.get(url_base, timeout=15)
-            soup = BeautifulSoup(resp.text, 'html.parser')
+            _, html = self._descargar(url_base, timeout=15)
+            soup = BeautifulSoup(html, 'html.parser')
             
             # Sacar emails de Home
             emails_totales.update(self.extraer_emails_de_texto(soup.get_text()))
             for link in soup.select('a[href^="mailto:"]'):
                 emails_totales.add(link.get('href').replace('mailto:', '').split('?')[0])
 
+            # Salida temprana: si la Home ya trae un info@/contacto@, no gastamos más peticiones
+            prioritario = self._elegir_email(emails_totales, solo_prioritario=True)
+            if prioritario: return prioritario
+
             # 2. Buscar páginas satélite (Contacto, About)
             links_internos = set()
             palabras_clave = ['contact', 'contac', 'about', 'nosotros', 'equipo', 'team']
@@ -106,88 +157,144 @@ class SuperEspiaWeb:
                     if urlparse(full_url).netloc == urlparse(url_base).netloc:
                         links_internos.add(full_url)
 
-            # 3. Escanear Satélites (Máximo 3 para no tardar años)
-            for link_interno in list(links_internos)[:3]:
-                # print(f"   -> Revisando sub-página: {link_interno}")
-                emails_totales.update(self.escanear_pagina(link_interno))
+            # 3. Escanear Satélites EN PARALELO (Máximo 3 para no tardar años)
+            futuros = [self._pool_paginas.submit(self.escanear_pagina, link) for link in list(links_internos)[:MAX_SATELITES]]
+            for futuro in as_completed(futuros):
+                emails_totales.update(futuro.result())
+                prioritario = self._elegir_email(emails_totales, solo_prioritario=True)
+                if prioritario:
+                    # Ya tenemos lo mejor posible: cancelamos lo que no empezó
+                    for pendiente in futuros: pendiente.cancel()
+                    return prioritario
 
         except Exception as e:
             logging.warning(f"⚠️ Sitio web blindado o caído ({url_base}): {str(e)[:50]}")
             return None
 
-        # Filtrar final
-        validos = [e for e in emails_totales if self.es_email_valido(e)]
-        
-        if validos:
-            # Prioridad: Info, Contacto, Admin
-            prioritarios = [e for e in validos if any(x in e for x in ['info', 'contact', 'hello', 'hola', 'admin'])]
-            return prioritarios[0] if prioritarios else validos[0]
-        
+        return self._elegir_email(emails_totales)
+
+    def _elegir_email(self, emails, solo_prioritario=False):
+        """ Prioridad: Info, Contacto, Admin. Si no hay, el primero válido (salvo solo_prioritario). """
+        validos = sorted(e for e in emails if self.es_email_valido(e))
+        prioritarios = [e for e in validos if self.es_prioritario(e)]
+        if prioritarios: return prioritarios[0]
+        if validos and not solo_prioritario: return validos[0]
         return None
 
+# --- ESPÍA COMPARTIDO (uno por proceso; gunicorn hace fork) ---
+# La sesión keep-alive y los semáforos por dominio sobreviven entre lotes y son
+# los mismos para todos los hilos del pipeline: el tope MAX_POR_HOST se respeta
+# aunque dos lotes concurrentes apunten al mismo sitio.
+_espia = None
+_pid_espia = None
+_lock_espia = threading.Lock()
+
+def obtener_espia():
+    global _espia, _pid_espia
+    with _lock_espia:
+        if _pid_espia != os.getpid():
+            # Proceso hijo recién forkeado: la sesión y el pool del padre no sirven aquí
+            _espia = None
+            _pid_espia = os.getpid()
+        if _espia is None:
+            _espia = SuperEspiaWeb()
+        return _espia
+
+@atexit.register
+def _cerrar_espia():
+    with _lock_espia:
+        if _espia is not None and _pid_espia == os.getpid():
+            _espia.cerrar()
+
 # --- FUNCIÓN PRINCIPAL (LA QUE LLAMA EL ORQUESTADOR) ---
 
-def ejecutar_espia(campana_id, limite_diario_contratado=4):
-    logging.info(f"🕵️ SUPER ESPÍA WEB ACTIVO | Campaña: {campana_id}")
+# Consulta caliente del reclamo (migrador.py verificar la pasa por EXPLAIN)
+SQL_RECLAMAR_OBJETIVOS = """
+    UPDATE prospects p
+    SET status = 'espiando', updated_at = NOW()
+    FROM (
+        SELECT id FROM prospects
+        WHERE (%s IS NULL OR campaign_id = %s)
+        AND (
+            (status = 'cazado'
+             AND website_url IS NOT NULL
+             AND (captured_email IS NULL OR length(captured_email) < 5))
+            OR (status = 'espiando' AND updated_at < NOW() - %s * INTERVAL '1 minute')
+        )
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ) sel
+    WHERE p.id = sel.id
+    RETURNING p.id, p.website_url, p.business_name
+"""
+
+def reclamar_objetivos(cur, tamano_lote, campana_id=None):
+    """
+    Toma webs pendientes (tienen web, no email) marcándolas 'espiando' con FOR UPDATE SKIP LOCKED.
+    Recupera también las que quedaron colgadas en 'espiando' (proceso caído).
+    """
+    cur.execute(SQL_RECLAMAR_OBJETIVOS, (campana_id, campana_id, MINUTOS_RECLAMO, tamano_lote))
+    return cur.fetchall()
+
+def ejecutar_espia(campana_id=None, tamano_lote=TAMANO_LOTE, hilos=HILOS_SITIOS):
+    """ Espía un lote (de una campaña, o de todas si campana_id es None). Devuelve cuántos prospectos avanzó. """
+    logging.info(f"🕵️ SUPER ESPÍA WEB ACTIVO | Campaña: {campana_id or 'todas'}")
     
-    agente007 = SuperEspiaWeb()
+    agente007 = obtener_espia()
     conn = None
     
     try:
-        conn = psycopg2.connect(DATABASE_URL)
+        conn = conexion_db.tomar()
         cur = conn.cursor()
 
         # 1. AUDITORÍA GRATUITA (Mover los que ya tienen datos)
         cur.execute("""
             UPDATE prospects SET status = 'espiado', updated_at = NOW()
-            WHERE campaign_id = %s AND status = 'cazado' 
+            WHERE (%s IS NULL OR campaign_id = %s) AND status = 'cazado' 
             AND captured_email IS NOT NULL AND length(captured_email) > 5
-        """, (campana_id,))
-        if cur.rowcount > 0:
-            logging.info(f"✨ {cur.rowcount} prospectos ya tenían email. Promovidos gratis.")
+        """, (campana_id, campana_id))
+        promovidos = cur.rowcount
+        if promovidos > 0:
+            logging.info(f"✨ {promovidos} prospectos ya tenían email. Promovidos gratis.")
         conn.commit()
 
-        # 2. SELECCIONAR OBJETIVOS (Tienen Web pero no Email)
-        query = """
-            SELECT id, website_url, business_name
-            FROM prospects
-            WHERE campaign_id = %s
-            AND status = 'cazado'
-            AND website_url IS NOT NULL
-            AND (captured_email IS NULL OR length(captured_email) < 5)
-            LIMIT 10; -- Lote pequeño para ser rápido
-        """
-        cur.execute(query, (campana_id,))
-        objetivos = cur.fetchall()
+        # 2. RECLAMAR OBJETIVOS (Tienen Web pero no Email)
+        objetivos = reclamar_objetivos(cur, tamano_lote, campana_id)
+        conn.commit()
 
         if not objetivos:
             logging.info("💤 No hay webs pendientes para espiar.")
-            return
+            return promovidos
 
-        logging.info(f"🎯 Objetivos en la mira: {len(objetivos)}")
+        logging.info(f"🎯 Objetivos en la mira: {len(objetivos)} ({hilos} en paralelo)")
         
-        for pid, web, nombre in objetivos:
-            nuevo_email = agente007.infiltrarse_en_sitio(web)
-            
+        # 3. INFILTRACIÓN EN PARALELO: un sitio lento ya no frena a los demás
+        with ThreadPoolExecutor(max_workers=hilos) as pool:
+            emails = list(pool.map(lambda objetivo: agente007.infiltrarse_en_sitio(objetivo[1]), objetivos))
+
+        actualizaciones = []
+        for (pid, web, nombre), nuevo_email in zip(objetivos, emails):
             if nuevo_email:
                 logging.info(f"✅ ¡ÉXITO! Email robado de {web}: {nuevo_email}")
-                cur.execute("""
-                    UPDATE prospects 
-                    SET captured_email = %s, status = 'espiado', updated_at = NOW()
-                    WHERE id = %s
-                """, (nuevo_email, pid))
             else:
-                logging.info(f"❌ Misión fallida en {web}. Marcado como revisado.")
                 # Lo pasamos a 'espiado' igual, para que el Analista decida si sirve sin email (o con teléfono)
-                # O lo marcamos como 'revisado_sin_email' si quieres ser estricto.
-                # Por ahora, lo pasamos para no trancar el flujo.
-                cur.execute("UPDATE prospects SET status = 'espiado', updated_at = NOW() WHERE id = %s", (pid,))
-            
-            conn.commit()
+                logging.info(f"❌ Misión fallida en {web}. Marcado como revisado.")
+            actualizaciones.append((nuevo_email, pid))
+
+        # 4. Un solo viaje a la DB para todo el lote
+        execute_batch(cur, """
+            UPDATE prospects 
+            SET captured_email = COALESCE(%s, captured_email), status = 'espiado', updated_at = NOW()
+            WHERE id = %s
+        """, actualizaciones, page_size=len(actualizaciones))
+        conn.commit()
+        return promovidos + len(actualizaciones)
 
     except Exception as e:
+        # Los 'espiando' de este lote se recuperan solos a los MINUTOS_RECLAMO
         logging.error(f"🔥 Error Crítico del Espía: {e}")
         if conn: conn.rollback()
+        return 0
     finally:
         if conn: conn.close()
 
@@ -3,8 +3,11 @@ import time
 import json
 import logging
 import datetime
-import psycopg2
-from psycopg2.extras import Json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import conexion_db
+import memoria_chat
+from psycopg2.extras import Json, execute_batch
 import google.generativeai as genai
 from dotenv import load_dotenv
 
@@ -22,6 +25,45 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - NUTRIDOR - %(level
 DATABASE_URL = os.environ.get("DATABASE_URL")
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
 
+# Jugadas por ronda: van en paralelo a la IA (brain.run_many)
+TAMANO_LOTE = int(os.environ.get("NUTRIDOR_LOTE", 30))
+HORAS_ENTRE_JUGADAS = 48
+# Un reclamo empuja next_step_at este tanto (x2 por cada intento fallido previo):
+# si la ronda muere, el prospecto vuelve solo
+MINUTOS_RECLAMO = 15
+# Reclamos seguidos sin jugada antes de rendirse con un prospecto ('error_nutricion')
+MAX_INTENTOS = int(os.environ.get("NUTRIDOR_MAX_INTENTOS", 3))
+
+# Consultas calientes del reclamo (migrador.py verificar las pasa por EXPLAIN)
+SQL_RENDIR_AGOTADOS = """
+    UPDATE prospects
+    SET status = 'error_nutricion', updated_at = NOW()
+    WHERE status = 'nutriendo' AND next_step_at <= NOW()
+    AND (%s IS NULL OR campaign_id = %s)
+    AND intentos_jugada >= %s
+"""
+
+SQL_RECLAMAR_VENCIDOS = """
+    UPDATE prospects p
+    SET next_step_at = NOW() + %s * 2 ^ LEAST(p.intentos_jugada, 6) * INTERVAL '1 minute',
+        intentos_jugada = p.intentos_jugada + 1
+    FROM (
+        SELECT p.id
+        FROM prospects p
+        JOIN campaigns c ON p.campaign_id = c.id
+        JOIN clients cl ON c.client_id = cl.id
+        WHERE p.status = 'nutriendo'
+        AND p.next_step_at <= NOW()
+        AND (cl.is_active OR cl.next_payment_date + INTERVAL '5 days' >= CURRENT_DATE)
+        AND (%s IS NULL OR p.campaign_id = %s)
+        ORDER BY p.next_step_at
+        LIMIT %s
+        FOR UPDATE OF p SKIP LOCKED
+    ) sel
+    WHERE p.id = sel.id
+    RETURNING p.id
+"""
+
 # --- CONFIGURACIÓN DE IA (MODIFICADO PARA USAR BRAIN) ---
 # Comentamos esto para que no bloquee la rotación con una llave fija vieja
 # if GOOGLE_API_KEY:
@@ -30,28 +72,41 @@ GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
 # else:
 #     MODELO_IA = None
 
-class TrabajadorNutridor:
-    def __init__(self):
-        self.conn = None
+# --- CHAT DEL NIDO ---
+CONTEXTO_TTL_SEGUNDOS = int(os.environ.get("NIDO_CONTEXTO_TTL", 300))
+MAX_CONTEXTOS_CACHE = 5000
+_cache_contexto = {}  # token -> (expira_monotonic, contexto)
+_lock_contexto = threading.Lock()
+# Contador de interacciones y memoria de la charla: fuera del camino de la respuesta.
+# Un solo hilo conserva el orden de los turnos.
+_segundo_plano = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nido-fondo")
 
-    def conectar(self):
-        try:
-            self.conn = psycopg2.connect(DATABASE_URL)
-            return self.conn.cursor()
-        except Exception as e:
-            logging.error(f"Error DB: {e}")
-            return None
+def _sumar_interaccion(prospecto_id):
+    try:
+        with conexion_db.conexion() as conn, conn.cursor() as cur:
+            cur.execute("UPDATE prospects SET interactions_count = interactions_count + 1 WHERE id = %s", (prospecto_id,))
+            conn.commit()
+    except Exception as e:
+        logging.error(f"⚠️ No se pudo sumar la interacción de {prospecto_id}: {e}")
 
-    # --- CEREBRO PSICOLÓGICO (Generador de Jugadas - Ciclo Lento 48h) ---
+def dolor_principal(pain_points):
+    """ pain_points guarda el JSON entero del Analista ({"pain_points": [...], ...}) o una lista. """
+    if isinstance(pain_points, dict): pain_points = pain_points.get('pain_points')
+    if isinstance(pain_points, list) and pain_points: return pain_points[0]
+    return 'Necesidad General'
 
-    def generar_jugada_maestra(self, prospecto, campana, analisis, paso_actual):
-        """
-        Genera el contenido para el Nido basado en el Paso (1-7) 
-        y aplica la estrategia psicológica correspondiente.
-        """
-        # Verificación del Brain en lugar del Modelo Fijo
-        if not brain: return None
+def interpretar_jugada(texto):
+    texto_limpio = texto.replace("```json", "").replace("```", "").strip()
+    return json.loads(texto_limpio)
 
+class TrabajadorNutridor:
+    # Sin estado de conexión en la instancia: main.py comparte este objeto entre hilos de gunicorn.
+    # Cada método toma su propia conexión del pool (conexion_db).
+
+    # --- CEREBRO PSICOLÓGICO (Generador de Jugadas - Ciclo Lento 48h) ---
+
+    def construir_prompt_jugada(self, prospecto, campana, analisis, paso_actual):
+        """ Arma el prompt de la jugada `paso_actual` (1-7) con su estrategia psicológica. """
         # LA ESCALERA DE PERSUASIÓN (Tus 20 Trucos aplicados)
         estrategias = {
             1: "Aporte de Valor + Reciprocidad (Regalar conocimiento sin pedir nada)",
@@ -66,13 +121,13 @@ class TrabajadorNutridor:
         estrategia_actual = estrategias.get(paso_actual, "Aporte de Valor")
         
         # PROMPT DE INGENIERÍA DE VENTAS
-        prompt = f"""
+        return f"""
         ERES: Un Estratega de Ventas B2B (Estilo Jordan Belfort).
         MISIÓN: Nutrir a un prospecto en el "Nido". Estamos en el MENSAJE {paso_actual} de 7.
         
         DATOS DEL PROSPECTO:
         - Nombre: {prospecto.get('business_name')}
-        - Dolor Principal: {analisis.get('pain_points', ['Necesidad General'])[0]}
+        - Dolor Principal: {dolor_principal(analisis.get('pain_points'))}
         
         DATOS DE NOSOTROS (CAMPAÑA):
         - Producto: {campana.get('product_description')}
@@ -98,6 +153,15 @@ class TrabajadorNutridor:
         }}
         """
 
+    def generar_jugada_maestra(self, prospecto, campana, analisis, paso_actual):
+        """
+        Genera el contenido para el Nido basado en el Paso (1-7) 
+        y aplica la estrategia psicológica correspondiente.
+        """
+        # Verificación del Brain en lugar del Modelo Fijo
+        if not brain: return None
+        prompt = self.construir_prompt_jugada(prospecto, campana, analisis, paso_actual)
+
         model_id = None # Para rastrear fallos
         try:
             # CAMBIO: Usamos brain para obtener modelo INTELIGENTE
@@ -108,32 +172,29 @@ class TrabajadorNutridor:
             # CAMBIO: Registramos uso
             brain.register_usage(model_id)
             
-            texto_limpio = res.text.replace("```json", "").replace("```", "").strip()
-            return json.loads(texto_limpio)
+            return interpretar_jugada(res.text)
         except Exception as e:
             logging.error(f"⚠️ Error IA Nutridor: {e}")
             # CAMBIO: Reportamos si es un error de cuota para cambiar llave
             if model_id and "429" in str(e): 
-                brain.report_failure(model_id)
+                brain.report_failure(model_id, str(e))
                 raise e 
             return None
 
     # --- CEREBRO INSTANTÁNEO (Chatbot Vendedor - NUEVA FUNCIÓN) ---
     # Esta es la pieza que faltaba para conectar el Nido en tiempo real
-    
-    def responder_chat_instantaneo(self, mensaje_usuario, token_sesion):
+
+    def obtener_contexto_chat(self, token_sesion):
         """
-        Responde al prospecto EN TIEMPO REAL dentro del Nido.
-        Esta función es llamada por main.py (/api/chat-nido).
+        Prospecto + campaña del token, con caché en memoria (CONTEXTO_TTL_SEGUNDOS).
+        Una conversación manda muchos mensajes seguidos: solo el primero toca la DB.
         """
-        if not brain: return "Error: Cerebro IA desconectado."
+        ahora = time.monotonic()
+        with _lock_contexto:
+            entrada = _cache_contexto.get(token_sesion)
+            if entrada and entrada[0] > ahora: return entrada[1]
 
-        conn = None
-        try:
-            conn = psycopg2.connect(DATABASE_URL)
-            cur = conn.cursor()
-            
-            # 1. Recuperar Contexto (Quién es el prospecto y qué le vendemos)
+        with conexion_db.conexion() as conn, conn.cursor() as cur:
             # Buscamos por el token de sesión que es seguro
             cur.execute("""
                 SELECT p.business_name, p.pain_points, c.product_description, c.tone_voice, c.sales_link, p.id
@@ -141,28 +202,44 @@ class TrabajadorNutridor:
                 JOIN campaigns c ON p.campaign_id = c.id
                 WHERE p.access_token = %s
             """, (token_sesion,))
-            
             datos = cur.fetchone()
-            if not datos: return "Error: Sesión no válida."
-            
-            p_nombre, p_dolores, c_producto, c_tono, c_link, p_id = datos
-            
-            # 2. Registrar Interacción (Para cobrar si llega a 3)
-            # Cada vez que el cliente habla, cuenta como interacción
-            cur.execute("UPDATE prospects SET interactions_count = interactions_count + 1 WHERE id = %s", (p_id,))
-            conn.commit()
+        if not datos: return None
+
+        contexto = dict(zip(("business_name", "pain_points", "product_description", "tone_voice", "sales_link", "id"), datos))
+        with _lock_contexto:
+            if len(_cache_contexto) >= MAX_CONTEXTOS_CACHE:
+                for clave in [k for k, v in _cache_contexto.items() if v[0] <= ahora]: del _cache_contexto[clave]
+                if len(_cache_contexto) >= MAX_CONTEXTOS_CACHE: _cache_contexto.clear()
+            _cache_contexto[token_sesion] = (ahora + CONTEXTO_TTL_SEGUNDOS, contexto)
+        return contexto
+
+    def registrar_interaccion(self, prospecto_id):
+        """ Suma la interacción (para cobrar si llega a 3) FUERA del camino de la respuesta. """
+        _segundo_plano.submit(_sumar_interaccion, prospecto_id)
 
-            # 3. Generar Respuesta con IA
-            prompt_chat = f"""
+    def recordar_intercambio(self, token_sesion, mensaje_usuario, respuesta_ia):
+        """ Guarda el turno en la memoria de la conversación (memoria_chat) en segundo plano. """
+        def guardar():
+            try:
+                memoria_chat.registrar_intercambio(token_sesion, mensaje_usuario, respuesta_ia)
+            except Exception as e:
+                logging.error(f"⚠️ No se pudo guardar la conversación de {token_sesion}: {e}")
+        _segundo_plano.submit(guardar)
+
+    def construir_prompt_chat(self, contexto, mensaje_usuario, historial=""):
+        return f"""
             ERES: Un Vendedor Experto de Top Performer.
             TU OBJETIVO: Cerrar la venta o agendar una llamada.
             
-            CLIENTE: {p_nombre}
-            SU DOLOR: {p_dolores}
+            CLIENTE: {contexto['business_name']}
+            SU DOLOR: {contexto['pain_points']}
+            
+            PRODUCTO QUE VENDES: {contexto['product_description']}
+            TU TONO: {contexto['tone_voice']}
+            LINK DE VENTA (Solo úsalo si muestran interés de compra): {contexto['sales_link']}
             
-            PRODUCTO QUE VENDES: {c_producto}
-            TU TONO: {c_tono}
-            LINK DE VENTA (Solo úsalo si muestran interés de compra): {c_link}
+            CONVERSACIÓN HASTA AHORA:
+            {historial or "(es el primer mensaje)"}
             
             MENSAJE DEL CLIENTE: "{mensaje_usuario}"
             
@@ -172,26 +249,68 @@ class TrabajadorNutridor:
             - Si es una objeción, usa la técnica "Sentir, Sentí, Encontré".
             - Termina siempre con una pregunta para mantener la conversación.
             """
-            
-            # CAMBIO: Usamos modelo VELOZ para chat
-            model_id = None
-            try:
-                model, model_id = brain.get_optimal_model(task_type="velocidad")
-                res = model.generate_content(prompt_chat)
-                brain.register_usage(model_id)
-                return res.text
-            except Exception as e_ia:
-                if model_id and "429" in str(e_ia):
-                    brain.report_failure(model_id)
-                logging.error(f"Error IA Chat: {e_ia}")
-                return "Dame un momento, estoy revisando tu caso..."
+    
+    def responder_chat_instantaneo(self, mensaje_usuario, token_sesion):
+        """
+        Responde al prospecto EN TIEMPO REAL dentro del Nido.
+        Esta función es llamada por main.py (/api/chat-nido).
+        """
+        return "".join(self.responder_chat_stream(mensaje_usuario, token_sesion))
 
+    def responder_chat_stream(self, mensaje_usuario, token_sesion):
+        """
+        Igual que responder_chat_instantaneo pero va entregando la respuesta
+        por trozos a medida que Gemini los genera (/api/chat-nido/stream).
+        """
+        if not brain:
+            yield "Error: Cerebro IA desconectado."
+            return
+
+        try:
+            # 1. Recuperar Contexto (Quién es el prospecto y qué le vendemos)
+            contexto = self.obtener_contexto_chat(token_sesion)
         except Exception as e:
             logging.error(f"🔥 Error Chat Nido: {e}")
-            return "Lo siento, tuve un problema técnico. ¿Podrías repetirlo?"
-        finally:
-            if conn: conn.close()
+            yield "Lo siento, tuve un problema técnico. ¿Podrías repetirlo?"
+            return
+        if not contexto:
+            yield "Error: Sesión no válida."
+            return
 
+        model_id = None
+        trozos = []
+        completa = False
+        try:
+            # 2. Memoria acotada: resumen + últimos turnos (si falla, se responde sin historial)
+            try:
+                historial = memoria_chat.contexto_conversacion(token_sesion)
+            except Exception as e:
+                logging.error(f"⚠️ Memoria de chat no disponible: {e}")
+                historial = ""
+
+            # 3. Generar Respuesta con IA (modelo VELOZ para chat)
+            model, model_id = brain.get_optimal_model(task_type="velocidad")
+            prompt = self.construir_prompt_chat(contexto, mensaje_usuario, historial)
+            for trozo in model.generate_content(prompt, stream=True):
+                texto = getattr(trozo, "text", "")
+                if texto:
+                    trozos.append(texto)
+                    yield texto
+            completa = True
+        except Exception as e_ia:
+            if model_id and "429" in str(e_ia):
+                brain.report_failure(model_id, str(e_ia))
+            logging.error(f"Error IA Chat: {e_ia}")
+            if not trozos:
+                yield "Dame un momento, estoy revisando tu caso..."
+        finally:
+            # 4. Contabilidad del turno, también si el cliente cierra la página a mitad
+            # (GeneratorExit no pasa por el except): la interacción cuenta, lo que
+            # Gemini ya generó se gastó, y la memoria guarda el texto que SÍ se envió.
+            self.registrar_interaccion(contexto["id"])
+            if model_id and (completa or trozos):
+                brain.register_usage(model_id)
+            self.recordar_intercambio(token_sesion, mensaje_usuario, "".join(trozos))
 
     # --- GESTIÓN FINANCIERA (El cobrador amable) ---
 
@@ -199,12 +318,10 @@ class TrabajadorNutridor:
         """
         Verifica si el cliente pagó. Da 5 días de gracia.
         """
-        cur = self.conectar()
-        if not cur: return False
-        
         try:
-            cur.execute("SELECT next_payment_date, is_active FROM clients WHERE id = %s", (client_id,))
-            res = cur.fetchone()
+            with conexion_db.conexion() as conn, conn.cursor() as cur:
+                cur.execute("SELECT next_payment_date, is_active FROM clients WHERE id = %s", (client_id,))
+                res = cur.fetchone()
             if not res: return False
             
             fecha_pago, activo = res
@@ -227,103 +344,137 @@ class TrabajadorNutridor:
             
             return False
             
-        except Exception:
+        except Exception as e:
+            logging.error(f"Error DB: {e}")
             return False
-        finally:
-            cur.close()
-            if self.conn: self.conn.close()
 
     # --- MOTOR DE EJECUCIÓN ---
 
-    def ejecutar_ciclo_seguimiento(self):
+    def reclamar_vencidos(self, cur, tamano_lote, campana_id=None):
+        """
+        Prospectos del Nido a los que YA les toca jugada, de clientes al día
+        (activos, o dentro de los 5 días de gracia), en UNA consulta.
+        El reclamo empuja next_step_at unos minutos (FOR UPDATE SKIP LOCKED):
+        dos rondas en paralelo nunca generan la misma jugada. Cada reclamo sin
+        jugada duplica la espera; tras MAX_INTENTOS quedan en 'error_nutricion'.
+        """
+        cur.execute(SQL_RENDIR_AGOTADOS, (campana_id, campana_id, MAX_INTENTOS))
+        if cur.rowcount:
+            logging.warning(f"🧯 {cur.rowcount} prospectos agotaron {MAX_INTENTOS} intentos de jugada: 'error_nutricion'.")
+
+        cur.execute(SQL_RECLAMAR_VENCIDOS, (MINUTOS_RECLAMO, campana_id, campana_id, tamano_lote))
+        ids = [r[0] for r in cur.fetchall()]
+        if not ids: return []
+
+        cur.execute("""
+            SELECT 
+                p.id, p.business_name, p.pain_points, p.nido_data,
+                c.product_description, c.tone_voice
+            FROM prospects p
+            JOIN campaigns c ON p.campaign_id = c.id
+            WHERE p.id = ANY(%s)
+        """, (ids,))
+        return cur.fetchall()
+
+    def ejecutar_ciclo_seguimiento(self, campana_id=None, limite=None):
+        """
+        Ronda de jugadas del Nido. Con `campana_id` solo atiende esa campaña y con
+        `limite` corta tras esa cantidad de jugadas IA. Devuelve cuántas generó.
+        """
         logging.info("🏗️ NUTRIDOR: Iniciando ronda de mantenimiento del Nido...")
         
+        tamano_lote = TAMANO_LOTE if limite is None else min(TAMANO_LOTE, limite)
+        jugadas = 0
         conn = None
         try:
-            conn = psycopg2.connect(DATABASE_URL)
+            conn = conexion_db.tomar()
             cur = conn.cursor()
 
-            # 1. BUSCAR PROSPECTOS EN 'NUTRIENDO'
-            # (Aquellos que ya dejaron su email en el Pre-Nido)
-            cur.execute("""
-                SELECT 
-                    p.id, p.business_name, p.pain_points, p.nido_data, p.updated_at,
-                    c.id as campaign_id, c.client_id, c.product_description, c.tone_voice
-                FROM prospects p
-                JOIN campaigns c ON p.campaign_id = c.id
-                WHERE p.status = 'nutriendo'
-            """)
-            
-            prospectos = cur.fetchall()
-            
-            for fila in prospectos:
-                pid, p_nombre, p_dolores, p_nido_json, p_ultimo_update, cid, client_id, c_prod, c_tono = fila
-                
-                # A. VERIFICAR PAGOS (Regla de los 5 días)
-                if not self.verificar_permiso_cliente(client_id):
-                    continue # Cliente moroso, no trabajamos para él.
+            # 1. RECLAMAR LOS QUE YA LES TOCA (next_step_at vencido, cliente al día)
+            prospectos = self.reclamar_vencidos(cur, tamano_lote, campana_id) if tamano_lote > 0 else []
+            conn.commit()
 
-                # B. DETERMINAR EL PASO ACTUAL (1 al 7)
+            frios = []
+            trabajos = []
+            for pid, p_nombre, p_dolores, p_nido_json, c_prod, c_tono in prospectos:
+                # DETERMINAR EL PASO ACTUAL (1 al 7)
                 datos_nido = p_nido_json if p_nido_json else {}
-                paso_actual = datos_nido.get("fase", 0)
-                
-                # C. CONTROL DE TIEMPO (No spamear)
-                # Esperamos 48 horas entre mensajes, excepto el primero (paso 0)
-                if p_ultimo_update:
-                    horas_pasadas = (datetime.datetime.now() - p_ultimo_update).total_seconds() / 3600
-                    if paso_actual > 0 and horas_pasadas < 48:
-                        continue # Aún no toca
-                
-                nuevo_paso = paso_actual + 1
+                nuevo_paso = datos_nido.get("fase", 0) + 1
 
-                # D. REGLA DE SALIDA: Si ya pasó el 7, es Lead Frío
+                # REGLA DE SALIDA: Si ya pasó el 7, es Lead Frío
                 if nuevo_paso > 7:
                     logging.info(f"❄️ Prospecto {p_nombre} sin respuesta tras 7 intentos. Lead Frío.")
-                    cur.execute("UPDATE prospects SET status = 'lead_frio' WHERE id = %s", (pid,))
-                    conn.commit()
+                    frios.append(pid)
                     continue
 
-                # E. GENERAR JUGADA CON IA
                 logging.info(f"🧠 Generando JUGADA {nuevo_paso}/7 para {p_nombre}...")
-                
-                campana_data = {"product_description": c_prod, "tone_voice": c_tono}
-                analisis_data = {"pain_points": p_dolores}
-
-                try:
-                    contenido_nuevo = self.generar_jugada_maestra(
-                        {"business_name": p_nombre}, 
-                        campana_data, 
-                        analisis_data, 
-                        nuevo_paso
-                    )
-                    
-                    if contenido_nuevo:
-                        # Guardamos en DB
-                        cur.execute("""
-                            UPDATE prospects 
-                            SET nido_data = %s, updated_at = NOW()
-                            WHERE id = %s
-                        """, (Json(contenido_nuevo), pid))
-                        conn.commit()
-                        logging.info(f"✅ Nido actualizado (Fase {nuevo_paso}) para {p_nombre}")
-                        
-                        # Pausa para no saturar Google (Anti-429)
-                        time.sleep(10)
-
-                except Exception as e_ia:
-                    if "429" in str(e_ia):
-                        logging.warning("🛑 Pausa por Límite IA (429).")
-                        time.sleep(60)
-                        break 
-                    logging.error(f"Error IA en {p_nombre}: {e_ia}")
-
-            # 2. VERIFICAR INTERACCIONES (FACTURACIÓN)
+                prompt = self.construir_prompt_jugada(
+                    {"business_name": p_nombre},
+                    {"product_description": c_prod, "tone_voice": c_tono},
+                    {"pain_points": p_dolores},
+                    nuevo_paso
+                )
+                trabajos.append((pid, p_nombre, nuevo_paso, prompt))
+
+            if frios:
+                cur.execute("UPDATE prospects SET status = 'lead_frio' WHERE id = ANY(%s)", (frios,))
+                conn.commit()
+
+            # 2. TODAS LAS JUGADAS A LA VEZ (el ritmo lo marca el limitador de ai_manager)
+            if trabajos and brain:
+                resultados = brain.run_many([t[3] for t in trabajos], task_type="inteligencia")
+                jugadas = len(trabajos)
+
+                actualizaciones = []
+                fallidos = []
+                for (pid, p_nombre, nuevo_paso, _), resultado in zip(trabajos, resultados):
+                    if resultado["error"]:
+                        # El reclamo vence solo y se reintenta con backoff (x2 por intento)
+                        logging.warning(f"🛑 Error IA en {p_nombre}: {resultado['error']}. Se reintenta más tarde.")
+                        fallidos.append(pid)
+                        continue
+                    try:
+                        contenido_nuevo = interpretar_jugada(resultado["texto"])
+                    except Exception as e:
+                        logging.error(f"Error interpretando jugada de {p_nombre}: {e}")
+                        fallidos.append(pid)
+                        continue
+                    if not contenido_nuevo:
+                        fallidos.append(pid)
+                        continue
+                    # La fase la fija el servidor, no la IA (es la que decide la siguiente jugada)
+                    contenido_nuevo["fase"] = nuevo_paso
+                    actualizaciones.append((Json(contenido_nuevo), HORAS_ENTRE_JUGADAS, pid))
+
+                # 3. Un solo viaje de red para todas las jugadas
+                if actualizaciones:
+                    execute_batch(cur, """
+                        UPDATE prospects 
+                        SET nido_data = %s, updated_at = NOW(), intentos_jugada = 0,
+                            next_step_at = NOW() + %s * INTERVAL '1 hour'
+                        WHERE id = %s
+                    """, actualizaciones, page_size=len(actualizaciones))
+                    conn.commit()
+                    logging.info(f"✅ Nido actualizado para {len(actualizaciones)}/{len(trabajos)} prospectos.")
+
+                # Los que ya gastaron MAX_INTENTOS no esperan otro reclamo para rendirse
+                if fallidos:
+                    cur.execute("""
+                        UPDATE prospects SET status = 'error_nutricion', updated_at = NOW()
+                        WHERE id = ANY(%s) AND status = 'nutriendo' AND intentos_jugada >= %s
+                    """, (fallidos, MAX_INTENTOS))
+                    if cur.rowcount:
+                        logging.warning(f"🧯 {cur.rowcount} prospectos agotaron {MAX_INTENTOS} intentos de jugada: 'error_nutricion'.")
+                    conn.commit()
+
+            # 4. VERIFICAR INTERACCIONES (FACTURACIÓN)
             # Si el cliente interactuó 3 veces, marcamos como "Validado" para cobrar.
             cur.execute("""
                 UPDATE prospects 
                 SET status = 'validado_facturable' 
                 WHERE status = 'nutriendo' AND interactions_count >= 3
-            """)
+                AND (%s IS NULL OR campaign_id = %s)
+            """, (campana_id, campana_id))
             if cur.rowcount > 0:
                 conn.commit()
                 logging.info(f"💰 ¡CA-CHING! {cur.rowcount} prospectos validados para facturación.")
@@ -334,6 +485,7 @@ class TrabajadorNutridor:
             logging.error(f"🔥 Error Ciclo Nutridor: {e}")
         finally:
             if conn: conn.close()
+        return jugadas
 
 if __name__ == "__main__":
     worker = TrabajadorNutridor()
@@ -2,10 +2,14 @@ import os
 import time
 import json
 import logging
-import psycopg2
-import random
+import conexion_db
+import signal
+import sys
+import socket
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from psycopg2.extras import Json
 from dotenv import load_dotenv
 
 # --- CONEXIÓN AL CEREBRO ROTATIVO ---
@@ -22,8 +26,8 @@ try:
     from trabajador_espia import ejecutar_espia
     
     # Trabajadores tipo "Procesamiento Lotes"
-    from trabajador_analista import trabajar_analista
-    from trabajador_persuasor import trabajar_persuasor
+    from trabajador_analista import trabajar_analista_concurrente, TAMANO_LOTE as LOTE_ANALISTA
+    from trabajador_persuasor import trabajar_persuasor, TAMANO_LOTE as LOTE_PERSUASOR
     
     # Trabajador tipo "Clase"
     from trabajador_nutridor import TrabajadorNutridor
@@ -44,13 +48,52 @@ logging.basicConfig(
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
+# --- PARALELISMO ENTRE CAMPAÑAS ---
+# Cada hilo puede tener hasta 2 conexiones del pool a la vez (ej: Nutridor):
+# mantener DB_POOL_MAX >= 2 * ORQUESTADOR_HILOS + 1.
+HILOS_ORQUESTADOR = int(os.environ.get("ORQUESTADOR_HILOS", 4))
+PLAZO_CAMPANA_SEGUNDOS = int(os.environ.get("ORQUESTADOR_PLAZO_CAMPANA", 900))
+# El lease dura el plazo + este margen; se renueva entre etapas
+MARGEN_LEASE_SEGUNDOS = 600
+
+# "ciclos" (vuelta horaria por campaña) o "pipeline" (una cola de larga vida por etapa)
+MODO_ORQUESTADOR = os.environ.get("ORQUESTADOR_MODO", "ciclos").lower()
+
+# --- AVISOS EN TIEMPO REAL (LISTEN/NOTIFY, ver escucha_eventos.py) ---
+ESCUCHAR_EVENTOS = os.environ.get("ORQUESTADOR_ESCUCHA", "1") != "0"
+# Una misma etapa+campaña no se relanza más seguido que esto (los lotes fallidos
+# vuelven a la cola y avisarían otra vez al instante)
+INTERVALO_MINIMO_EVENTO = 30
+
+# Contador del día (migraciones/009): una fila por clave primaria
+SQL_CAZADOS_HOY = "SELECT cazados FROM campaign_stats_diarias WHERE campaign_id = %s AND dia = CURRENT_DATE"
+
+# Cola en la que entra el prospecto -> etapa que hay que despertar
+ETAPA_POR_ESTADO = {
+    'cazado': 'espia',
+    'espiado': 'analista',
+    'analizado_exitoso': 'persuasor',
+    'nutriendo': 'nutridor',
+}
+
 class OrquestadorSupremo:
     def __init__(self):
         # Inicializamos al Nutridor
         self.nutridor = TrabajadorNutridor()
+        # Prefijo de las fichas de dueño en campaign_leases (cada toma agrega su propio sufijo)
+        self.dueno = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.pipeline = None
+        self.escucha = None
+        # Despacho de eventos (modo ciclos)
+        self._despacho = None
+        self._en_curso = set()
+        self._repetir = set()
+        self._lock_despacho = threading.Lock()
+        self._apagando = threading.Event()
         
     def conectar_db(self):
-        return psycopg2.connect(DATABASE_URL)
+        # Conexión del pool compartido: el .close() de siempre la devuelve al pool
+        return conexion_db.tomar()
 
     # ==============================================================================
     # 💰 MÓDULO 1: DEPARTAMENTO FINANCIERO (INTACTO)
@@ -130,12 +173,83 @@ class OrquestadorSupremo:
         if not brain: return False 
         
         try:
-            # Intentamos obtener un modelo de prueba
-            brain._find_available_key("general", "FREE") 
-            return True
-        except Exception:
-            logging.warning("🛑 GOBERNADOR: Alerta de capacidad. Todas las IAs están ocupadas o agotadas.")
+            # Cupo diario que queda en TODAS las llaves (FREE y PAID)
+            if brain.capacidad_restante() > 0:
+                return True
+        except Exception as e:
+            logging.error(f"⚠️ Gobernador sin datos de IA: {e}")
+        logging.warning("🛑 GOBERNADOR: Alerta de capacidad. Todas las IAs están ocupadas o agotadas.")
+        return False
+
+    def cupo_ia_por_campana(self, total_campanas):
+        """
+        Reparto justo: el cupo de IA que queda hoy se divide por igual entre las campañas,
+        así las primeras en terminar no se comen las llaves de las demás.
+        None = sin límite (no hay brain para medir).
+        """
+        if not brain or not total_campanas: return None
+        try:
+            return max(1, brain.capacidad_restante() // total_campanas)
+        except Exception as e:
+            logging.error(f"⚠️ No se pudo medir el cupo de IA: {e}")
+            return None
+
+    # ==============================================================================
+    # 🔐 LEASES: UNA CAMPAÑA, UN SOLO ORQUESTADOR
+    # ==============================================================================
+
+    def tomar_lease(self, camp_id, segundos, renovar=None):
+        """
+        Toma el lease de la campaña y devuelve su ficha de dueño (None si otro lo tiene vigente).
+        Cada toma usa una ficha NUEVA: dos hilos de este mismo proceso (ciclo y aviso)
+        se excluyen igual que dos máquinas. Solo quien pasa su ficha en `renovar` lo extiende.
+        Un lease vencido (proceso muerto) se puede robar.
+        """
+        dueno = renovar or f"{self.dueno}:{uuid.uuid4().hex[:8]}"
+        conn = self.conectar_db()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO campaign_leases (campaign_id, owner, expires_at)
+                    VALUES (%s::text, %s, NOW() + %s * INTERVAL '1 second')
+                    ON CONFLICT (campaign_id) DO UPDATE
+                    SET owner = EXCLUDED.owner, expires_at = EXCLUDED.expires_at
+                    WHERE campaign_leases.expires_at < NOW()
+                    OR campaign_leases.owner = EXCLUDED.owner
+                    RETURNING campaign_id
+                """, (str(camp_id), dueno, segundos))
+                tomado = cur.fetchone() is not None
+            conn.commit()
+            return dueno if tomado else None
+        except Exception as e:
+            logging.error(f"⚠️ Error tomando lease de campaña {camp_id}: {e}")
+            conn.rollback()
+            return None
+        finally:
+            conn.close()
+
+    def liberar_lease(self, camp_id, dueno):
+        conn = self.conectar_db()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM campaign_leases WHERE campaign_id = %s::text AND owner = %s", (str(camp_id), dueno))
+            conn.commit()
+        except Exception as e:
+            # No es grave: el lease vence solo
+            logging.error(f"⚠️ Error liberando lease de campaña {camp_id}: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+
+    def puede_seguir(self, camp_id, nombre, plazo, etapa, lease=None):
+        """ Punto de control entre etapas: respeta el plazo y renueva el lease (si hay). """
+        if plazo and time.monotonic() > plazo:
+            logging.warning(f"⏰ {nombre}: plazo agotado antes de '{etapa}'. Sigue en el próximo ciclo.")
+            return False
+        if lease and not self.tomar_lease(camp_id, PLAZO_CAMPANA_SEGUNDOS + MARGEN_LEASE_SEGUNDOS, renovar=lease):
+            logging.warning(f"🔐 {nombre}: se perdió el lease antes de '{etapa}'. Otra instancia la tomó.")
             return False
+        return True
 
     def planificar_estrategia_caza(self, descripcion_producto, audiencia_objetivo, tipo_producto):
         plataformas_disponibles = self.obtener_arsenal_disponible()
@@ -166,87 +280,143 @@ class OrquestadorSupremo:
 
         except Exception as e:
             logging.error(f"⚠️ Fallo estrategia IA: {e}")
-            if model_id and "429" in str(e): brain.report_failure(model_id)
+            if model_id and "429" in str(e): brain.report_failure(model_id, str(e))
             return query_default, platform_default
 
     # ==============================================================================
     # ⚙️ MÓDULO 3: COORDINACIÓN DE TRABAJADORES (LA CADENA DE MONTAJE)
     # ==============================================================================
 
-    def ejecutar_campana_secuencial(self, campana):
+    def obtener_campanas_activas(self):
+        """ Campañas activas de clientes al día, en el formato que esperan las etapas. """
+        conn = self.conectar_db()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT c.id, c.campaign_name, c.product_description, c.target_audience, 
+                           c.product_type, c.daily_prospects_limit, c.geo_location
+                    FROM campaigns c
+                    JOIN clients cl ON c.client_id = cl.id
+                    WHERE c.status = 'active' AND cl.is_active = TRUE
+                """)
+                return cur.fetchall()
+        finally:
+            conn.close()
+
+    def cazar_si_falta(self, campana):
         """
-        Ejecuta TODOS los trabajadores en orden para UNA sola campaña.
+        Lanza al Cazador si la campaña aún no cumplió su meta de hoy.
+        Devuelve True si hubo caza.
         """
-        # Desempacamos TODAS las variables, incluyendo ubicacion
         camp_id, nombre, prod, audiencia, tipo_prod, limite_diario, ubicacion = campana
         if not limite_diario: limite_diario = 4
 
-        logging.info(f"🎬 --- INICIANDO SECUENCIA PARA: {nombre} ---")
-
-        # 1. EL CAZADOR (Trae la materia prima)
         # Verificamos si ya cumplió la meta de hoy antes de mandarlo a trabajar
         conn = self.conectar_db()
         cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM prospects WHERE campaign_id = %s AND created_at::date = CURRENT_DATE AND status = 'cazado'", (camp_id,))
-        cazados_hoy = cur.fetchone()[0]
+        cur.execute(SQL_CAZADOS_HOY, (str(camp_id),))
+        fila = cur.fetchone()
+        cazados_hoy = fila[0] if fila else 0
         cur.close()
         conn.close()
 
-        if cazados_hoy < limite_diario:
-            logging.info(f"🔫 1. ACTIVANDO CAZADOR ({cazados_hoy}/{limite_diario})")
-            query_opt, plat = self.planificar_estrategia_caza(prod, audiencia, tipo_prod)
-            
-            # --- CORRECCIÓN CRÍTICA AQUI: usamos 'ubicacion' en vez de 'ubic' ---
-            ejecutar_caza(camp_id, query_opt, ubicacion, plat, "Variable", limite_diario)
-            # --------------------------------------------------------------------
-        else:
+        if cazados_hoy >= limite_diario:
             logging.info(f"✅ Meta de caza cumplida hoy para {nombre}.")
+            return False
+
+        logging.info(f"🔫 1. ACTIVANDO CAZADOR ({cazados_hoy}/{limite_diario})")
+        query_opt, plat = self.planificar_estrategia_caza(prod, audiencia, tipo_prod)
+        
+        # --- CORRECCIÓN CRÍTICA AQUI: usamos 'ubicacion' en vez de 'ubic' ---
+        ejecutar_caza(camp_id, query_opt, ubicacion, plat, "Variable", limite_diario)
+        # --------------------------------------------------------------------
+        return True
+
+    def ejecutar_campana_secuencial(self, campana, plazo=None, cupo_ia=None, lease=None):
+        """
+        Ejecuta TODOS los trabajadores en orden para UNA sola campaña.
+        `plazo` (time.monotonic) corta entre etapas; `cupo_ia` limita las llamadas
+        de IA de esta pasada (lo que sobra queda en la cola para el próximo ciclo).
+        `lease` es la ficha de tomar_lease: se renueva entre etapas.
+        """
+        # Desempacamos TODAS las variables, incluyendo ubicacion
+        camp_id, nombre, prod, audiencia, tipo_prod, limite_diario, ubicacion = campana
+
+        logging.info(f"🎬 --- INICIANDO SECUENCIA PARA: {nombre} ---")
+
+        # 1. EL CAZADOR (Trae la materia prima)
+        self.cazar_si_falta(campana)
 
         # 2. EL ESPÍA (Enriquece datos)
+        if not self.puede_seguir(camp_id, nombre, plazo, "espía", lease): return
         logging.info("🕵️ 2. ACTIVANDO ESPÍA")
-        ejecutar_espia(camp_id, limite_diario)
+        ejecutar_espia(camp_id)
 
         # 3. EL ANALISTA (Filtra calidad)
+        if not self.puede_seguir(camp_id, nombre, plazo, "analista", lease): return
+        if cupo_ia is not None and cupo_ia <= 0:
+            logging.info(f"⏸️ {nombre}: sin cupo de IA en este ciclo.")
+            return
         logging.info("🧠 3. ACTIVANDO ANALISTA")
         try:
-            trabajar_analista() # Se asume que procesa un lote y retorna
+            lote = LOTE_ANALISTA if cupo_ia is None else min(LOTE_ANALISTA, cupo_ia)
+            usados = trabajar_analista_concurrente(tamano_lote=lote, campana_id=camp_id) # SKIP LOCKED
+            if cupo_ia is not None: cupo_ia -= usados or 0
         except Exception as e:
             logging.error(f"Error Analista: {e}")
 
         # 4. EL PERSUASOR (Escribe correos)
+        if not self.puede_seguir(camp_id, nombre, plazo, "persuasor", lease): return
         logging.info("🎩 4. ACTIVANDO PERSUASOR")
         try:
-            trabajar_persuasor() # Se asume que procesa un lote y retorna
+            lote = LOTE_PERSUASOR if cupo_ia is None else min(LOTE_PERSUASOR, cupo_ia)
+            if lote > 0:
+                usados = trabajar_persuasor(campana_id=camp_id, tamano_lote=lote)
+                if cupo_ia is not None: cupo_ia -= usados or 0
         except Exception as e:
             logging.error(f"Error Persuasor: {e}")
 
         # 5. EL NUTRIDOR (Chat y Seguimiento)
+        if not self.puede_seguir(camp_id, nombre, plazo, "nutridor", lease): return
         logging.info("🌱 5. ACTIVANDO NUTRIDOR")
         try:
-            self.nutridor.ejecutar_ciclo_seguimiento()
+            self.nutridor.ejecutar_ciclo_seguimiento(campana_id=camp_id, limite=cupo_ia)
         except Exception as e:
             logging.error(f"Error Nutridor: {e}")
 
         logging.info(f"🏁 --- FIN SECUENCIA PARA: {nombre} ---")
 
 
+    def ejecutar_campana_con_lease(self, campana, cupo_ia):
+        """ Envoltorio para el pool: gobernador + lease + plazo alrededor de la secuencia. """
+        camp_id, nombre = campana[0], campana[1]
+
+        # 1. GOBERNADOR: ¿Hay cupo de IA Global?
+        if not self.verificar_salud_global_ia():
+            logging.warning(f"🛑 GOBERNADOR: {nombre} queda para el próximo ciclo por falta de IA.")
+            return False
+
+        # 2. LEASE: si otra instancia la está trabajando, la saltamos
+        lease = self.tomar_lease(camp_id, PLAZO_CAMPANA_SEGUNDOS + MARGEN_LEASE_SEGUNDOS)
+        if not lease:
+            logging.info(f"🔐 {nombre} ya está en manos de otro Orquestador. Saltando.")
+            return False
+
+        try:
+            plazo = time.monotonic() + PLAZO_CAMPANA_SEGUNDOS
+            self.ejecutar_campana_secuencial(campana, plazo=plazo, cupo_ia=cupo_ia, lease=lease)
+            return True
+        finally:
+            self.liberar_lease(camp_id, lease)
+
     def coordinar_operaciones_diarias(self):
         """
-        CONTROLADOR DE TRÁFICO: Distribuye las campañas en el tiempo disponible.
+        CONTROLADOR DE TRÁFICO: Reparte las campañas entre un pool de hilos.
+        La vuelta dura ~ (campañas / ORQUESTADOR_HILOS) * duración de una campaña.
         """
-        conn = self.conectar_db()
-        cur = conn.cursor()
-        
         try:
             # A. Obtener Campañas
-            cur.execute("""
-                SELECT c.id, c.campaign_name, c.product_description, c.target_audience, 
-                       c.product_type, c.daily_prospects_limit, c.geo_location
-                FROM campaigns c
-                JOIN clients cl ON c.client_id = cl.id
-                WHERE c.status = 'active' AND cl.is_active = TRUE
-            """)
-            campanas = cur.fetchall()
+            campanas = self.obtener_campanas_activas()
             
             if not campanas:
                 logging.info("💤 No hay campañas activas.")
@@ -255,29 +425,119 @@ class OrquestadorSupremo:
             # B. Cálculos de Tiempo (Balanceo de Carga)
             total_campanas = len(campanas)
             
-            logging.info(f"🚦 CONTROLADOR DE TRÁFICO: {total_campanas} campañas en cola.")
+            hilos = max(1, min(HILOS_ORQUESTADOR, total_campanas))
+            cupo_ia = self.cupo_ia_por_campana(total_campanas)
+            
+            logging.info(f"🚦 CONTROLADOR DE TRÁFICO: {total_campanas} campañas en cola, {hilos} en paralelo (cupo IA por campaña: {cupo_ia}).")
 
-            for campana in campanas:
-                # 1. GOBERNADOR: ¿Hay cupo de IA Global?
-                if not self.verificar_salud_global_ia():
-                    logging.warning("🛑 GOBERNADOR: Frenando operaciones por falta de IA. Reintentando más tarde.")
-                    break 
+            # Sin respiros fijos: el ritmo de IA lo marca el limitador RPM/TPM de ai_manager
+            completadas = 0
+            with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="campana") as pool:
+                futuros = {pool.submit(self.ejecutar_campana_con_lease, c, cupo_ia): c for c in campanas}
+                for futuro in as_completed(futuros):
+                    try:
+                        if futuro.result(): completadas += 1
+                    except Exception as e:
+                        logging.error(f"Error en campaña {futuros[futuro][1]}: {e}")
 
-                # 2. EJECUCIÓN SECUENCIAL
-                self.ejecutar_campana_secuencial(campana)
-                
-                # 3. Respiro entre campañas
-                tiempo_respiro = 30 
-                if total_campanas > 10: tiempo_respiro = 10 
-                
-                logging.info(f"⏳ Respirando {tiempo_respiro}s antes de la siguiente campaña...")
-                time.sleep(tiempo_respiro)
+            logging.info(f"🏁 Ciclo de campañas: {completadas}/{total_campanas} ejecutadas.")
 
         except Exception as e:
             logging.error(f"Error en coordinación operaciones: {e}")
+
+    # ==============================================================================
+    # 👂 MÓDULO 3B: DESPACHO POR EVENTOS (LISTEN/NOTIFY)
+    # ==============================================================================
+
+    def iniciar_escucha(self):
+        if not ESCUCHAR_EVENTOS: return
+        from escucha_eventos import EscuchaEventos
+        if not self.pipeline:
+            self._despacho = ThreadPoolExecutor(max_workers=HILOS_ORQUESTADOR, thread_name_prefix="evento")
+        self.escucha = EscuchaEventos(self.despachar_evento).iniciar()
+
+    def detener_escucha(self):
+        self._apagando.set()
+        if self.escucha: self.escucha.detener()
+        if self._despacho: self._despacho.shutdown(wait=False)
+
+    def despachar_evento(self, evento):
+        """ Traduce un aviso de la DB a la etapa (y campaña) que hay que mover YA. """
+        tabla = evento.get("tabla")
+        if tabla == "*":
+            # Reconexión: pudimos perder avisos. En pipeline despertamos todo;
+            # en modo ciclos lo cubre el barrido periódico.
+            if self.pipeline:
+                for nombre in self.pipeline.etapas: self.pipeline.despertar(nombre)
+            return
+
+        etapa = "cazador" if tabla == "campaigns" else ETAPA_POR_ESTADO.get(evento.get("status"))
+        camp_id = evento.get("campaign_id")
+        if not etapa or not camp_id: return
+
+        if self.pipeline:
+            self.pipeline.despertar(etapa)
+        elif self._despacho:
+            self._programar_etapa(etapa, camp_id)
+
+    def _programar_etapa(self, etapa, camp_id):
+        clave = (etapa, camp_id)
+        with self._lock_despacho:
+            if clave in self._en_curso:
+                # Ya corre: se repite UNA vez al terminar (los avisos se funden)
+                self._repetir.add(clave)
+                return
+            self._en_curso.add(clave)
+        try:
+            self._despacho.submit(self._correr_etapa, etapa, camp_id)
+        except RuntimeError:
+            # Executor apagado (saliendo)
+            with self._lock_despacho: self._en_curso.discard(clave)
+
+    def _correr_etapa(self, etapa, camp_id):
+        clave = (etapa, camp_id)
+        try:
+            while not self._apagando.is_set():
+                inicio = time.monotonic()
+                try:
+                    self.ejecutar_etapa_campana(etapa, camp_id)
+                except Exception as e:
+                    logging.error(f"Error en etapa {etapa} (campaña {camp_id}) por evento: {e}")
+                with self._lock_despacho:
+                    if clave not in self._repetir:
+                        return
+                    self._repetir.discard(clave)
+                restante = INTERVALO_MINIMO_EVENTO - (time.monotonic() - inicio)
+                if restante > 0: self._apagando.wait(restante)
         finally:
-            cur.close()
-            conn.close()
+            with self._lock_despacho: self._en_curso.discard(clave)
+
+    def ejecutar_etapa_campana(self, etapa, camp_id):
+        """ Corre UNA etapa para UNA campaña (modo ciclos, disparada por un aviso). """
+        logging.info(f"⚡ Aviso en tiempo real: etapa '{etapa}' para campaña {camp_id}")
+        if etapa == "espia":
+            ejecutar_espia(camp_id)
+            return
+        if etapa == "cazador":
+            # El Cazador no reclama por fila: se protege con el lease de la campaña.
+            # Si está tomado, la campaña ya está en plena secuencia y la cubre.
+            lease = self.tomar_lease(camp_id, PLAZO_CAMPANA_SEGUNDOS)
+            if not lease:
+                logging.info(f"🔐 Campaña {camp_id} ocupada; el aviso lo cubre su secuencia en curso.")
+                return
+            try:
+                campana = next((c for c in self.obtener_campanas_activas() if str(c[0]) == str(camp_id)), None)
+                if campana: self.cazar_si_falta(campana)
+            finally:
+                self.liberar_lease(camp_id, lease)
+            return
+        if not self.verificar_salud_global_ia(): return
+        if etapa == "analista":
+            trabajar_analista_concurrente(campana_id=camp_id)
+        elif etapa == "persuasor":
+            trabajar_persuasor(campana_id=camp_id)
+        elif etapa == "nutridor":
+            self.nutridor.ejecutar_ciclo_seguimiento(campana_id=camp_id)
 
     # ==============================================================================
     # 📨 MÓDULO 4: REPORTES (INTACTO)
@@ -315,47 +575,87 @@ class OrquestadorSupremo:
     # 🏁 BUCLE PRINCIPAL (NUEVO RITMO)
     # ==============================================================================
 
+    def iniciar_pipeline(self):
+        """
+        MODO PIPELINE: las etapas corren solas en sus hilos; este hilo solo
+        se ocupa de finanzas y reportes.
+        """
+        from pipeline import PipelineEtapas
+        logging.info(">>> 🏭 ORQUESTADOR SUPREMO (MODO PIPELINE) 🏭 <<<")
+
+        self.pipeline = PipelineEtapas(self)
+        self.pipeline.iniciar()
+        self.iniciar_escucha()
+        ultima_revision_reportes = datetime.now() - timedelta(days=1)
+        try:
+            while True:
+                try:
+                    self.gestionar_finanzas_clientes()
+                    if datetime.now() > ultima_revision_reportes + timedelta(hours=24):
+                        self.generar_reporte_diario()
+                        ultima_revision_reportes = datetime.now()
+                    logging.info(f"📈 Etapas: {json.dumps(self.pipeline.estado())}")
+                except Exception as e:
+                    logging.critical(f"🔥 ERROR CATASTRÓFICO: {e}")
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            logging.info("🛑 Deteniendo sistema...")
+        finally:
+            self.detener_escucha()
+            self.pipeline.detener()
+
     def iniciar_turno(self):
-        logging.info(">>> 🤖 ORQUESTADOR SUPREMO (MODO SECUENCIAL 24H) 🤖 <<<")
+        if MODO_ORQUESTADOR == "pipeline":
+            return self.iniciar_pipeline()
+
+        logging.info(">>> 🤖 ORQUESTADOR SUPREMO (MODO PARALELO 24H) 🤖 <<<")
         
+        # Los avisos mueven cada etapa en segundos; el ciclo horario queda como barrido de respaldo
+        self.iniciar_escucha()
         ultima_revision_reportes = datetime.now() - timedelta(days=1)
         
-        while True:
-            try:
-                inicio_ciclo = time.time()
-                
-                # 1. Finanzas (Siempre primero)
-                self.gestionar_finanzas_clientes()
-                
-                # 2. Operaciones Tácticas (La Cadena de Montaje)
-                self.coordinar_operaciones_diarias()
-                
-                # 3. Reportes
-                if datetime.now() > ultima_revision_reportes + timedelta(hours=24):
-                    self.generar_reporte_diario()
-                    ultima_revision_reportes = datetime.now()
-
-                # 4. DESCANSO DEL CICLO MAYOR
-                duracion_proceso = time.time() - inicio_ciclo
-                
-                tiempo_base_descanso = 3600 # 1 hora
-                
-                if duracion_proceso > 1800:
-                    tiempo_dormir = 600
-                else:
-                    tiempo_dormir = tiempo_base_descanso - duracion_proceso
-                    if tiempo_dormir < 600: tiempo_dormir = 600 
-
-                logging.info(f"💤 Vuelta completa en {duracion_proceso/60:.1f} mins. Durmiendo {tiempo_dormir/60:.1f} mins...")
-                time.sleep(tiempo_dormir) 
-
-            except KeyboardInterrupt:
-                logging.info("🛑 Deteniendo sistema...")
-                break
-            except Exception as e:
-                logging.critical(f"🔥 ERROR CATASTRÓFICO: {e}")
-                time.sleep(60)
+        try:
+            while True:
+                try:
+                    inicio_ciclo = time.time()
+                    
+                    # 1. Finanzas (Siempre primero)
+                    self.gestionar_finanzas_clientes()
+                    
+                    # 2. Operaciones Tácticas (La Cadena de Montaje)
+                    self.coordinar_operaciones_diarias()
+                    
+                    # 3. Reportes
+                    if datetime.now() > ultima_revision_reportes + timedelta(hours=24):
+                        self.generar_reporte_diario()
+                        ultima_revision_reportes = datetime.now()
+
+                    # 4. DESCANSO DEL CICLO MAYOR
+                    duracion_proceso = time.time() - inicio_ciclo
+                    
+                    tiempo_base_descanso = 3600 # 1 hora
+                    
+                    if duracion_proceso > 1800:
+                        tiempo_dormir = 600
+                    else:
+                        tiempo_dormir = tiempo_base_descanso - duracion_proceso
+                        if tiempo_dormir < 600: tiempo_dormir = 600 
+
+                    logging.info(f"💤 Vuelta completa en {duracion_proceso/60:.1f} mins. Próximo barrido en {tiempo_dormir/60:.1f} mins (los avisos siguen atendiéndose)...")
+                    self._apagando.wait(tiempo_dormir)
+
+                except KeyboardInterrupt:
+                    logging.info("🛑 Deteniendo sistema...")
+                    break
+                except Exception as e:
+                    logging.critical(f"🔥 ERROR CATASTRÓFICO: {e}")
+                    time.sleep(60)
+        finally:
+            self.detener_escucha()
 
 if __name__ == "__main__":
+    # SIGTERM (deploy/apagado de la VM) -> salida limpia para que corran los atexit
+    # (ej: ai_manager vuelca el uso de IA acumulado en memoria)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
     ceo = OrquestadorSupremo()
     ceo.iniciar_turno()
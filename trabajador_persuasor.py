@@ -1,8 +1,7 @@
 import os
-import time
 import json
 import logging
-import psycopg2
+import conexion_db
 from psycopg2.extras import Json
 import google.generativeai as genai
 from dotenv import load_dotenv
@@ -21,15 +20,17 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - PERSUASOR - %(leve
 DATABASE_URL = os.environ.get("DATABASE_URL")
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
 
-# --- CEREBRO COPYWRITER ---
+# Prospectos por turno: van en paralelo a la IA (brain.run_many), no uno a uno
+TAMANO_LOTE = int(os.environ.get("PERSUASOR_LOTE", 20))
+# Un 'persuadiendo' más viejo que esto se considera abandonado y se vuelve a reclamar
+MINUTOS_RECLAMO = 15
+# Reclamos sin salir de la cola antes de rendirse con un prospecto ('contacto_fallido')
+MAX_INTENTOS = int(os.environ.get("PERSUASOR_MAX_INTENTOS", 3))
 
-def generar_estrategia_prenido(prospecto, campana, analisis):
-    """
-    Genera el contenido de las DOS CAJAS (Valor + Pitch) usando 
-    psicología de ventas adaptada al dolor específico.
-    """
-    if not brain: return None
+# --- CEREBRO COPYWRITER ---
 
+def construir_prompt_prenido(prospecto, campana, analisis):
+    """ Arma el prompt del Pre-Nido (DOS CAJAS: Valor + Pitch) para un prospecto. """
     # Extraemos datos clave
     nombre_cliente = prospecto.get('business_name', 'Emprendedor')
     rubro_cliente = analisis.get('industry', 'su sector')
@@ -43,13 +44,7 @@ def generar_estrategia_prenido(prospecto, campana, analisis):
     mision = campana.get('mission_statement', 'Ayudar a empresas')
     tono = campana.get('tone_voice', 'Profesional y Empático')
 
-    model_id = None # Para reportar fallos
-
-    try:
-        # 1. PEDIMOS CEREBRO INTELIGENTE
-        model, model_id = brain.get_optimal_model(task_type="inteligencia")
-        
-        prompt = f"""
+    return f"""
         ACTÚA COMO: Un Consultor de Negocios Senior y Copywriter de Respuesta Directa.
         TU OBJETIVO: Escribir un mensaje de "Pre-Nido" para {nombre_cliente} ({rubro_cliente}).
         
@@ -88,17 +83,35 @@ def generar_estrategia_prenido(prospecto, campana, analisis):
             "estrategia_usada": "Nombre de la estrategia psicológica aplicada"
         }}
         """
+
+def interpretar_respuesta_ia(texto):
+    texto_limpio = texto.replace("```json", "").replace("```", "").strip()
+    return json.loads(texto_limpio)
+
+def generar_estrategia_prenido(prospecto, campana, analisis):
+    """
+    Genera el contenido de las DOS CAJAS (Valor + Pitch) usando 
+    psicología de ventas adaptada al dolor específico.
+    """
+    if not brain: return None
+
+    model_id = None # Para reportar fallos
+
+    try:
+        # 1. PEDIMOS CEREBRO INTELIGENTE
+        model, model_id = brain.get_optimal_model(task_type="inteligencia")
+        
+        prompt = construir_prompt_prenido(prospecto, campana, analisis)
         
         respuesta = model.generate_content(prompt)
         brain.register_usage(model_id)
         
-        texto_limpio = respuesta.text.replace("```json", "").replace("```", "").strip()
-        return json.loads(texto_limpio)
+        return interpretar_respuesta_ia(respuesta.text)
 
     except Exception as e:
         logging.error(f"⚠️ Error generando copy IA: {e}")
         if model_id and "429" in str(e):
-            brain.report_failure(model_id)
+            brain.report_failure(model_id, str(e))
         return None
 
 # --- SIMULACIÓN DE ENVÍO (INTACTO) ---
@@ -129,44 +142,101 @@ def enviar_mensaje_multicanal(prospecto, contenido):
 
 # --- CICLO DE TRABAJO (MODO SECUENCIAL) ---
 
-def trabajar_persuasor():
+# Consultas calientes del reclamo (migrador.py verificar las pasa por EXPLAIN)
+SQL_RENDIR_AGOTADOS = """
+    UPDATE prospects
+    SET status = 'contacto_fallido', updated_at = NOW()
+    WHERE (%s IS NULL OR campaign_id = %s)
+    AND status = 'persuadiendo' AND updated_at < NOW() - %s * INTERVAL '1 minute'
+    AND intentos_persuasion >= %s
+"""
+
+SQL_RECLAMAR_LOTE = """
+    UPDATE prospects p
+    SET status = 'persuadiendo', updated_at = NOW(),
+        intentos_persuasion = p.intentos_persuasion + 1
+    FROM (
+        SELECT id FROM prospects
+        WHERE (%s IS NULL OR campaign_id = %s)
+        AND (
+            status = 'analizado_exitoso'
+            OR (status = 'persuadiendo' AND updated_at < NOW() - %s * INTERVAL '1 minute')
+        )
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ) sel
+    WHERE p.id = sel.id
+    RETURNING p.id
+"""
+
+def reclamar_lote(cur, tamano_lote, campana_id=None):
+    """
+    Toma prospectos 'analizado_exitoso' marcándolos 'persuadiendo' (FOR UPDATE SKIP LOCKED):
+    dos persuasores en paralelo jamás escriben dos veces al mismo prospecto.
+    También recupera los que quedaron colgados en 'persuadiendo' (proceso caído);
+    los colgados que ya gastaron MAX_INTENTOS pasan a 'contacto_fallido'.
+    """
+    cur.execute(SQL_RENDIR_AGOTADOS, (campana_id, campana_id, MINUTOS_RECLAMO, MAX_INTENTOS))
+    if cur.rowcount:
+        logging.warning(f"🧯 {cur.rowcount} prospectos agotaron {MAX_INTENTOS} intentos de persuasión: 'contacto_fallido'.")
+
+    cur.execute(SQL_RECLAMAR_LOTE, (campana_id, campana_id, MINUTOS_RECLAMO, tamano_lote))
+    ids = [r[0] for r in cur.fetchall()]
+    if not ids: return []
+
+    cur.execute("""
+        SELECT 
+            p.id, p.business_name, p.captured_email, p.social_profiles, p.pain_points,
+            c.id as campaign_id, c.product_description, c.mission_statement, c.tone_voice
+        FROM prospects p
+        JOIN campaigns c ON p.campaign_id = c.id
+        WHERE p.id = ANY(%s)
+    """, (ids,))
+    return cur.fetchall()
+
+def trabajar_persuasor(campana_id=None, tamano_lote=TAMANO_LOTE):
     # Eliminado el while True para que funcione en la cadena del Orquestador
+    # Devuelve cuántos prospectos SALIERON de la cola ('persuadido' / 'contacto_fallido'):
+    # un lote que falla entero devuelve 0 y la Etapa del pipeline hace su pausa en vez
+    # de volver a reclamar en caliente lo mismo que acabamos de devolver a la cola
     logging.info(f"🎩 PERSUASOR ACTIVO (Modo Secuencial - Brain Rotativo)")
+    if not brain: return 0
     
     conn = None
+    pendientes = []
     try:
-        conn = psycopg2.connect(DATABASE_URL)
+        conn = conexion_db.tomar()
         cur = conn.cursor()
 
-        # 1. BUSCAR PROSPECTOS 'analizado_exitoso'
-        query = """
-            SELECT 
-                p.id, p.business_name, p.captured_email, p.social_profiles, p.pain_points,
-                c.id as campaign_id, c.product_description, c.mission_statement, c.tone_voice
-            FROM prospects p
-            JOIN campaigns c ON p.campaign_id = c.id
-            WHERE p.status = 'analizado_exitoso'
-            LIMIT 3;
-        """
-        cur.execute(query)
-        lote = cur.fetchall()
+        # 1. RECLAMAR PROSPECTOS 'analizado_exitoso'
+        lote = reclamar_lote(cur, tamano_lote, campana_id)
+        conn.commit()
 
         if not lote:
             logging.info("💤 Sin prospectos calificados en este turno.")
-            return # Regresa el control al Orquestador
+            return 0 # Regresa el control al Orquestador
 
         logging.info(f"💎 Procesando {len(lote)} prospectos calificados...")
+        # Todo lo que no termine en 'persuadido'/'contacto_fallido' vuelve a la cola
+        pendientes = [fila[0] for fila in lote]
 
+        # 2. GENERAR TODOS LOS "PRE-NIDOS" A LA VEZ (un solo viaje de latencia de IA)
+        trabajos = []
         for fila in lote:
             pid, p_nombre, p_email, p_social, p_dolores, cid, c_prod, c_mision, c_tono = fila
-            
             prospecto_data = {"business_name": p_nombre, "captured_email": p_email, "social_profiles": p_social}
             campana_data = {"product_description": c_prod, "mission_statement": c_mision, "tone_voice": c_tono}
             analisis_data = p_dolores if p_dolores else {}
+            trabajos.append((pid, p_nombre, prospecto_data, construir_prompt_prenido(prospecto_data, campana_data, analisis_data)))
+
+        resultados = brain.run_many([t[3] for t in trabajos], task_type="inteligencia")
 
-            # 2. GENERAR EL "PRE-NIDO"
+        for (pid, p_nombre, prospecto_data, _), resultado in zip(trabajos, resultados):
             try:
-                contenido_prenido = generar_estrategia_prenido(prospecto_data, campana_data, analisis_data)
+                if resultado["error"]:
+                    logging.error(f"⚠️ Error generando copy IA para {p_nombre}: {resultado['error']}")
+                    continue
+                contenido_prenido = interpretar_respuesta_ia(resultado["texto"])
                 
                 if contenido_prenido:
                     # 3. ENVIAR MENSAJE
@@ -186,20 +256,46 @@ def trabajar_persuasor():
                     else:
                         cur.execute("UPDATE prospects SET status = 'contacto_fallido' WHERE id = %s", (pid,))
                         conn.commit()
+                    pendientes.remove(pid)
                 else:
                     logging.warning(f"⚠️ IA devolvió vacío para {p_nombre}")
 
             except Exception as e_ia:
                 logging.error(f"Error en {p_nombre}: {e_ia}")
-
-            time.sleep(3) # Pausa dramática entre correos
+                conn.rollback()
+            # (Sin pausas fijas: el ritmo lo marca el limitador RPM/TPM de ai_manager)
 
         cur.close()
+        return len(trabajos) - len(pendientes)
 
     except Exception as e:
         logging.critical(f"🔥 Error Crítico Persuasor: {e}")
+        return 0
     finally:
-        if conn: conn.close()
+        if conn:
+            devolver_a_la_cola(conn, pendientes)
+            conn.close()
+
+def devolver_a_la_cola(conn, ids):
+    """
+    Los reclamados que fallaron vuelven a 'analizado_exitoso' para el próximo turno;
+    agotados los MAX_INTENTOS, quedan en 'contacto_fallido'.
+    """
+    if not ids: return
+    try:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE prospects
+                SET status = CASE WHEN intentos_persuasion >= %s THEN 'contacto_fallido'
+                                  ELSE 'analizado_exitoso' END,
+                    updated_at = NOW()
+                WHERE id = ANY(%s) AND status = 'persuadiendo'
+            """, (MAX_INTENTOS, ids))
+        conn.commit()
+    except Exception as e:
+        # No es grave: el reclamo vence solo a los MINUTOS_RECLAMO
+        logging.error(f"⚠️ No se pudieron devolver {len(ids)} prospectos a la cola: {e}")
 
 if __name__ == "__main__":
     trabajar_persuasor()